@@ -0,0 +1,279 @@
+"""
+Benchmarks of the acquisition hot paths: monitor loops, scans and camera frames.
+"""
+import time
+import numpy as np
+
+from .common import simulated_ad2_operator, blink_operator, CallTimer, run_monitor
+
+
+class AD2Monitor:
+    """Samples per second acquired by the _monitor_loop of the Analog Discovery 2 Operator."""
+    timeout = 60
+
+    def setup(self):
+        self.opr = simulated_ad2_operator()
+        self.opr.properties['monitor']['time_step'] = 0  # acquire as fast as possible
+        self.reads = CallTimer(self.opr.instrument, 'read_analog')
+
+    def track_monitor_samples_per_s(self):
+        duration = run_monitor(self.opr, 2)
+        return self.reads.calls / duration
+    track_monitor_samples_per_s.unit = 'samples/s'
+
+
+class BlinkMonitor:
+    """Samples per second acquired by the _monitor_loop of the BlinkOperator."""
+    timeout = 60
+
+    def setup(self):
+        self.opr = blink_operator()
+        self.opr.properties['monitor']['time_step'] = 0  # acquire as fast as possible
+        self.reads = CallTimer(self.opr.instrument, 'get_status')
+
+    def track_monitor_samples_per_s(self):
+        duration = run_monitor(self.opr, 1)
+        return self.reads.calls / duration
+    track_monitor_samples_per_s.unit = 'samples/s'
+
+
+class AD2Scan:
+    """
+    Scan speed of the Analog Discovery 2 Operator.
+    The per point overhead is the time spent in do_scan that is not spent inside the (simulated) device.
+    """
+    params = [10, 100]
+    param_names = ['points']
+    timeout = 300
+
+    def setup(self, points):
+        self.opr = simulated_ad2_operator(start=0, stop=points - 1, step=1, stabilize_time=0)
+        self.device = CallTimer(self.opr.instrument, 'read_analog', 'write_analog')
+        self.opr.analog_in = self.opr.instrument.read_analog  # the Operator keeps a direct alias to this method
+
+    def time_do_scan(self, points):
+        self.opr.do_scan()
+
+    def track_scan_points_per_s(self, points):
+        t0 = time.perf_counter()
+        self.opr.do_scan()
+        return points / (time.perf_counter() - t0)
+    track_scan_points_per_s.unit = 'points/s'
+
+    def track_per_point_overhead(self, points):
+        self.device.time = 0
+        t0 = time.perf_counter()
+        self.opr.do_scan()
+        return (time.perf_counter() - t0 - self.device.time) / points * 1e6
+    track_per_point_overhead.unit = 'us/point'
+
+
+class AD2ScanVirtualClock:
+    """
+    Scan speed of the Analog Discovery 2 Operator with the simulated device running on a VirtualClock.
+    This measures the overhead of the scan loop itself, because no time is spent waiting.
+    """
+    params = [1000, 10000]
+    param_names = ['points']
+    timeout = 300
+
+    def setup(self, points):
+        from labphew.core.tools.clock import VirtualClock
+        self.clock = VirtualClock()
+        self.opr = simulated_ad2_operator(clock=self.clock, start=0, stop=5, step=5 / (points - 1), stabilize_time=0.001)
+
+    def track_scan_points_per_s(self, points):
+        t0 = time.perf_counter()
+        self.opr.do_scan()
+        return points / (time.perf_counter() - t0)
+    track_scan_points_per_s.unit = 'points/s'
+
+    def track_virtual_scan_duration(self, points):
+        v0 = self.clock.time()
+        self.opr.do_scan()
+        return self.clock.time() - v0
+    track_virtual_scan_duration.unit = 's'
+
+
+class AD2ScanRoundTrips:
+    """
+    Analog out round trips to the (simulated) device per scan point of the Analog Discovery 2 Operator.
+    The saved round trips are compared to writing every point with nodeOffsetSet() and configure(). With auto configure
+    (the default) the running channel doesn't need configure() for a new offset.
+    The 'clipped' scan sweeps beyond the limits of the analog out channel, which results in repeated values.
+    """
+    params = ['sweep', 'clipped']
+    param_names = ['scan']
+
+    def setup(self, scan):
+        from labphew.core.tools.clock import VirtualClock
+        start, stop = (0, 5) if scan == 'sweep' else (-10, 10)
+        self.opr = simulated_ad2_operator(clock=VirtualClock(), start=start, stop=stop, step=0.05, stabilize_time=0)
+        self.writes = CallTimer(self.opr, 'analog_out')
+        self.round_trips = CallTimer(self.opr.instrument.ao, 'nodeOffsetSet', 'configure')
+
+    def track_round_trips_per_point(self, scan):
+        self.opr.do_scan()
+        return self.round_trips.calls / self.writes.calls
+    track_round_trips_per_point.unit = 'round trips/point'
+
+    def track_round_trips_saved(self, scan):
+        self.opr.do_scan()
+        return 2 * self.writes.calls - self.round_trips.calls
+    track_round_trips_saved.unit = 'round trips'
+
+
+class AD2AdaptiveScan:
+    """
+    Adaptive versus uniform scan of a device with a sharp step in its response (on a VirtualClock).
+    Both use the same smallest step, the adaptive scan should need only a fraction of the points.
+    """
+    params = ['uniform', 'adaptive']
+    param_names = ['mode']
+    timeout = 300
+
+    def setup(self, mode):
+        from labphew.core.tools.clock import VirtualClock
+        from labphew.controller.digilent.simulation import DeviceUnderTest
+        dut = DeviceUnderTest(coupling=[[0, 0], [0, 1]], transfer=[None, lambda x: np.tanh((x - 2.5) * 20)])
+        self.opr = simulated_ad2_operator(clock=VirtualClock(), dut=dut, start=0, stop=5, step=0.01, stabilize_time=0,
+                                          adaptive=mode == 'adaptive', tolerance=0.02, max_points=1000, max_time=None)
+
+    def track_scan_points(self, mode):
+        x, y = self.opr.do_scan()
+        return len(x)
+    track_scan_points.unit = 'points'
+
+    def track_largest_step_in_response(self, mode):
+        x, y = self.opr.do_scan()
+        return float(np.abs(np.diff(y)).max())
+    track_largest_step_in_response.unit = 'V'
+
+
+class AD2ProfileSwitch:
+    """
+    Switching between a fast monitor and a high-averaging scan acquisition setting of the (simulated) Analog Discovery 2:
+    with preset_basic_analog() (full reset) versus apply_profile() (only the differences).
+    """
+    def setup(self):
+        from labphew.controller.digilent.waveforms import SimulatedDfwController
+        self.daq = SimulatedDfwController()
+        self.daq.register_profile('monitor', n=80, freq=10000)
+        self.daq.register_profile('scan', n=2000, freq=100000, return_std=True)
+        ai_calls = CallTimer(self.daq.ai, 'reset', 'bufferSizeSet', 'frequencySet', 'channelRangeSet', 'configure')
+        ao_calls = CallTimer(self.daq.ao, 'reset', 'nodeFunctionSet', 'configure')
+        self.device_calls = lambda: ai_calls.calls + ao_calls.calls
+
+    def _switch_preset(self):
+        self.daq.preset_basic_analog(n=2000, freq=100000, return_std=True)
+        self.daq.preset_basic_analog(n=80, freq=10000)
+
+    def _switch_profile(self):
+        self.daq.apply_profile('scan')
+        self.daq.apply_profile('monitor')
+
+    def time_switch_preset(self):
+        self._switch_preset()
+
+    def time_switch_profile(self):
+        self._switch_profile()
+
+    def track_device_calls_preset(self):
+        calls = self.device_calls()
+        self._switch_preset()
+        return (self.device_calls() - calls) / 2
+    track_device_calls_preset.unit = 'calls/switch'
+
+    def track_device_calls_profile(self):
+        self.daq.apply_profile('monitor')
+        calls = self.device_calls()
+        self._switch_profile()
+        return (self.device_calls() - calls) / 2
+    track_device_calls_profile.unit = 'calls/switch'
+
+
+class AD2Feedback:
+    """
+    Timing of the feedback loop (PID) of the Analog Discovery 2 Operator with a simulated device: the loop rate and the
+    latency from the deadline of an iteration until the output is written.
+    """
+    timeout = 60
+
+    def setup(self):
+        self.opr = simulated_ad2_operator()
+        self.opr.properties['pid']['period'] = 0.003
+        self.opr.start_feedback()
+        time.sleep(1)
+        self.stats = self.opr.stop_feedback()
+
+    def track_loop_rate(self):
+        return self.stats['rate']
+    track_loop_rate.unit = 'Hz'
+
+    def track_latency_median(self):
+        return self.stats['latency_median'] * 1e3
+    track_latency_median.unit = 'ms'
+
+    def track_latency_p99(self):
+        return self.stats['latency_p99'] * 1e3
+    track_latency_p99.unit = 'ms'
+
+
+class BlinkScan:
+    """Scan speed of the BlinkOperator (without waiting between points)."""
+    params = [100, 1000]
+    param_names = ['points']
+    timeout = 120
+
+    def setup(self, points):
+        self.opr = blink_operator(number_of_points=points, time_between_points=0)
+
+    def track_scan_points_per_s(self, points):
+        t0 = time.perf_counter()
+        self.opr.do_scan()
+        return points / (time.perf_counter() - t0)
+    track_scan_points_per_s.unit = 'points/s'
+
+
+class SimulatedCameraFrames:
+    """Frame rate of the simulated camera."""
+    params = [256, 1024]
+    param_names = ['size']
+
+    def setup(self, size):
+        from labphew.controller.simulated_camera import SimulatedCamera
+        self.cam = SimulatedCamera(width=size, height=size)
+        self.cam.initialize()
+
+    def track_frames_per_s(self, size):
+        n = 20
+        t0 = time.perf_counter()
+        for i in range(n):
+            self.cam.trigger_camera()
+            self.cam.read_camera()
+        return n / (time.perf_counter() - t0)
+    track_frames_per_s.unit = 'frames/s'
+
+    def peakmem_read_camera(self, size):
+        self.cam.trigger_camera()
+        self.cam.read_camera()
+
+
+class SignalSimulatorThroughput:
+    """Samples per second (per channel) generated by the vectorized simulator of the Analog Discovery 2."""
+    params = [8192, 2**20]
+    param_names = ['block_size']
+
+    def setup(self, block_size):
+        from labphew.controller.digilent.simulation import SignalSimulator, DeviceUnderTest
+        self.sim = SignalSimulator(DeviceUnderTest(bandwidth=[1e5, None], noise_density=[1e-6, 1e-6]), frequency=1e8)
+        self.sim.set_ao(0, function=SignalSimulator.SINE, amplitude=1.0, frequency=1e4)
+        self.out = np.empty((2, block_size))
+
+    def track_samples_per_s(self, block_size):
+        n = max(1, 2**22 // block_size)
+        t0 = time.perf_counter()
+        for i in range(n):
+            self.sim.acquire(block_size, out=self.out)
+        return n * block_size / (time.perf_counter() - t0)
+    track_samples_per_s.unit = 'samples/s'
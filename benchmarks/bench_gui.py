@@ -0,0 +1,150 @@
+"""
+Benchmarks of the refresh rate of the Analog Discovery 2 gui windows.
+They run with the Qt "offscreen" platform so no display is required.
+"""
+import time
+import numpy as np
+
+from .common import simulated_ad2_operator, qt_application
+
+
+class MonitorWindowRefresh:
+    """Refresh rate of MonitorWindow.update_monitor() with new data for every refresh."""
+    params = [100, 1000, 1000000]
+    param_names = ['plot_points']
+
+    def setup(self, plot_points):
+        self.app = qt_application()
+        from labphew.view.analog_discovery_2_view import MonitorWindow
+        self.opr = simulated_ad2_operator()
+        self.opr.properties['monitor']['plot_points'] = plot_points
+        self.gui = MonitorWindow(self.opr)
+        self.gui.show()
+        self.opr.analog_monitor_time = np.arange(plot_points) * 0.01
+        self.opr.analog_monitor_1 = np.random.normal(size=plot_points)
+        self.opr.analog_monitor_2 = np.random.normal(size=plot_points)
+
+    def teardown(self, plot_points):
+        self.gui.monitor_timer.stop()
+        self.gui.hide()
+
+    def track_refresh_per_s(self, plot_points):
+        n = 100
+        t0 = time.perf_counter()
+        for i in range(n):
+            self.opr._new_monitor_data = True
+            self.gui.update_monitor()
+            self.app.processEvents()
+        return n / (time.perf_counter() - t0)
+    track_refresh_per_s.unit = 'refresh/s'
+
+
+class ScanWindowRefresh:
+    """Refresh rate of ScanWindow.update_scan() with new data for every refresh."""
+    params = [100, 10000, 1000000]
+    param_names = ['points']
+
+    def setup(self, points):
+        self.app = qt_application()
+        from labphew.view.analog_discovery_2_view import ScanWindow
+        self.opr = simulated_ad2_operator()
+        self.gui = ScanWindow(self.opr)
+        self.gui.show()
+        self.opr.scan_voltages = list(np.linspace(0, 5, points))
+        self.opr.measured_voltages = list(np.random.normal(size=points))
+
+    def teardown(self, points):
+        self.gui.scan_timer.stop()
+        self.gui.hide()
+
+    def track_refresh_per_s(self, points):
+        n = 100
+        t0 = time.perf_counter()
+        for i in range(n):
+            self.opr._new_scan_data = True
+            self.gui.update_scan()
+            self.app.processEvents()
+        return n / (time.perf_counter() - t0)
+    track_refresh_per_s.unit = 'refresh/s'
+
+
+class ScopeWindowRefresh:
+    """
+    Refresh rate of ScopeWindow.update_monitor() (persistence images and last frame), and the rate at which frames can
+    be added to the persistence histograms.
+    """
+    params = [1000, 10000]
+    param_names = ['frame_size']
+
+    def setup(self, frame_size):
+        self.app = qt_application()
+        from labphew.view.analog_discovery_2_view import ScopeWindow
+        from labphew.core.tools.statistics import PersistenceHistogram
+        self.opr = simulated_ad2_operator()
+        self.opr.properties['scope']['frame_size'] = frame_size
+        self.gui = ScopeWindow(self.opr)
+        self.gui.show()
+        self.opr.persistence = [PersistenceHistogram(frame_size, 256, (-2.5, 2.5), 0.999) for ch in range(2)]
+        self.opr.scope_time = np.arange(frame_size) * 1e-6
+        self.frames = np.sin(np.linspace(0, 20, frame_size)) + np.random.normal(scale=0.05, size=(100, 2, frame_size))
+        self.opr.scope_frame = self.frames[0]
+
+    def teardown(self, frame_size):
+        self.gui.monitor_timer.stop()
+        self.gui.hide()
+
+    def track_refresh_per_s(self, frame_size):
+        n = 50
+        t0 = time.perf_counter()
+        for i in range(n):
+            self.opr._new_scope_data = True
+            self.gui.update_monitor()
+            self.app.processEvents()
+        return n / (time.perf_counter() - t0)
+    track_refresh_per_s.unit = 'refresh/s'
+
+    def track_persistence_frames_per_s(self, frame_size):
+        t0 = time.perf_counter()
+        for frame in self.frames:
+            for ch in range(2):
+                self.opr.persistence[ch].add(frame[ch])
+        return len(self.frames) / (time.perf_counter() - t0)
+    track_persistence_frames_per_s.unit = 'frames/s'
+
+
+class MonitorHistoryPan:
+    """
+    Rate at which MonitorWindow.plot_history() redraws while panning over hours of monitor history (recorded at 100Hz).
+    """
+    params = [1, 24]
+    param_names = ['hours']
+
+    def setup(self, hours):
+        self.app = qt_application()
+        from labphew.view.analog_discovery_2_view import MonitorWindow
+        from labphew.core.tools.buffers import TieredHistory
+        self.opr = simulated_ad2_operator()
+        self.gui = MonitorWindow(self.opr)
+        self.gui.show()
+        self.opr.monitor_history = history = TieredHistory(2)
+        block = 360000  # one hour
+        for start in range(0, hours * block, block):
+            t = (start + np.arange(block)) * 0.01
+            history.extend(t, np.column_stack((np.sin(t / 60), np.random.normal(scale=0.1, size=block))))
+        self.duration = hours * 3600
+        self.gui.plot1.getViewBox().disableAutoRange()
+
+    def teardown(self, hours):
+        self.gui.monitor_timer.stop()
+        self.gui.hide()
+
+    def track_pan_per_s(self, hours):
+        n = 50
+        width = self.duration / 4  # a quarter of the history is visible
+        t0 = time.perf_counter()
+        for i in range(n):
+            left = (self.duration - width) * i / n
+            self.gui.plot1.setXRange(left, left + width, padding=0)
+            self.app.processEvents()
+        return n / (time.perf_counter() - t0)
+    track_pan_per_s.unit = 'redraws/s'
@@ -0,0 +1,11 @@
+"""
+Benchmarks of the time it takes to import labphew (in a fresh interpreter).
+"""
+
+
+def timeraw_import_labphew():
+    return "import labphew"
+
+
+def timeraw_import_ad2_model():
+    return "import labphew.model.analog_discovery_2_model"
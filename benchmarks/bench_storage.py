@@ -0,0 +1,192 @@
+"""
+Benchmarks of saving scan data to netCDF files.
+"""
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from .common import simulated_ad2_operator
+
+
+class SaveScan:
+    """Throughput of Operator.save_scan() for scans of different length."""
+    params = [10**3, 10**5, 10**7]
+    param_names = ['points']
+    timeout = 600
+
+    def setup(self, points):
+        self.tempdir = tempfile.mkdtemp()
+        self.opr = simulated_ad2_operator()
+        self.opr.scan_voltages = list(np.linspace(0, 1, points))
+        self.opr.measured_voltages = list(np.random.normal(size=points))
+
+    def teardown(self, points):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def time_save_scan(self, points):
+        self.opr.save_scan(os.path.join(self.tempdir, 'scan.nc'))
+
+    def time_save_scan_cataloged(self, points):
+        self.opr.properties['catalog'] = os.path.join(self.tempdir, 'catalog.sqlite')
+        self.opr.save_scan(os.path.join(self.tempdir, 'scan.nc'))
+        self.opr.properties['catalog'] = None
+
+    def track_save_scan_points_per_s(self, points):
+        import time
+        t0 = time.perf_counter()
+        self.opr.save_scan(os.path.join(self.tempdir, 'scan.nc'))
+        return points / (time.perf_counter() - t0)
+    track_save_scan_points_per_s.unit = 'points/s'
+
+
+class ReadScanRange:
+    """Reading a 1% coordinate range of a saved scan: full load versus lazy open (labphew.data.open_scan)."""
+    params = [10**5, 10**7]
+    param_names = ['points']
+    timeout = 600
+
+    def setup(self, points):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'scan.nc')
+        opr = simulated_ad2_operator()
+        opr.scan_voltages = list(np.linspace(0, 1, points))
+        opr.measured_voltages = list(np.random.normal(size=points))
+        opr.save_scan(self.filename)
+
+    def teardown(self, points):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def time_load_dataset_range(self, points):
+        import xarray as xr
+        xr.load_dataset(self.filename).measured_voltage.sel(scan_voltage=slice(0.5, 0.51)).values
+
+    def time_open_scan_range(self, points):
+        from labphew.data import open_scan
+        with open_scan(self.filename, scan_voltage=(0.5, 0.51)) as dat:
+            dat.measured_voltage.values
+
+    def peakmem_open_scan_range(self, points):
+        self.time_open_scan_range(points)
+
+
+class CatalogFind:
+    """Finding saved scans by their attributes: catalog query versus opening every file."""
+    params = [100, 1000]
+    param_names = ['files']
+    timeout = 600
+
+    def setup(self, files):
+        import xarray as xr
+        from labphew.data.catalog import Catalog
+        self.tempdir = tempfile.mkdtemp()
+        for i in range(files):
+            xr.Dataset(data_vars={'measured_voltage': ('scan_voltage', np.random.normal(size=100))},
+                       attrs={'user': 'X' if i % 2 else 'Y', 'step': 0.001 * (i % 20)}
+                       ).to_netcdf(os.path.join(self.tempdir, f'scan {i}.nc'))
+        self.catalog = Catalog(os.path.join(self.tempdir, 'catalog.sqlite'))
+        self.catalog.scan(self.tempdir, workers=0)
+
+    def teardown(self, files):
+        self.catalog.close()
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def time_open_all_files(self, files):
+        import glob
+        import xarray as xr
+        found = []
+        for filename in glob.glob(os.path.join(self.tempdir, '*.nc')):
+            with xr.open_dataset(filename) as dat:
+                if dat.attrs['user'] == 'X' and dat.attrs['step'] < 0.01:
+                    found.append(filename)
+
+    def time_catalog_find(self, files):
+        self.catalog.find(user='X', step=(None, 0.01))
+
+    def time_catalog_scan_unchanged(self, files):
+        self.catalog.scan(self.tempdir, workers=0)
+
+
+class BatchAnalysis:
+    """labphew.data.batch.map_files() over saved scans: serial, parallel and from the cache."""
+    params = [200]
+    param_names = ['files']
+    timeout = 600
+
+    def setup(self, files):
+        import xarray as xr
+        self.tempdir = tempfile.mkdtemp()
+        self.pattern = os.path.join(self.tempdir, '*.nc')
+        for i in range(files):
+            xr.Dataset(coords={'scan_voltage': np.linspace(0, 5, 10**5)},
+                       data_vars={'measured_voltage': ('scan_voltage', np.random.normal(size=10**5))}
+                       ).to_netcdf(os.path.join(self.tempdir, f'scan {i}.nc'))
+        self.cache = os.path.join(self.tempdir, 'cache')
+        from labphew.data.batch import map_files, peak
+        map_files(peak, self.pattern, workers=0, cache=self.cache)
+
+    def teardown(self, files):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def time_serial(self, files):
+        from labphew.data.batch import map_files, peak
+        map_files(peak, self.pattern, workers=0, cache=None)
+
+    def time_parallel(self, files):
+        from labphew.data.batch import map_files, peak
+        map_files(peak, self.pattern, workers=None, cache=None)
+
+    def time_cached(self, files):
+        from labphew.data.batch import map_files, peak
+        map_files(peak, self.pattern, workers=0, cache=self.cache)
+
+
+class SaveManyScans:
+    """Saving many small scans (Operator.save_scan()): a file per scan versus appending to one container file."""
+    params = [['files', 'container']]
+    param_names = ['mode']
+    timeout = 600
+
+    def setup(self, mode):
+        self.tempdir = tempfile.mkdtemp()
+        self.opr = simulated_ad2_operator()
+        self.opr.scan_voltages = list(np.linspace(0, 1, 100))
+        self.opr.measured_voltages = list(np.random.normal(size=100))
+
+    def teardown(self, mode):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def time_save_500_scans(self, mode):
+        for i in range(500):
+            if mode == 'files':
+                self.opr.save_scan(os.path.join(self.tempdir, f'scan {i}.nc'))
+            else:
+                self.opr.save_scan(os.path.join(self.tempdir, 'scans.nc'), append=True)
+
+    def track_disk_usage(self, mode):
+        self.time_save_500_scans(mode)
+        return sum(entry.stat().st_blocks * 512 for entry in os.scandir(self.tempdir))
+    track_disk_usage.unit = 'bytes'
+
+
+class ReadContainerRun:
+    """Reading one run from a container file of 10000 runs."""
+    timeout = 600
+
+    def setup(self):
+        import xarray as xr
+        from labphew.data.container import ScanContainer
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'scans.nc')
+        with ScanContainer(self.filename, mode='w') as container:
+            for i in range(10000):
+                container.append(xr.Dataset(coords={'scan_voltage': np.linspace(0, 1, 100 + i % 50)},
+                                            data_vars={'measured_voltage': ('scan_voltage', np.ones(100 + i % 50))},
+                                            attrs={'step': 0.01}))
+
+    def teardown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def time_read_run(self):
+        from labphew.data.container import read_run
+        read_run(self.filename, 7654)
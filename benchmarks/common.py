@@ -0,0 +1,102 @@
+"""
+Helpers shared by the benchmarks.
+
+The benchmarks only use simulated devices, so they can run on any computer (note that the Digilent WaveForms runtime
+still needs to be installed, because labphew.controller.digilent.waveforms imports the dwf module).
+"""
+import os
+import logging
+import threading
+import time
+
+import labphew
+
+# labphew sets the logging level to DEBUG, which would make the benchmarks mostly measure printing to the console
+logging.getLogger().setLevel(logging.WARNING)
+
+
+def simulated_ad2_operator(clock=None, dut=None, **scan_properties):
+    """
+    Create an Analog Discovery 2 Operator with a simulated device and the default config.
+
+    :param clock: optional clock for the simulated device (and Operator), e.g. a VirtualClock
+    :param dut: optional DeviceUnderTest for the simulated device
+    :param scan_properties: optional values to overwrite in properties['scan']
+    :return: the Operator
+    """
+    from labphew.controller.digilent.waveforms import SimulatedDfwController
+    from labphew.model.analog_discovery_2_model import Operator
+    opr = Operator(SimulatedDfwController(clock=clock, dut=dut), properties={})
+    opr.load_config()
+    opr.properties['scan'].update(scan_properties)
+    opr.properties['catalog'] = None  # don't add the benchmark files to the user's catalog
+    return opr
+
+
+def blink_operator(**scan_properties):
+    """
+    Create a BlinkOperator with the (fake) BlinkController and the default config.
+
+    :param scan_properties: optional values to overwrite in properties['scan']
+    :return: the BlinkOperator
+    """
+    from labphew.controller.blink_controller import BlinkController
+    from labphew.model.blink_model import BlinkOperator
+    opr = BlinkOperator(BlinkController(), properties={})
+    opr.load_config()
+    opr.properties['scan'].update(scan_properties)
+    opr.properties['catalog'] = None
+    return opr
+
+
+class CallTimer:
+    """
+    Wraps methods of an object to count the calls and accumulate the time spent inside them.
+    This allows to separate the time spent in the (simulated) device from the overhead of the Operator.
+    """
+    def __init__(self, obj, *method_names):
+        self.calls = 0
+        self.time = 0.0
+        for name in method_names:
+            setattr(obj, name, self._wrap(getattr(obj, name)))
+
+    def _wrap(self, method):
+        def wrapped(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.time += time.perf_counter() - t0
+                self.calls += 1
+        return wrapped
+
+
+def run_monitor(operator, duration):
+    """
+    Run the _monitor_loop of an Operator in a thread (like a MonitorWindow does) for a fixed duration.
+
+    :param operator: the Operator
+    :param duration: time (s) to run the monitor
+    :return: the actual duration (s)
+    """
+    operator._allow_monitor = True
+    thread = threading.Thread(target=operator._monitor_loop)
+    t0 = time.perf_counter()
+    thread.start()
+    time.sleep(duration)
+    operator._stop = True
+    thread.join()
+    operator._allow_monitor = False
+    return time.perf_counter() - t0
+
+
+def qt_application():
+    """
+    Return the (offscreen) QApplication, creating it if necessary.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from PyQt5.QtWidgets import QApplication
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([])
+    return app
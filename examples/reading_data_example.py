@@ -37,4 +37,14 @@ print(dat.measured_voltage.sel(scan_voltage=slice(0, 1.0)))  # for scan_voltage
 # See also http://xarray.pydata.org/en/stable/indexing.html
 
 # Plotting is very easy with xarray:
-dat.measured_voltage.plot()
\ No newline at end of file
+dat.measured_voltage.plot()
+
+# Large files (e.g. long recordings) can be opened without loading them into memory. Only the selected part is read:
+from labphew.data import open_scan, iter_chunks
+
+with open_scan(filename, scan_voltage=(0, 1.0)) as lazy:
+    print(lazy.measured_voltage.mean().values)
+
+# Or process a file block by block (each block is a Dataset in memory, of at most max_bytes):
+for start, block in iter_chunks(filename, max_bytes=2**20):
+    print(start, block.measured_voltage.max().values)
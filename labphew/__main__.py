@@ -6,6 +6,8 @@ It takes two arguments that is the name of the example and a path to the configu
 
     $ labphew start blink -default
 
+`labphew catalog <directory>` adds the saved datasets in a directory to the catalog (see labphew.data.catalog).
+
 """
 import sys
 import labphew
@@ -20,6 +22,11 @@ def main():
 
     # note: 0th argument will be labphew
 
+    if len(sys.argv) > 1 and sys.argv[1] == 'catalog':
+        from labphew.data.catalog import main as catalog_main
+        catalog_main(sys.argv[2:])
+        return
+
     if len(sys.argv) < 3 or sys.argv[1] != 'start':
         show_help()
         return
@@ -59,6 +66,9 @@ labphew start blink {}
 
 For blink (and other files where it's implemented) you could use -default or -d for the config file
 and -browse or -b to open a browse window.
+
+To add the saved datasets in a directory to the catalog (see labphew.data.catalog):
+labphew catalog <directory> [--rebuild] [--workers N]
 """
 
 if __name__ == "__main__":
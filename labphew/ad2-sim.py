@@ -38,12 +38,12 @@ def main(config_file = None):
     # >>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>
     # Load your classes and create your gui:
 
-    # from labphew.controller.digilent.waveforms import DfwController  If you were to use with real device
-    from labphew.controller.digilent.waveforms import SimulatedDfwController as DfwController  # To test with simulated device
+    from labphew.controller.digilent.waveforms import open_device  # shares the open device within this process
     from labphew.model.analog_discovery_2_model import Operator
     from labphew.view.analog_discovery_2_view import MonitorWindow, ScanWindow
 
-    instrument = DfwController()
+    # instrument = open_device()  If you were to use with real device
+    instrument = open_device(simulated=True)  # To test with simulated device
     opr = Operator(instrument)
     opr.load_config(default_config)
 
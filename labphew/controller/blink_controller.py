@@ -10,21 +10,25 @@ developers to create new controllers for real devices.
 Example usage can be found at the bottom of the file under if __name__=='__main___'
 """
 import logging
-import time
+from labphew.core.tools.clock import wall_clock
 
 class BlinkController:
     """
     Blink Controller: Fake Device controller to act as an example.
     """
-    def __init__(self):
+    def __init__(self, clock=None):
         """
         Create Blink controller object which simulates a fake device.
+
+        :param clock: clock used for the simulation, see labphew.core.tools.clock (default: None, meaning the wall clock)
+        :type clock: WallClock or None
         """
         self.logger = logging.getLogger(__name__)
+        self.clock = wall_clock if clock is None else clock
 
         # Set parameters to simulate the device
         self.__simulated_device_blink_period= 1  #
-        self.__simulated_device_start_time = time.time()
+        self.__simulated_device_start_time = self.clock.time()
         self.__simulated_device_status = False
         self.__simulated_device_enabled = True
 
@@ -62,7 +66,7 @@ class BlinkController:
         # For the purpose of demonstration, this method simulates setting a parameter on a device:
         self.logger.debug('"Sending" blink period of {} to device'.format(period_s))
         self.__simulated_device_blink_period = period_s
-        self.__simulated_device_start_time = time.time()
+        self.__simulated_device_start_time = self.clock.time()
         self.__simulated_device_status = not self.__simulated_device_status
 
     def enable(self, enable):
@@ -87,7 +91,7 @@ class BlinkController:
         # Your code to communicate with the device goes here.
         # For the purpose of demonstration, this method returns a simulated status:
         if self.__simulated_device_enabled:
-            return bool(int((time.time()-self.__simulated_device_start_time)/self.__simulated_device_blink_period/.5) % 2)
+            return bool(int((self.clock.time()-self.__simulated_device_start_time)/self.__simulated_device_blink_period/.5) % 2)
         else:
             self.logger.warning('Device is disabled')
             return False
@@ -0,0 +1,373 @@
+"""
+=============================
+Digilent WaveForms Simulation
+=============================
+
+Vectorized simulation of the analog signals of a Digilent WaveForms device (like the Analog Discovery 2), used by
+SimulatedDfwController in labphew.controller.digilent.waveforms.
+
+The simulation generates whole blocks of samples for both analog in channels at once with NumPy, which makes it
+possible to simulate sample rates in the MHz range. It consists of two parts:
+
+- SignalSimulator keeps track of the state of the analog out channels (DC offset or periodic/custom waveform) and
+  of the analog in settings (sample rate, range) and produces the sample blocks.
+- DeviceUnderTest describes what is connected between the analog out channels (W1, W2) and the analog in channels
+  (1+, 2+): a linear coupling matrix, a (possibly non-linear) transfer function per channel, a first order bandwidth
+  limit and a noise spectrum.
+
+Samples are generated as one continuous stream: each block continues where the previous one ended, so periodic
+signals keep their phase and filter states carry over between blocks.
+
+DigitalSimulator produces the samples of the 16 digital lines, a binary counter by default.
+
+find_trigger() locates an edge trigger (with hysteresis) in a block, for simulating triggered acquisitions.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import numpy as np
+from scipy import signal
+
+
+class DeviceUnderTest:
+    """
+    Model of the device connected between analog out and analog in.
+
+    For each block the simulator computes the analog out signals ao (shape (2, n)) and then applies:
+
+    1. coupling: x = coupling @ ao + offset
+    2. transfer function per channel: y[k] = transfer[k](x[k]) (functions should accept and return numpy arrays)
+    3. first order low-pass filter per channel with -3dB frequency bandwidth[k] (None means no bandwidth limit)
+    4. noise per channel with a white noise density noise_density[k] (V/sqrt(Hz)), or with a custom power spectral
+       density noise_psd[k] (a function of frequency returning V^2/Hz)
+    """
+    def __init__(self, coupling=None, offset=None, transfer=None, bandwidth=None, noise_density=None, noise_psd=None):
+        """
+        :param coupling: 2x2 matrix coupling analog out channels (columns) to analog in channels (rows) (default: identity)
+        :type coupling: array_like or None
+        :param offset: DC offset per analog in channel (V) (default: 0)
+        :type offset: array_like or None
+        :param transfer: list of 2 vectorized functions (or None for identity) (default: identity)
+        :type transfer: list or None
+        :param bandwidth: list of 2 cut-off frequencies (Hz) (or None for no bandwidth limit)
+        :type bandwidth: list or None
+        :param noise_density: list of 2 white noise densities (V/sqrt(Hz)) (default: 0)
+        :type noise_density: list or None
+        :param noise_psd: list of 2 functions of frequency that return the noise power spectral density (V^2/Hz), or None
+        :type noise_psd: list or None
+        """
+        self.coupling = np.eye(2) if coupling is None else np.asarray(coupling, dtype=float)
+        self.offset = np.zeros(2) if offset is None else np.asarray(offset, dtype=float)
+        self.transfer = [None, None] if transfer is None else list(transfer)
+        self.bandwidth = [None, None] if bandwidth is None else list(bandwidth)
+        self.noise_density = [0.0, 0.0] if noise_density is None else list(noise_density)
+        self.noise_psd = [None, None] if noise_psd is None else list(noise_psd)
+
+    def gain_and_phase(self, channel_in, channel_out, frequency, sample_rate=None):
+        """
+        Returns the small signal gain and phase (degrees) from an analog out channel to an analog in channel at a given
+        frequency, for a linear device (i.e. ignoring the transfer functions).
+        This is what a lock-in amplifier should measure.
+        If the sample rate is given, it returns the response of the discrete time filter of the SignalSimulator (which
+        deviates from the analog filter when the frequency is not much smaller than the sample rate).
+
+        :param channel_in: analog in channel (0 or 1)
+        :type channel_in: int
+        :param channel_out: analog out channel (0 or 1)
+        :type channel_out: int
+        :param frequency: frequency (Hz)
+        :type frequency: float
+        :param sample_rate: sample rate of the simulation (Hz) (default: None, meaning the analog filter)
+        :type sample_rate: float or None
+        :return: gain, phase (degrees)
+        :rtype: float, float
+        """
+        h = self.coupling[channel_in, channel_out]
+        cutoff = self.bandwidth[channel_in]
+        if cutoff and sample_rate:
+            b, a = _lowpass_coefficients(cutoff, sample_rate)
+            h = h * signal.freqz(b, a, worN=[frequency], fs=sample_rate)[1][0]
+        elif cutoff:
+            h = h / (1 + 1j * frequency / cutoff)
+        return abs(h), np.degrees(np.angle(h))
+
+
+def _lowpass_coefficients(cutoff, frequency):
+    """ Coefficients (b, a) of the first order low-pass filter of the simulation. """
+    alpha = 1 - np.exp(-2 * np.pi * cutoff / frequency)
+    return np.array([alpha]), np.array([1.0, alpha - 1])
+
+
+def default_device_under_test():
+    """
+    The device used by SimulatedDfwController if no device is specified:
+    analog in 1 reads a constant 1V with large noise, analog in 2 reads an exponential (diode-like) response to analog
+    out 2.
+    """
+    return DeviceUnderTest(coupling=[[0, 0], [0, 1]],
+                           transfer=[lambda x: x + 1.0, lambda x: np.exp(x - 0.7) / 20],
+                           noise_density=[0.5 / np.sqrt(5000), 2e-5])
+
+
+class SignalSimulator:
+    """
+    Generates blocks of analog in samples for a DeviceUnderTest driven by the simulated analog out channels.
+    """
+    # Function numbers as used by the dwf module (AnalogOut.FUNC)
+    DC, SINE, SQUARE, TRIANGLE, RAMP_UP, RAMP_DOWN, NOISE, CUSTOM = 0, 1, 2, 3, 4, 5, 6, 30
+
+    def __init__(self, dut=None, frequency=10000, range=50.0, bits=14, seed=None):
+        """
+        :param dut: the device under test (default: default_device_under_test())
+        :type dut: DeviceUnderTest or None
+        :param frequency: analog in sample rate (Hz) (default: 10000)
+        :type frequency: float
+        :param range: analog in voltage range (peak to peak) (default: 50.0)
+        :type range: float
+        :param bits: resolution of the simulated ADC, None for no quantization (default: 14)
+        :type bits: int or None
+        :param seed: seed for the random number generator
+        :type seed: int or None
+        """
+        self.dut = default_device_under_test() if dut is None else dut
+        self.frequency = float(frequency)
+        self.range = float(range)
+        self.bits = bits
+        self.rng = np.random.default_rng(seed)
+        self.sample_index = 0  # index of the next sample in the continuous stream
+        self.ao = [self._default_ao(), self._default_ao()]
+        self._filter_state = [None, None]
+        self._filter_coefficients = {}
+
+    @staticmethod
+    def _default_ao():
+        return {'enable': True, 'function': 0, 'offset': 0.0, 'amplitude': 0.0, 'frequency': 1000.0, 'phase': 0.0,
+                'data': None}
+
+    def set_ao(self, channel, **settings):
+        """
+        Update settings of analog out channel(s).
+        Possible settings: enable, function, offset, amplitude, frequency, phase (degrees), data (custom waveform,
+        normalized to [-1, 1])
+
+        :param channel: analog out channel (0 or 1, or -1 for both)
+        :type channel: int
+        """
+        for ch in (0, 1) if channel == -1 else (channel,):
+            for key, value in settings.items():
+                if key not in self.ao[ch]:
+                    raise KeyError(f'Unknown analog out setting: {key}')
+                if key == 'data' and value is not None:
+                    value = np.asarray(value, dtype=float)
+                self.ao[ch][key] = value
+
+    def reset_ao(self, channel=-1):
+        """ Reset analog out channel(s) to 0V DC. """
+        for ch in (0, 1) if channel == -1 else (channel,):
+            self.ao[ch] = self._default_ao()
+
+    def ao_signal(self, channel, t):
+        """
+        Calculates the analog out signal of a channel at times t.
+
+        :param channel: analog out channel (0 or 1)
+        :type channel: int
+        :param t: times (s)
+        :type t: numpy.ndarray
+        :return: voltages
+        :rtype: numpy.ndarray
+        """
+        ao = self.ao[channel]
+        if not ao['enable']:
+            return np.zeros_like(t)
+        func = ao['function']
+        if func == self.DC or ao['amplitude'] == 0:
+            return np.full_like(t, ao['offset'])
+        cycles = t * ao['frequency'] + ao['phase'] / 360.0
+        if func == self.SINE:
+            wave = np.sin(2 * np.pi * cycles)
+        elif func == self.SQUARE:
+            wave = np.where(cycles % 1 < 0.5, 1.0, -1.0)
+        elif func == self.TRIANGLE:
+            wave = 1 - 4 * np.abs((cycles + 0.25) % 1 - 0.5)
+        elif func == self.RAMP_UP:
+            wave = 2 * (cycles % 1) - 1
+        elif func == self.RAMP_DOWN:
+            wave = 1 - 2 * (cycles % 1)
+        elif func == self.NOISE:
+            wave = self.rng.uniform(-1, 1, size=t.shape)
+        elif func == self.CUSTOM and ao['data'] is not None and len(ao['data']):
+            data = ao['data']
+            wave = data[((cycles % 1) * len(data)).astype(np.intp)]
+        else:
+            wave = np.zeros_like(t)
+        return ao['offset'] + ao['amplitude'] * wave
+
+    def _lowpass(self, channel, x):
+        """ First order low-pass filter that keeps its state between blocks. """
+        cutoff = self.dut.bandwidth[channel]
+        if not cutoff:
+            return x
+        key = (cutoff, self.frequency)
+        if key not in self._filter_coefficients:
+            self._filter_coefficients[key] = _lowpass_coefficients(cutoff, self.frequency)
+        b, a = self._filter_coefficients[key]
+        state = self._filter_state[channel]
+        if state is None or state[1] != key:
+            state = (signal.lfilter_zi(b, a) * x[0], key)  # start in steady state
+        y, zf = signal.lfilter(b, a, x, zi=state[0])
+        self._filter_state[channel] = (zf, key)
+        return y
+
+    def _noise(self, channel, n):
+        psd = self.dut.noise_psd[channel]
+        if psd is not None:
+            # Shape white noise in the frequency domain (note: the spectrum is only reproduced within one block)
+            f = np.fft.rfftfreq(n, 1 / self.frequency)
+            f[0] = f[1] if n > 1 else 1
+            amplitude = np.sqrt(np.asarray(psd(f), dtype=float) * self.frequency / 2)
+            spectrum = self.rng.standard_normal(len(f)) + 1j * self.rng.standard_normal(len(f))
+            return np.fft.irfft(spectrum * amplitude, n) * np.sqrt(n / 2)
+        density = self.dut.noise_density[channel]
+        if density:
+            return self.rng.standard_normal(n) * (density * np.sqrt(self.frequency / 2))
+        return 0
+
+    def acquire(self, n, out=None):
+        """
+        Generate the next block of samples for both analog in channels.
+
+        :param n: number of samples per channel
+        :type n: int
+        :param out: optional preallocated array of shape (2, n) to write the samples in
+        :type out: numpy.ndarray or None
+        :return: samples (V) of shape (2, n)
+        :rtype: numpy.ndarray
+        """
+        if out is None:
+            out = np.empty((2, n))
+        t = (self.sample_index + np.arange(n)) / self.frequency
+        self.sample_index += n
+        ao = np.stack([self.ao_signal(0, t), self.ao_signal(1, t)])
+        np.matmul(self.dut.coupling, ao, out=out)
+        out += self.dut.offset[:, None]
+        for ch in range(2):
+            if self.dut.transfer[ch] is not None:
+                out[ch] = self.dut.transfer[ch](out[ch])
+            out[ch] = self._lowpass(ch, out[ch])
+            out[ch] += self._noise(ch, n)
+        half_range = self.range / 2
+        if self.bits:
+            step = self.range / 2 ** self.bits
+            np.round(out / step, out=out)
+            out *= step
+        np.clip(out, -half_range, half_range, out=out)
+        return out
+
+
+class DigitalSimulator:
+    """
+    Generates blocks of digital in samples (16 bit integers, one bit per line). By default the lines show a binary
+    counter that increments at counter_frequency: line k toggles at counter_frequency / 2**(k+1).
+    The pins of a pattern that is played (see play()) show the pattern instead, as if they are looped back.
+    """
+    def __init__(self, counter_frequency=1000.0):
+        """
+        :param counter_frequency: increment rate of the counter (Hz) (default: 1000)
+        :type counter_frequency: float
+        """
+        self.counter_frequency = counter_frequency
+        self.time = 0.0  # time (s) of the next sample in the continuous stream
+        self.pattern = None
+
+    def play(self, states, sample_rate, mask=0xFFFF, run=None, repeat=1, idle=0):
+        """
+        Start playing a pattern (at the time of the next sample).
+
+        :param states: 16 bit states of one period of the pattern
+        :type states: numpy.ndarray
+        :param sample_rate: sample rate of the pattern (Hz)
+        :type sample_rate: float
+        :param mask: the pins that are driven by the pattern (default: 0xFFFF)
+        :type mask: int
+        :param run: number of samples of one run, during which the pattern is looped (default: None, one period)
+        :type run: int or None
+        :param repeat: number of runs, 0 for infinite (default: 1)
+        :type repeat: int
+        :param idle: state of the pins when the pattern is not playing (default: 0)
+        :type idle: int
+        """
+        self.pattern = {'states': np.asarray(states, dtype=np.uint16), 'sample_rate': float(sample_rate),
+                        'mask': mask, 'run': len(states) if run is None else int(run), 'repeat': repeat,
+                        'idle': idle, 'start': self.time}
+
+    def stop(self):
+        """Stop playing the pattern."""
+        self.pattern = None
+
+    def acquire(self, n, sample_rate):
+        """
+        Generate the next block of samples.
+
+        :param n: number of samples
+        :type n: int
+        :param sample_rate: sample rate (Hz)
+        :type sample_rate: float
+        :return: samples of shape (n,)
+        :rtype: numpy.ndarray
+        """
+        t = self.time + np.arange(n) / sample_rate
+        self.time += n / sample_rate
+        samples = (np.floor(t * self.counter_frequency).astype(np.int64) & 0xFFFF).astype(np.uint16)
+        pattern = self.pattern
+        if pattern is not None:
+            # index in the pattern stream (the small offset avoids rounding down at the exact sample times)
+            k = np.floor((t - pattern['start']) * pattern['sample_rate'] + 1e-6).astype(np.int64)
+            active = k >= 0
+            if pattern['repeat']:
+                active &= k < pattern['run'] * pattern['repeat']
+            states = pattern['states'][(k % pattern['run']) % len(pattern['states'])]
+            states = np.where(active, states, pattern['idle'])
+            samples = (samples & ~np.uint16(pattern['mask'])) | (states & pattern['mask'])
+        return samples.astype(np.uint16)
+
+
+def find_trigger(x, level, hysteresis=0.0, edge='rising', start=0, stop=None):
+    """
+    Find the first edge trigger in a signal, like the trigger detector of the device: a rising edge triggers when the
+    signal reaches level after it has been below level - hysteresis (a falling edge is the mirror image).
+
+    :param x: the signal
+    :type x: numpy.ndarray
+    :param level: trigger level
+    :type level: float
+    :param hysteresis: hysteresis (default: 0)
+    :type hysteresis: float
+    :param edge: 'rising' or 'falling' (default: 'rising')
+    :type edge: str
+    :param start: first index at which a trigger is accepted (default: 0)
+    :type start: int
+    :param stop: triggers are accepted before this index (default: None, meaning the end of x)
+    :type stop: int or None
+    :return: index of the first sample after the edge (None if there's no trigger)
+    :rtype: int or None
+    """
+    if edge == 'falling':
+        x, level = -x, -level
+    index = np.arange(len(x))
+    # the last index (up to each sample) at which the signal was above the level, and below the arming level
+    last_above = np.maximum.accumulate(np.where(x >= level, index, -1))
+    last_armed = np.maximum.accumulate(np.where(x < level - hysteresis, index, -1))
+    triggers = np.flatnonzero((x[1:] >= level) & (last_armed[:-1] > last_above[:-1])) + 1
+    triggers = triggers[(triggers >= start) & (triggers < (len(x) if stop is None else stop))]
+    return int(triggers[0]) if len(triggers) else None
+
+
+if __name__ == '__main__':
+    import time
+    sim = SignalSimulator(DeviceUnderTest(bandwidth=[1e4, None], noise_density=[1e-6, 1e-6]), frequency=1e8)
+    sim.set_ao(0, function=SignalSimulator.SINE, amplitude=1.0, frequency=1e4)
+    n = 2**20
+    t0 = time.time()
+    for i in range(10):
+        block = sim.acquire(n)
+    print(f'{10 * n / (time.time() - t0) / 1e6:.1f} MSamples/s per channel')
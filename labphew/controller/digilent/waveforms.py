@@ -15,27 +15,53 @@ Unfortunately there's no extended documentation for the dwf module, but original
 described in the `WaveForms SDK Reference Manual <https://s3-us-west-2.amazonaws.com/digilent/resources/instrumentation/waveforms/waveforms_sdk_rm.pdf>`_.
 Using an autocompleting IDE it's possible to explore the available methods and find the documentation of the corresponding functions in the WaveForms SDK Reference Manual.
 
+The instruments of the device (AnalogIn, AnalogOut, etc.) are wrapped such that DfwController keeps a shadow copy of
+the settings (i.e. the values passed to the ...Set() methods). The ...Get() methods are served from memory, which
+avoids a (USB) round trip to the device. See DfwController.shadow_check and DfwController.verify_settings() for
+debugging.
+
 In addition to the DfwController class this module contains functions to explore which devices are connected and to close connections.
+To share one open device between several operators or windows, use open_device() instead of DfwController().
 
 """
 import logging
+import copy
+import ctypes
+import hashlib
 import dwf
 import time
+from contextlib import contextmanager
 import numpy as np
+from labphew.core.tools.clock import wall_clock
+from labphew.core.tools.device_registry import DeviceRegistry
+from labphew.core.tools.digital import DigitalCapture, DigitalPattern, unpack_bits
+from labphew.controller.digilent.simulation import SignalSimulator, DigitalSimulator, find_trigger
 
 
 class DfwController(dwf.Dwf):
     """
     Controller for Digilent devices controlled through WaveForms software
     """
-    def __init__(self, device_number=0, config=0):
+    # Methods of AnalogOut to apply the settings of update_analog_out()
+    _ao_node_setters = {'function': 'nodeFunctionSet', 'offset': 'nodeOffsetSet', 'amplitude': 'nodeAmplitudeSet',
+                        'frequency': 'nodeFrequencySet', 'phase': 'nodePhaseSet', 'symmetry': 'nodeSymmetrySet'}
+    # analog out settings that are applied to a running channel by the device itself if auto configure is on
+    _ao_live_settings = {'offset', 'amplitude'}
+    # Trigger sources of configure_trigger() (names of Dwf.TRIGSRC)
+    _trigger_sources = {'none': 'NONE', 'analog_in': 'DETECTOR_ANALOG_IN', 'digital_in': 'DETECTOR_DIGITAL_IN',
+                        'analog_out1': 'ANALOG_OUT1', 'analog_out2': 'ANALOG_OUT2', 'external1': 'EXTERNAL1',
+                        'external2': 'EXTERNAL2', 'pc': 'PC'}
+    # Idle outputs of play_digital_pattern() (names of DwfDigitalOut.IDLE)
+    _do_idle = {'low': 'LOW', 'high': 'HIGH', 'init': 'INIT', 'hiz': 'HiZ'}
+
+    def __init__(self, device_number=0, config=0, clock=None):
         """
         Connect to device with optional configuration.
 
         It connects to device with device_number as listed by the enumerate_devices() function of this module.
         Note that the default value of 0 will simply connect to the first device found.
-        The possible configurations are also returned by enumerate_devices(). Note that enumerate devices is run at time
-        of module import and stored in the variable devices. Note that the information returned by enumerate_devices()
+        The possible configurations are returned by enumerate_devices(config_info=True). Note that enumerate devices is
+        run at time of module import (without config info) and stored in the variable devices. Note that the information returned by enumerate_devices()
         (or stored in the variable devices) can be diplayed in more readable form with the function print_device_list()
         of this module.
 
@@ -43,18 +69,22 @@ class DfwController(dwf.Dwf):
         :type device_number: int
         :param config: configuration number (default: 0)
         :type config: int
+        :param clock: clock used for timing, see labphew.core.tools.clock (default: None, meaning the wall clock)
+        :type clock: WallClock or None
         """
         self.logger = logging.getLogger(__name__)
+        self.clock = wall_clock if clock is None else clock
         super().__init__(device_number, config)
 
-        self.AnalogIn = dwf.DwfAnalogIn(self)
-        self.AnalogOut = dwf.DwfAnalogOut(self)
-        self.DigitalIn = dwf.DwfDigitalIn(self)
-        self.DigitalOut = dwf.DwfDigitalOut(self)
+        self.AnalogIn = _SettingsShadow(dwf.DwfAnalogIn(self), 'AnalogIn')
+        self.AnalogOut = _SettingsShadow(dwf.DwfAnalogOut(self), 'AnalogOut')
+        self.DigitalIn = _SettingsShadow(dwf.DwfDigitalIn(self), 'DigitalIn')
+        self.DigitalOut = _SettingsShadow(dwf.DwfDigitalOut(self), 'DigitalOut')
 
         # Not sure yet what these do:
-        self.AnalogIO = dwf.DwfAnalogIO(self)
-        self.DigitalIO = dwf.DwfDigitalIO(self)
+        self.AnalogIO = _SettingsShadow(dwf.DwfAnalogIO(self), 'AnalogIO')
+        self.DigitalIO = _SettingsShadow(dwf.DwfDigitalIO(self), 'DigitalIO')
+        self._shadows = [self.AnalogIn, self.AnalogOut, self.DigitalIn, self.DigitalOut, self.AnalogIO, self.DigitalIO]
 
         # create short name references
         self.ai = self.AnalogIn
@@ -66,11 +96,71 @@ class DfwController(dwf.Dwf):
         self._read_timeout = 1  # will be overwritten by preset_basic_analog()
         self._last_ao0 = 0  # will be overwritten by write_analog()
         self._last_ao1 = 0  # will be overwritten by write_analog()
-        self._time_stabilized = time.time()  # will be overwritten by write_analog()
+        self._time_stabilized = self.clock.time()  # will be overwritten by write_analog()
+        self._ao_state = [{}, {}]  # last applied analog out settings, see update_analog_out()
+        self._ai_state = {}  # last applied analog in settings, see apply_profile()
+        self._profiles = {}  # acquisition profiles, see register_profile()
+        self.active_profile = None
+        self.trigger = None  # trigger settings, see configure_trigger()
+        self._ai_buffer = np.zeros((2, 0))  # reused buffer for reading analog in data, see _read_ai_buffer()
+        self._ai_buffer16 = np.zeros((2, 0), dtype=np.int16)  # reused buffer for reading raw analog in data
+        self._di_buffer = np.zeros(0, dtype=np.uint16)  # reused buffer for reading digital in data, see record_digital()
+        self._do_uploaded = {}  # (digest, divider, idle) of the pattern uploaded to each pin, see play_digital_pattern()
+        self._pattern_cache = {}  # compiled patterns, see _compile_pattern()
+        self._waveform_cache = {}  # normalized waveforms, see _prepare_waveform()
+        self._ao_data_info = {}  # minimum and maximum number of samples of custom waveforms per channel
+        self._auto_configure = bool(self.autoConfigureGet())  # see update_analog_out()
         self.preset_basic_analog()
 
         self.logger.debug('DfwController object created')
 
+    @property
+    def shadow_check(self):
+        """
+        Consistency-check mode for debugging.
+        When True, every ...Get() that is served from the shadow copy is also read from the device and a mismatch is
+        logged as an error (note that this removes the speed advantage of the shadow copy).
+        """
+        return self.AnalogIn.check
+
+    @shadow_check.setter
+    def shadow_check(self, check):
+        for shadow in self._shadows:
+            shadow.check = bool(check)
+
+    def verify_settings(self):
+        """
+        Compare all settings in the shadow copy with the values on the device.
+        Mismatches are logged as errors and corrected in the shadow copy.
+
+        :return: dictionary of mismatches {(instrument, setting, arguments): (shadow value, device value)}
+        :rtype: dict
+        """
+        mismatches = {}
+        for shadow in self._shadows:
+            mismatches.update(shadow.verify())
+        return mismatches
+
+    def invalidate_settings(self):
+        """
+        Clear the shadow copy of the settings, forcing the next ...Get() calls to read the values from the device.
+        Use this if the device settings may have been changed in another way than through this object.
+        It also clears the last applied settings used by update_analog_out() and apply_profile() and the record of
+        uploaded patterns used by play_digital_pattern().
+        """
+        for shadow in self._shadows:
+            shadow.invalidate()
+        self._ao_state = [{}, {}]
+        self._ai_state = {}
+        self._do_uploaded = {}
+
+    def reset(self):
+        """
+        Reset the device (all instruments) and clear the shadow copy of the settings.
+        """
+        super().reset()
+        self.invalidate_settings()
+
     def preset_basic_analog(self, n=80, freq=10000, range=50.0, return_std=False):
         """
         Apply settings for read_analog() and write_analog()
@@ -91,13 +181,70 @@ class DfwController(dwf.Dwf):
         self.ai.reset()
         self.ao.nodeFunctionSet(-1, self.ao.NODE.CARRIER, self.ao.FUNC.DC)
         self.ao.configure(-1, 3)  # apply
+        self.trigger = None  # the reset disabled the trigger
         self.ai.bufferSizeSet(n)
         self.ai.frequencySet(freq)
         self.ai.channelRangeSet(-1, range)
         self.ai.configure(1, 0)  # apply config to AI, but not start
         # self._read_timeout = 1.9 + self.ai.bufferSizeGet() / self.ai.frequencyGet()
         self.ao.configure(-1, 1)
-        self.basic_analog_return_std = False
+        self._ao_state = [{'function': self.ao.FUNC.DC, 'enable': True}, {'function': self.ao.FUNC.DC, 'enable': True}]
+        self._last_ao0 = 0
+        self._last_ao1 = 0
+        self._ai_state = {'n': n, 'freq': freq, 'range': range}
+        self.register_profile('basic', n, freq, range, return_std)  # to return to these settings with apply_profile()
+        self.active_profile = 'basic'
+        self.basic_analog_return_std = return_std
+
+    def register_profile(self, name, n=80, freq=10000, range=50.0, return_std=False):
+        """
+        Register a named acquisition profile for read_analog(), which can be applied later with apply_profile().
+        The parameters are the same as for preset_basic_analog().
+
+        :param name: name of the profile
+        :type name: str
+        :param n:     number of datapoints to collect and average (default 80)
+        :type n:      int
+        :param freq:  analog in frequency (default 10000)
+        :type freq:   int or float
+        :param range: the voltage range for the ADC (5.0 or 50.0) (default 50.0)
+        :type range:  int or float
+        :param return_std: also returns the standard deviations (default False)
+        :type return_std:  bool
+        """
+        self._profiles[name] = {'n': n, 'freq': freq, 'range': range, 'return_std': return_std}
+
+    def apply_profile(self, name):
+        """
+        Switch to a profile registered with register_profile().
+        Unlike preset_basic_analog() it doesn't reset the device: only the analog in settings that differ from the
+        current ones are applied, and analog out is not touched.
+        Note: if you change analog in settings directly (e.g. daq.ai.frequencySet()), call invalidate_settings() first.
+
+        :param name: name of the profile
+        :type name: str
+        :return: the number of settings that were changed (None if the profile doesn't exist)
+        :rtype: int
+        """
+        if name not in self._profiles:
+            self.logger.error(f'profile {name} is not registered')
+            return
+        profile = self._profiles[name]
+        changed = 0
+        for key, setter in (('n', self.ai.bufferSizeSet), ('freq', self.ai.frequencySet)):
+            if self._ai_state.get(key) != profile[key]:
+                setter(profile[key])
+                self._ai_state[key] = profile[key]
+                changed += 1
+        if self._ai_state.get('range') != profile['range']:
+            self.ai.channelRangeSet(-1, profile['range'])
+            self._ai_state['range'] = profile['range']
+            changed += 1
+        if changed:
+            self.ai.configure(1, 0)  # apply config to AI, but not start
+        self.basic_analog_return_std = profile['return_std']
+        self.active_profile = name
+        return changed
 
     def stop_analog_out(self, channel=-1):
         """
@@ -107,29 +254,187 @@ class DfwController(dwf.Dwf):
         :type channel: int
         """
         self.ao.configure(channel, 0)
+        for ch in (0, 1) if channel == -1 else (channel,):
+            self._ao_state[ch]['enable'] = False
 
     def write_analog(self, volt, channel=-1, enable=True):
         """
         Basic method to apply voltage to analog out channels (the Arbitrary Waveform Generator (AWG) pins W1 and W2).
+        The channels are switched to DC (e.g. after write_waveform()).
         Not that these pins can only supply about 2mA.
         In the background it also approximates the timestamp when the output will be stabilize (based on the change in voltage applied).
         To wait for that timestamp, call wait_for_stabilization()
+        Writing the same voltage again is skipped (see update_analog_out()).
 
         :param volt: voltage to apply (in Volt)
         :type vol: float
         :param channel: analog out channel to set (default is -1, meaning all channels)
         :type channel: int
-        :param delay: delay (s) to wait after setting output to allow for stabilization
-        :type delay: float
-        """
-        self.ao.nodeOffsetSet(channel, self.ao.NODE.CARRIER, volt)
-        self.ao.configure(channel, enable)
-        if channel == 0 or channel == -1:
-            self._time_stabilized = max(self._time_stabilized, time.time()+0.013+0.005*abs(self._last_ao0-volt))
-            self._last_ao0 = volt
-        if channel == 1 or channel == -1:
-            self._time_stabilized = max(self._time_stabilized, time.time()+0.013+0.005*abs(self._last_ao1-volt))
-            self._last_ao1 = volt
+        :param enable: enable the output (default: True)
+        :type enable: bool
+        """
+        channels = (0, 1) if channel == -1 else (channel,)
+        self.update_analog_out({ch: {'function': self.ao.FUNC.DC, 'offset': volt, 'enable': enable} for ch in channels})
+
+    def update_analog_out(self, settings):
+        """
+        Apply settings to one or both analog out channels in a single transaction.
+        Only the settings that differ from the last applied values are sent to the device, and all changed channels
+        are started with a single configure call (if they have the same enable value). If nothing changed, the device is
+        not accessed at all. If the device configures itself after every setting (auto configure, the default) and only
+        the offset and/or amplitude of a channel that is already running changed, the configure call is skipped too.
+        The possible settings (of the carrier node) are:
+        'function' (one of self.ao.FUNC), 'offset', 'amplitude' (V), 'frequency' (Hz), 'phase' (degrees),
+        'symmetry' (%) and 'enable' (bool, default True).
+        Changes in offset are taken into account for the stabilization time (see wait_for_stabilization()).
+
+        Example: daq.update_analog_out({0: {'offset': 1.0}, 1: {'offset': -1.0}})
+
+        :param settings: dictionary with the channel (0 or 1) as keys and dictionaries of settings as values
+        :type settings: dict
+        :return: number of device calls made
+        :rtype: int
+        """
+        device_calls = 0
+        start = {}  # channels to (re)start, grouped by enable value
+        for channel, channel_settings in settings.items():
+            state = self._ao_state[channel]
+            changed = set()
+            for key, value in channel_settings.items():
+                if key == 'enable':
+                    continue
+                if key not in self._ao_node_setters:
+                    self.logger.error(f'unknown analog out setting: {key}')
+                    continue
+                if state.get(key) == value:
+                    continue
+                getattr(self.ao, self._ao_node_setters[key])(channel, self.ao.NODE.CARRIER, value)
+                device_calls += 1
+                changed.add(key)
+                if key == 'offset':
+                    last = state.get(key, 0) if state.get('enable') else 0
+                    self._time_stabilized = max(self._time_stabilized, self.clock.time()+0.013+0.005*abs(last-value))
+                    if channel == 0:
+                        self._last_ao0 = value
+                    else:
+                        self._last_ao1 = value
+                state[key] = value
+            enable = bool(channel_settings.get('enable', True))
+            applied_live = enable and self._auto_configure and changed <= self._ao_live_settings
+            if state.get('enable') != enable or (changed and not applied_live):
+                start.setdefault(enable, []).append(channel)
+                state['enable'] = enable
+        for enable, channels in start.items():
+            self.ao.configure(-1 if len(channels) == 2 else channels[0], enable)
+            device_calls += 1
+        return device_calls
+
+    @contextmanager
+    def analog_out_transaction(self):
+        """
+        Context manager to collect analog out settings and apply them in a single update_analog_out() call at the end.
+
+        Example:
+        with daq.analog_out_transaction() as ao:
+            ao[0] = {'offset': 1.0}
+            ao[1] = {'function': daq.ao.FUNC.SINE, 'amplitude': 0.5, 'frequency': 1000}
+        """
+        settings = {}
+        yield settings
+        self.update_analog_out(settings)
+
+    def write_waveform(self, data, frequency, channel=0, amplitude=None, offset=None, phase=0.0, enable=True):
+        """
+        Output an arbitrary waveform on an analog out channel (using the custom function of the AWG). The data is one
+        period of the waveform, which is repeated at frequency.
+        The data is normalized to [-1, 1] before uploading, and by default the amplitude and offset of the channel
+        are set such that the output has the voltages of data. Specify amplitude and/or offset to scale or shift it.
+
+        Uploads are kept to a minimum:
+
+        - The normalized shape that is loaded on each channel is remembered (by a digest). Writing a waveform with the
+          same shape again (e.g. with another amplitude, offset or frequency) doesn't transfer the data again, only
+          the settings that changed are sent (see update_analog_out()).
+        - The normalized shapes of the last 16 different arrays are cached, so switching back to a previously used
+          waveform doesn't normalize (or convert) it again.
+
+        :param data: one period of the waveform (V)
+        :type data: numpy.ndarray
+        :param frequency: repetition frequency of the waveform (Hz)
+        :type frequency: float
+        :param channel: analog out channel (0 or 1) (default: 0)
+        :type channel: int
+        :param amplitude: amplitude of the normalized shape (V) (default: None, meaning half the peak-peak of data)
+        :type amplitude: float or None
+        :param offset: offset (V) (default: None, meaning the center of data)
+        :type offset: float or None
+        :param phase: phase (degrees) (default: 0)
+        :type phase: float
+        :param enable: enable the output (default: True)
+        :type enable: bool
+        :return: True if successful
+        :rtype: bool
+        """
+        if channel not in (0, 1):
+            self.logger.error('channel should be 0 or 1')
+            return
+        prepared = self._prepare_waveform(data)
+        if prepared is None:
+            return
+        digest, shape, scale, center = prepared
+        if channel not in self._ao_data_info:  # it doesn't change, so it's read from the device only once
+            self._ao_data_info[channel] = self.ao.nodeDataInfo(channel, self.ao.NODE.CARRIER)
+        min_samples, max_samples = self._ao_data_info[channel]
+        if not min_samples <= len(shape) <= max_samples:
+            self.logger.error(f'the waveform should have {min_samples} to {max_samples} samples')
+            return
+        state = self._ao_state[channel]
+        if state.get('waveform') != digest:
+            self._upload_waveform(channel, shape)
+            state['waveform'] = digest
+            state.pop('enable', None)  # make update_analog_out() restart the channel with the new data
+        self.update_analog_out({channel: {'function': self.ao.FUNC.CUSTOM, 'frequency': frequency, 'phase': phase,
+                                          'amplitude': scale if amplitude is None else amplitude,
+                                          'offset': center if offset is None else offset, 'enable': enable}})
+        return True
+
+    def _prepare_waveform(self, data):
+        """
+        Internal helper that normalizes waveform data to [-1, 1], or takes it from the cache of prepared waveforms
+        (keyed by a digest of the data).
+
+        :param data: one period of the waveform (V)
+        :type data: numpy.ndarray
+        :return: digest of the normalized shape, the normalized shape, half the peak-peak and the center of data (or
+                 None in case of invalid data)
+        :rtype: (str, numpy.ndarray, float, float)
+        """
+        data = np.ascontiguousarray(data, dtype=float)
+        key = hashlib.sha1(data).hexdigest()
+        if key not in self._waveform_cache:
+            if data.ndim != 1 or not len(data) or not np.isfinite(data).all():
+                self.logger.error('waveform data should be a 1D array of finite values')
+                return
+            low, high = data.min(), data.max()
+            center, scale = (high + low) / 2, (high - low) / 2
+            # rounded well below the resolution of the AWG, so scaled copies of a shape get the same digest
+            shape = np.round((data - center) / scale, 9) if scale else np.zeros_like(data)
+            if len(self._waveform_cache) >= 16:
+                del self._waveform_cache[next(iter(self._waveform_cache))]  # remove the oldest
+            self._waveform_cache[key] = (hashlib.sha1(shape).hexdigest(), shape, float(scale), float(center))
+        return self._waveform_cache[key]
+
+    def _upload_waveform(self, channel, shape):
+        """
+        Internal helper that uploads a normalized waveform to the carrier of a channel (directly from the array).
+
+        :param channel: analog out channel (0 or 1)
+        :type channel: int
+        :param shape: the normalized waveform
+        :type shape: numpy.ndarray
+        """
+        dwf.FDwfAnalogOutNodeDataSet(self.hdwf, channel, self.ao.NODE.CARRIER,
+                                     shape.ctypes.data_as(ctypes.POINTER(ctypes.c_double)), len(shape))
 
     def wait_for_stabilization(self):
         """
@@ -138,9 +443,9 @@ class DfwController(dwf.Dwf):
         :return: the amount of time waited (s)
         :rtype: float
         """
-        wait = self._time_stabilized - time.time()
+        wait = self._time_stabilized - self.clock.time()
         if wait > 0:
-            time.sleep(wait)
+            self.clock.sleep(wait)
             return wait
         return 0
 
@@ -154,36 +459,163 @@ class DfwController(dwf.Dwf):
         :return: the analog values of both AI channels (and possibly the standard deviations)
         :rtype: float, float [,float, float] (or None's in case of read timeout)
         """
-        self.ai.configure(0, 1)  # start acquisition
-        if self.wait_for_ai_acquisition():
+        block = self.read_analog_block()
+        if block is None:
             return tuple([None, None])*(1 + self.basic_analog_return_std)  # return the right amount of None's
-        buf = self.ai.bufferSizeGet()
-        c0 = np.array(self.ai.statusData(0, buf))
-        c1 = np.array(self.ai.statusData(1, buf))
+        c0, c1 = block
         if self.basic_analog_return_std:
             return c0.mean(), c1.mean(), c0.std(), c1.std()
         else:
             return c0.mean(), c1.mean()
 
+    def read_analog_block(self, raw=False):
+        """
+        Acquire one buffer of both analog in channels and return all samples.
+        See preset_basic_analog() to setup specifics for reading.
+
+        The data is read directly from the dll into a preallocated NumPy array that is reused for every read. This
+        avoids the conversion to (and from) a tuple of Python floats that AnalogIn.statusData() does.
+        Note that the returned array is overwritten by the next read, so make a copy if you want to keep it.
+
+        With raw=True it returns the raw 16 bit ADC values (int16), which is faster and uses less memory.
+        The voltage corresponds to approximately raw * range / 65536 + offset.
+
+        :param raw: return raw int16 values instead of voltages (default: False)
+        :type raw: bool
+        :return: array of shape (2, buffer size) (or None in case of read timeout)
+        :rtype: numpy.ndarray
+        """
+        self.ai.configure(0, 1)  # start acquisition
+        if self.wait_for_ai_acquisition():
+            return None
+        return self._read_ai_buffer(self.ai.bufferSizeGet(), raw)
+
+    def _read_ai_buffer(self, n, raw=False):
+        """
+        Internal helper that copies the last acquired n samples of both channels straight into the (reused) buffer.
+        The buffer is only reallocated when n changes.
+
+        :param n: number of samples per channel
+        :type n: int
+        :param raw: read raw int16 values using FDwfAnalogInStatusData16 (default: False)
+        :type raw: bool
+        :return: the buffer, of shape (2, n)
+        :rtype: numpy.ndarray
+        """
+        if raw:
+            if self._ai_buffer16.shape[1] != n:
+                self._ai_buffer16 = np.zeros((2, n), dtype=np.int16)
+            for ch in range(2):
+                # the dwf module doesn't wrap FDwfAnalogInStatusData16, so call the dll directly
+                dwf.dwfdll.FDwfAnalogInStatusData16(self.hdwf, ch, self._ai_buffer16[ch].ctypes.data_as(
+                    ctypes.POINTER(ctypes.c_short)), 0, n)
+            return self._ai_buffer16
+        if self._ai_buffer.shape[1] != n:
+            self._ai_buffer = np.zeros((2, n))
+        for ch in range(2):
+            dwf.FDwfAnalogInStatusData(self.hdwf, ch, self._ai_buffer[ch].ctypes.data_as(
+                ctypes.POINTER(ctypes.c_double)), n)
+        return self._ai_buffer
+
     def wait_for_ai_acquisition(self, start_timestamp=None):
         """
         Waits while ai status is busy. Uses the AI frequency and buffersize in combination with start_timestamp to
         calculate a read timeout. If no start_timestamp is supplied it uses time at moment of calling the method.
         It returns True if timeout occurred and None if acquisition finished regularly.
 
-        :param start_timestamp: the timestamp (as returned by time.time()) from which to calculate how long to wait
+        :param start_timestamp: the timestamp (as returned by self.clock.time()) from which to calculate how long to wait
         :type start_timestamp: float or None
         :return: True for timeout, None when nothing happened
         :rtype: True or None
         """
         if start_timestamp is None:
-            start_timestamp = time.time()
+            start_timestamp = self.clock.time()
         read_timeout = 1.9 + self.ai.bufferSizeGet() / self.ai.frequencyGet()
         while self.ai.status(True) != self.ai.STATE.DONE:
-            if time.time() > start_timestamp + read_timeout:
+            if self.clock.time() > start_timestamp + read_timeout:
                 self.logger.error('AI read timeout occured')
                 return True
 
+    def configure_trigger(self, source='analog_in', channel=0, level=0.0, edge='rising', position=0.5,
+                          hysteresis=0.01, auto_timeout=0.0):
+        """
+        Configure the trigger of analog in acquisitions, for capturing frames with capture_frame().
+        The number of samples and the sample rate of a frame are those of the analog in settings (see
+        preset_basic_analog() or apply_profile()).
+        Note that read_analog() and read_analog_block() also wait for the trigger, until disable_trigger() is called.
+
+        :param source: 'analog_in' (the level of an analog in channel), 'none' (free running), 'digital_in',
+                       'analog_out1', 'analog_out2' (start of analog out), 'external1', 'external2' or 'pc'
+                       (default: 'analog_in')
+        :type source: str
+        :param channel: analog in channel for the 'analog_in' source (0 or 1) (default: 0)
+        :type channel: int
+        :param level: trigger level (V) (default: 0)
+        :type level: float
+        :param edge: 'rising' or 'falling' (default: 'rising')
+        :type edge: str
+        :param position: fraction of the frame before the trigger (0 to 1) (default: 0.5)
+        :type position: float
+        :param hysteresis: the signal has to cross level -/+ hysteresis before it can trigger again (V) (default: 0.01)
+        :type hysteresis: float
+        :param auto_timeout: acquire without trigger if no trigger occurs within this time (s), 0 to always wait for a
+                             trigger (default: 0)
+        :type auto_timeout: float
+        :return: True if successful
+        :rtype: bool
+        """
+        if source not in self._trigger_sources or edge not in ('rising', 'falling') or not 0 <= position <= 1:
+            self.logger.error(f'invalid trigger settings: source should be one of {list(self._trigger_sources)}, edge '
+                              f'rising or falling and position between 0 and 1')
+            return
+        ai = self.ai
+        ai.triggerSourceSet(getattr(ai.TRIGSRC, self._trigger_sources[source]))
+        if source == 'analog_in':
+            ai.triggerChannelSet(channel)
+            ai.triggerTypeSet(ai.TRIGTYPE.EDGE)
+            ai.triggerLevelSet(level)
+            ai.triggerHysteresisSet(hysteresis)
+            ai.triggerConditionSet(ai.TRIGCOND.RISING_POSITIVE if edge == 'rising' else ai.TRIGCOND.FALLING_NEGATIVE)
+        # the device takes the position of the trigger in seconds relative to the middle of the frame
+        ai.triggerPositionSet((0.5 - position) * ai.bufferSizeGet() / ai.frequencyGet())
+        ai.triggerAutoTimeoutSet(auto_timeout)
+        ai.configure(1, 0)  # apply config to AI, but not start
+        self.trigger = {'source': source, 'channel': channel, 'level': level, 'edge': edge, 'position': position,
+                        'hysteresis': hysteresis, 'auto_timeout': auto_timeout}
+        return True
+
+    def disable_trigger(self):
+        """
+        Return to free running acquisition (without trigger).
+        """
+        self.ai.triggerSourceSet(self.ai.TRIGSRC.NONE)
+        self.ai.triggerAutoTimeoutSet(0)
+        self.ai.triggerPositionSet(0)
+        self.ai.configure(1, 0)
+        self.trigger = None
+
+    def capture_frame(self, timeout=1.0, raw=False):
+        """
+        Arm the acquisition, wait for the trigger (see configure_trigger()) and return the full frame of both channels.
+        Like read_analog_block(), the returned array is reused by the next capture (make a copy to keep it).
+
+        :param timeout: time (s) to wait for a trigger (on top of the duration of the frame) (default: 1.0)
+        :type timeout: float
+        :param raw: return raw int16 values instead of voltages (default: False)
+        :type raw: bool
+        :return: array of shape (2, buffer size) (or None if no trigger occurred within the timeout)
+        :rtype: numpy.ndarray
+        """
+        n = self.ai.bufferSizeGet()
+        deadline = self.clock.time() + timeout + n / self.ai.frequencyGet()
+        self.ai.configure(0, 1)  # arm
+        while self.ai.status(True) != self.ai.STATE.DONE:
+            if self.clock.time() > deadline:
+                self.ai.configure(0, 0)  # stop waiting for the trigger
+                self.logger.debug('no trigger within timeout')
+                return None
+        return self._read_ai_buffer(n, raw)
+
     def power_supply(self, positive=None, negative=None, enable=True):
         # """
         # Set the voltage for the positive programmable power supply (V+, V-).
@@ -266,7 +698,7 @@ class DfwController(dwf.Dwf):
         if number < 0 or number > 65535:
             self.logger.error("Number out of range [0 - 65535]")
             return
-        return [int(c) for c in '{0:016b}'.format(number)[::-1]]
+        return unpack_bits(number)[0].tolist()
 
     def _convert_value_and_pin_to_bits(self, value, pin=None):
         """
@@ -404,23 +836,317 @@ class DfwController(dwf.Dwf):
             change_ouput &= current_modes
         self.DigitalIO.outputSet(change_ouput)
 
+    def record_digital(self, duration, frequency=1e6, callback=None, timeout=1.0):
+        """
+        Record all 16 digital lines at a fixed sample rate (logic analyzer), using the record mode of DigitalIn.
+        The samples are streamed from the device in blocks, straight into a (reused) uint16 NumPy array, and stored as
+        a run-length encoded DigitalCapture (see labphew.core.tools.digital), which keeps long captures small.
+        Samples that the device reports as lost (when the data is not read fast enough) are counted in capture.lost.
+
+        :param duration: duration of the recording (s)
+        :type duration: float
+        :param frequency: sample rate (Hz), rounded to a divider of the internal clock (default: 1e6)
+        :type frequency: float
+        :param callback: function that is called with every block of samples (as a uint16 array that is reused for the
+                         next block), e.g. to stop a monitor or show progress. Return True from it to stop recording.
+        :type callback: callable or None
+        :param timeout: time (s) to wait for new data before giving up (default: 1.0)
+        :type timeout: float
+        :return: the capture (or None in case of a timeout)
+        :rtype: DigitalCapture
+        """
+        di = self.di
+        divider = max(1, int(round(di.internalClockInfo() / frequency)))
+        sample_rate = di.internalClockInfo() / divider
+        n = int(round(duration * sample_rate))
+        di.acquisitionModeSet(di.ACQMODE.RECORD)
+        di.dividerSet(divider)
+        di.sampleFormatSet(16)
+        di.triggerSourceSet(di.TRIGSRC.NONE)
+        di.triggerPositionSet(n)  # in record mode the number of samples after the trigger is the length of the record
+        di.configure(0, 1)
+        capture = DigitalCapture(sample_rate)
+        recorded = 0
+        lost = 0
+        last_data = self.clock.time()
+        while recorded < n:
+            state = di.status(True)
+            available = 0
+            if recorded or state not in (di.STATE.CONFIG, di.STATE.PREFILL, di.STATE.ARMED):
+                available, lost_now, corrupt = di.statusRecord()
+                lost = min(lost + lost_now + corrupt, n - recorded)
+            if not available:
+                if self.clock.time() > last_data + timeout:
+                    self.logger.error('DI record timeout occured')
+                    di.configure(0, 0)
+                    return
+                continue
+            available = min(available, n - recorded - lost)
+            if self._di_buffer.size < available:
+                self._di_buffer = np.zeros(available, dtype=np.uint16)
+            block = self._di_buffer[:available]
+            dwf.FDwfDigitalInStatusData(self.hdwf, block.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)), 2 * available)
+            capture.append(block, gap=lost)
+            recorded += available + lost
+            lost = 0
+            last_data = self.clock.time()
+            if callback is not None and callback(block):
+                break
+        di.configure(0, 0)
+        if capture.lost:
+            self.logger.warning(f'{capture.lost} samples were lost during the digital recording (try a lower rate)')
+        return capture
+
+    def play_digital_pattern(self, pattern, frequency=None, pins=None, repeat=1, idle='low', wait=False):
+        """
+        Play a pattern on the digital pins, hardware-timed by the custom pattern generators of DigitalOut.
+        The pattern is uploaded once: the digest of the sequence of every pin is remembered, and pins of which the
+        sequence (and sample rate) didn't change since the previous call are not uploaded again. Compiling arrays into
+        a DigitalPattern is cached as well, so playing the same array repeatedly is cheap.
+        Note that the pins that are driven by DigitalOut override write_digital(), until stop_digital_pattern().
+
+        :param pattern: a compiled pattern, or 16 bit states of shape (n,), or bits of shape (n, lines) (see
+                        DigitalPattern in labphew.core.tools.digital)
+        :type pattern: DigitalPattern or numpy.ndarray
+        :param frequency: sample rate (Hz), rounded to a divider of the internal clock (required for arrays)
+        :type frequency: float or None
+        :param pins: pins to drive (for arrays) (default: None, see DigitalPattern)
+        :type pins: list of int or None
+        :param repeat: number of times to play the pattern, 0 to repeat until stop_digital_pattern() (default: 1)
+        :type repeat: int
+        :param idle: output of the pins when the pattern is not playing: 'low', 'high', 'init' (the first state) or
+                     'hiz' (default: 'low')
+        :type idle: str
+        :param wait: wait until the pattern has finished (ignored when repeating forever) (default: False)
+        :type wait: bool
+        :return: the compiled pattern (or None in case of an error)
+        :rtype: DigitalPattern
+        """
+        pattern = self._compile_pattern(pattern, frequency, pins)
+        if pattern is None:
+            return
+        if idle not in self._do_idle:
+            self.logger.error(f'idle should be one of {list(self._do_idle)}')
+            return
+        do = self.do
+        clock = do.internalClockInfo()
+        divider = max(1, int(round(clock / pattern.sample_rate)))
+        if abs(clock / divider - pattern.sample_rate) > 1e-6 * pattern.sample_rate:
+            self.logger.warning(f'sample rate of the pattern is {clock / divider} Hz instead of {pattern.sample_rate}')
+        if len(pattern) > do.dataInfo(pattern.pins[0]):
+            self.logger.error(f'pattern of {len(pattern)} samples is longer than the buffer of '
+                              f'{do.dataInfo(pattern.pins[0])} samples')
+            return
+        do.configure(0)
+        for pin in set(self._do_uploaded) - set(pattern.pins):
+            do.enableSet(pin, False)
+            del self._do_uploaded[pin]
+        for pin in pattern.pins:
+            key = (pattern.digests[pin], divider, idle)
+            if self._do_uploaded.get(pin) == key:
+                continue
+            do.enableSet(pin, True)
+            do.typeSet(pin, do.TYPE.CUSTOM)
+            do.dividerSet(pin, divider)
+            do.idleSet(pin, getattr(do.IDLE, self._do_idle[idle]))
+            self._upload_digital_pattern(pin, pattern.data[pin], len(pattern))
+            self._do_uploaded[pin] = key
+        period = len(pattern) * divider / clock
+        do.runSet(period)
+        do.repeatSet(repeat)
+        do.configure(1)
+        if wait and repeat:
+            self.clock.sleep(period * repeat)
+            deadline = self.clock.time() + 1.0
+            while do.status() != do.STATE.DONE:
+                if self.clock.time() > deadline:
+                    self.logger.error('DO pattern did not finish')
+                    break
+        return pattern
+
+    def stop_digital_pattern(self):
+        """
+        Stop the pattern generator and release the pins (the uploaded patterns are kept for the next play).
+        """
+        self.do.configure(0)
+        for pin in self._do_uploaded:
+            self.do.enableSet(pin, False)
+        self._do_uploaded.clear()
+
+    def _compile_pattern(self, pattern, frequency, pins):
+        """
+        Internal helper that compiles an array into a DigitalPattern, or takes it from the cache of compiled patterns
+        (keyed by a digest of the array, the frequency and the pins).
+
+        :return: the compiled pattern (or None in case of an error)
+        :rtype: DigitalPattern
+        """
+        if isinstance(pattern, DigitalPattern):
+            return pattern
+        if frequency is None:
+            self.logger.error('specify the frequency of the pattern')
+            return
+        states = np.ascontiguousarray(pattern)
+        key = (hashlib.sha1(states).hexdigest(), states.shape, states.dtype.str, float(frequency),
+               None if pins is None else tuple(pins))
+        if key not in self._pattern_cache:
+            try:
+                compiled = DigitalPattern(states, frequency, pins)
+            except ValueError as e:
+                self.logger.error(f'invalid pattern: {e}')
+                return
+            if len(self._pattern_cache) >= 16:
+                del self._pattern_cache[next(iter(self._pattern_cache))]  # remove the oldest
+            self._pattern_cache[key] = compiled
+        return self._pattern_cache[key]
+
+    def _upload_digital_pattern(self, pin, data, n):
+        """
+        Internal helper that uploads the packed bits of one pin (directly from the array).
+
+        :param pin: pin number
+        :type pin: int
+        :param data: the bits of the pattern, packed lsb first
+        :type data: numpy.ndarray
+        :param n: number of bits
+        :type n: int
+        """
+        dwf.FDwfDigitalOutDataSet(self.hdwf, pin, data.ctypes.data_as(ctypes.POINTER(ctypes.c_ubyte)), n)
+
 
 
 
 
 
+class _SettingsShadow:
+    """
+    Internal wrapper around one of the instruments of the dwf module (e.g. DwfAnalogIn) that keeps a shadow copy of
+    its settings. All attributes of the instrument are available through the wrapper.
+
+    - Calling a ...Set() method clears the shadow values of that setting. For the settings in _indices (per channel,
+      node or pin) only the values of the specified channel/node are cleared, unless the channel is -1 (all channels).
+      All other settings (e.g. with several values, like DigitalIn.triggerSet()) are cleared completely.
+    - Calling a ...Get() method returns the shadow value. If there is none, it is read from the device and stored.
+      Because it is the value reported by the device, it is validated (e.g. the actual frequency the device uses).
+    - Calling reset() clears all shadow values.
+    """
+    # number of leading index arguments (channel, node, pin) of the Set() and Get() methods of per-channel settings
+    _indices = {
+        'AnalogIn': {'channelEnable': 1, 'channelFilter': 1, 'channelRange': 1, 'channelOffset': 1,
+                     'channelAttenuation': 1},
+        'AnalogOut': {'nodeEnable': 2, 'nodeFunction': 2, 'nodeFrequency': 2, 'nodeAmplitude': 2, 'nodeOffset': 2,
+                      'nodeSymmetry': 2, 'nodePhase': 2, 'idle': 1, 'triggerSource': 1, 'triggerSlope': 1, 'run': 1,
+                      'wait': 1, 'repeat': 1, 'repeatTrigger': 1, 'limitation': 1, 'mode': 1},
+        'DigitalOut': {'enable': 1, 'output': 1, 'type': 1, 'idle': 1, 'divider': 1, 'dividerInit': 1, 'counter': 1,
+                       'counterInit': 1},
+    }
+
+    def __init__(self, instrument, name):
+        self._instrument = instrument
+        self._name = name
+        self._settings = {}
+        self._wrapped = {}
+        self.check = False
+        self.logger = logging.getLogger(__name__)
+
+    def __getattr__(self, item):
+        """Called for all attributes that don't exist in the wrapper itself, i.e. those of the instrument"""
+        if item in self._wrapped:
+            return self._wrapped[item]
+        attr = getattr(self._instrument, item)
+        if not callable(attr) or isinstance(attr, type):
+            return attr
+        if item.endswith('Set'):
+            wrapped = self._wrap_set(item[:-3], attr)
+        elif item.endswith('Get'):
+            wrapped = self._wrap_get(item[:-3], attr)
+        elif item == 'reset':
+            wrapped = self._wrap_reset(attr)
+        else:
+            return attr
+        self._wrapped[item] = wrapped
+        return wrapped
+
+    def _wrap_set(self, setting, method):
+        indices = self._indices.get(self._name, {}).get(setting)
+
+        def set_value(*args, **kwargs):
+            if indices is None or kwargs or -1 in args[:indices]:
+                self._invalidate_setting(setting)
+            else:
+                self._invalidate_setting(setting, args[:indices])
+            return method(*args, **kwargs)
+        return set_value
+
+    def _wrap_get(self, setting, method):
+        def get_value(*args):
+            key = (setting,) + args
+            if key in self._settings:
+                value = self._settings[key]
+                if self.check:
+                    device_value = method(*args)
+                    if device_value != value:
+                        self.logger.error(f'Shadow value of {self._name}.{setting}{args} is {value}, but the device reports {device_value}')
+                        self._settings[key] = value = device_value
+                return value
+            value = method(*args)
+            self._settings[key] = value
+            return value
+        return get_value
+
+    def _wrap_reset(self, method):
+        def reset(*args, **kwargs):
+            self.invalidate()
+            return method(*args, **kwargs)
+        return reset
+
+    def _invalidate_setting(self, setting, indices=()):
+        """Clear the shadow values of a setting (only those of the specified channel/node if indices are given)."""
+        n = len(indices)
+        for key in [key for key in self._settings if key[0] == setting and key[1:1 + n] == indices]:
+            del self._settings[key]
+
+    def invalidate(self):
+        """Clear all shadow values."""
+        self._settings.clear()
+
+    def verify(self):
+        """
+        Compare all shadow values with the values on the device, and correct them.
+
+        :return: dictionary of mismatches {(instrument, setting, arguments): (shadow value, device value)}
+        :rtype: dict
+        """
+        mismatches = {}
+        for key, value in list(self._settings.items()):
+            device_value = getattr(self._instrument, key[0] + 'Get')(*key[1:])
+            if device_value != value:
+                self.logger.error(f'Shadow value of {self._name}.{key[0]}{key[1:]} is {value}, but the device reports {device_value}')
+                mismatches[(self._name, key[0], key[1:])] = (value, device_value)
+                self._settings[key] = device_value
+        return mismatches
+
+
 class SimulatedDfwController:
     """
     Rudimentary simulated version of DfwController for the purpose of developing without a connected device.
     Note that it is far from a complete simulation, it just mimics a few basic methods.
-    You can add any simulation function to relate read_analog() to a value set with write_analog() via _analog_simulation_functions.
+    The analog signals are generated in blocks by a SignalSimulator (see labphew.controller.digilent.simulation).
+    You can specify what is connected between analog out and analog in by passing a DeviceUnderTest (dut).
+    All waiting is done on self.clock. Pass a VirtualClock (see labphew.core.tools.clock) to run faster than real time.
     """
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, clock=None, dut=None, **kwargs):
         self.logger = logging.getLogger(__name__)
-        self._analog_in_values = [0.0, 0.0]  # empty dictionary to hold simulated analog values
-        # self._analog_simulation_functions = [lambda v: np.exp(v-0.7)/20, lambda v: np.random.normal(1,.5)]
-        self._analog_simulation_functions = [lambda v: np.random.normal(1, .5), lambda v: np.exp(v - 0.7) / 20]
+        self.clock = wall_clock if clock is None else clock
+        self.simulator = SignalSimulator(dut)
+        self.digital_simulator = DigitalSimulator()
+        self._ai_block = np.zeros((2, 0))  # the last simulated acquisition
         self.basic_analog_return_std = False
+        self._time_stabilized = self.clock.time()
+        self._last_ao0 = 0
+        self._last_ao1 = 0
+        self._profiles = {}
+        self._auto_configure = True  # the simulated node settings are applied immediately
         from collections import defaultdict
 
         class Dummy:
@@ -438,12 +1164,37 @@ class SimulatedDfwController:
                     return lambda *args, **kwargs: None
 
         self.AnalogIn = Dummy()
-        self.AnalogIn.statusData = lambda ch, n: tuple(np.random.normal(size=n))
+        self.AnalogIn.configure = self._simulated_ai_configure
+        self.AnalogIn.statusData = lambda ch, n: self._ai_block[ch, :n].copy()
+        self.AnalogIn.TRIGSRC = Dummy(NONE=0, PC=1, DETECTOR_ANALOG_IN=2, DETECTOR_DIGITAL_IN=3, ANALOG_IN=4,
+                                      DIGITAL_IN=5, DIGITAL_OUT=6, ANALOG_OUT1=7, ANALOG_OUT2=8, ANALOG_OUT3=9,
+                                      ANALOG_OUT4=10, EXTERNAL1=11, EXTERNAL2=12, EXTERNAL3=13, EXTERNAL4=14)
+        self.AnalogIn.TRIGTYPE = Dummy(EDGE=0, PULSE=1, TRANSITION=2)
+        self.AnalogIn.TRIGCOND = Dummy(RISING_POSITIVE=0, FALLING_NEGATIVE=1)
         self.AnalogOut = Dummy()
+        for key, setter in self._ao_node_setters.items():
+            setattr(self.AnalogOut, setter, self._simulated_ao_setter(key))
+        self.AnalogOut.configure = lambda channel, start: self.simulator.set_ao(channel, enable=bool(start))
+        self.AnalogOut.reset = lambda channel=-1, parent=False: self.simulator.reset_ao(channel)
         self.AnalogOut.NODE = Dummy(CARRIER=0, FM=1, AM=2)
         self.AnalogOut.FUNC = Dummy(DC=0, SINE=1, SQUARE=2, TRIANGLE=3, RAMP_UP=4, RAMP_DOWN=5, NOISE=6, CUSTOM=30, PLAY=31)
+        self.AnalogOut.nodeDataInfo = lambda channel, node: (1, 4096)
         self.DigitalIn = Dummy()
         self.DigitalOut = Dummy()
+        self.DigitalOut.internalClockInfo = lambda: 100e6
+        self.DigitalOut.dataInfo = lambda pin: 16384
+        self.DigitalOut.configure = self._simulated_do_configure
+        self.DigitalOut.status = lambda: (self.do.STATE.DONE if self.clock.time() >= self._do_end
+                                          else self.do.STATE.RUNNING)
+        self.DigitalOut.TYPE = Dummy(PULSE=0, CUSTOM=1, RANDOM=2)
+        self.DigitalOut.IDLE = Dummy(INIT=0, LOW=1, HIGH=2, HiZ=3)
+        self.DigitalOut.STATE = Dummy(READY=0, ARMED=1, DONE=2, TRIGGERED=3, RUNNING=3, CONFIG=4, PREFILL=5, WAIT=7)
+        self._do_data = {}  # the uploaded patterns, see _upload_digital_pattern()
+        self._do_uploaded = {}
+        self._pattern_cache = {}
+        self._do_end = 0  # time at which the pattern finishes
+        self._waveform_cache = {}
+        self._ao_data_info = {}
         self.AnalogIO = Dummy()
         self.DigitalIO = Dummy()
         # create short name references
@@ -452,6 +1203,8 @@ class SimulatedDfwController:
         self.di = self.DigitalIn
         self.do = self.DigitalOut
 
+        self.shadow_check = False  # the Dummy instruments store the settings in memory anyway
+        self.preset_basic_analog()
         self.logger.debug('SimulatedDfwController object created')
 
     def __getattr__(self, item):
@@ -464,33 +1217,168 @@ class SimulatedDfwController:
     def __len__(self):
         pass
 
+    # The analog out methods are the same as those of DfwController, the simulated AnalogOut applies them to the simulator
+    _ao_node_setters = DfwController._ao_node_setters
+    _ao_live_settings = DfwController._ao_live_settings
+    stop_analog_out = DfwController.stop_analog_out
+    write_analog = DfwController.write_analog
+    update_analog_out = DfwController.update_analog_out
+    analog_out_transaction = DfwController.analog_out_transaction
+    write_waveform = DfwController.write_waveform
+    _prepare_waveform = DfwController._prepare_waveform
+    # Acquisition profiles are also shared
+    register_profile = DfwController.register_profile
+    apply_profile = DfwController.apply_profile
+    # The trigger settings are stored by the Dummy AnalogIn, capture_frame() simulates the trigger
+    _trigger_sources = DfwController._trigger_sources
+    configure_trigger = DfwController.configure_trigger
+    disable_trigger = DfwController.disable_trigger
+    # Digital patterns are compiled and cached the same way, the simulated DigitalOut checks the timing and plays them
+    _do_idle = DfwController._do_idle
+    play_digital_pattern = DfwController.play_digital_pattern
+    stop_digital_pattern = DfwController.stop_digital_pattern
+    _compile_pattern = DfwController._compile_pattern
+
+    def _simulated_ao_setter(self, key):
+        """Returns a simulated version of one of the AnalogOut.node...Set() methods."""
+        def set_value(channel, node, value):
+            if key in self.simulator.ao[0]:
+                self.simulator.set_ao(channel, **{key: value})
+        return set_value
+
+    def _simulated_ai_configure(self, reconfigure, start):
+        """
+        Simulated version of AnalogIn.configure(). Applies the analog in settings to the simulator and, if start is
+        True, simulates an acquisition of bufferSize samples (which can then be retrieved with AnalogIn.statusData).
+        """
+        self.simulator.frequency = float(self.ai.frequencyGet())
+        self.simulator.range = float(self.ai.channelRangeGet(-1))
+        if start:
+            n = int(self.ai.bufferSizeGet())
+            if self._ai_block.shape[1] != n:
+                self._ai_block = np.empty((2, n))
+            self.simulator.acquire(n, out=self._ai_block)
+
+    def _upload_waveform(self, channel, shape):
+        """Simulated version of _upload_waveform(). Applies the waveform to the simulator."""
+        self.simulator.set_ao(channel, data=shape)
+
+    def _upload_digital_pattern(self, pin, data, n):
+        """Simulated version of _upload_digital_pattern(). Stores the packed bits."""
+        self._do_data[pin] = (data.copy(), n)
+
+    def _simulated_do_configure(self, start):
+        """
+        Simulated version of DigitalOut.configure(). Checks the timing of the enabled pins (equal dividers and pattern
+        lengths, a run time of whole periods) and plays the pattern on the DigitalSimulator, so that record_digital()
+        shows it.
+        """
+        if not start:
+            self.digital_simulator.stop()
+            self._do_end = 0
+            return
+        pins = [pin for pin in self._do_data if self.do.enableGet(pin)]
+        if not pins:
+            return
+        dividers = {self.do.dividerGet(pin) for pin in pins}
+        lengths = {self._do_data[pin][1] for pin in pins}
+        if len(dividers) > 1 or len(lengths) > 1:
+            self.logger.error(f'the enabled pins have different dividers {dividers} or pattern lengths {lengths}, so '
+                              f'their patterns would not stay aligned')
+        divider, n = self.do.dividerGet(pins[0]), self._do_data[pins[0]][1]
+        sample_rate = 100e6 / divider
+        run = int(round(self.do.runGet() * sample_rate))
+        if run % n:
+            self.logger.warning(f'the run time of {run} samples is not a whole number of periods of {n} samples, so '
+                                f'the pattern is cut off at the end of every run')
+        states = np.zeros(n, dtype=np.uint16)
+        mask = idle = 0
+        for pin in pins:
+            data, _ = self._do_data[pin]
+            states |= np.unpackbits(data, bitorder='little')[:n].astype(np.uint16) << pin
+            mask |= 1 << pin
+            if self.do.idleGet(pin) == self.do.IDLE.HIGH or (self.do.idleGet(pin) == self.do.IDLE.INIT and
+                                                             states[0] >> pin & 1):
+                idle |= 1 << pin
+        repeat = self.do.repeatGet()
+        self.digital_simulator.play(states, sample_rate, mask, run, repeat, idle)
+        self._do_end = self.clock.time() + run * repeat / sample_rate if repeat else np.inf
+        self.logger.debug(f'playing pattern of {n} samples at {sample_rate} Hz on pins {pins}, {repeat} runs of '
+                          f'{run} samples')
+
     def read_analog(self):
         """
         Simulated version of read_analog().
-        Applies functions specified in self._analog_simulation_functions (optionally to the values set by write_analog() ).
+        Simulates an acquisition of both channels (and waits for the time that would take).
         """
-        time.sleep(0.01)
-        results = [func(v) for func, v in zip(self._analog_simulation_functions, self._analog_in_values)]
+        c0, c1 = self.read_analog_block()
         if self.basic_analog_return_std:
-            return tuple([*results, results[0]/10, results[1]/10])
+            return c0.mean(), c1.mean(), c0.std(), c1.std()
         else:
-            return tuple(results)
+            return c0.mean(), c1.mean()
+
+    def read_analog_block(self, raw=False):
+        """
+        Simulated version of read_analog_block().
+        Simulates an acquisition of both channels (and waits for the time that would take).
 
-    def write_analog(self, volt, channel=-1):
+        :param raw: return raw int16 values instead of voltages (default: False)
+        :type raw: bool
+        :return: array of shape (2, buffer size)
+        :rtype: numpy.ndarray
         """
-        Simulated version of write_analog().
+        self.ai.configure(0, 1)  # start acquisition
+        self.clock.sleep(0.002 + self._ai_block.shape[1] / self.simulator.frequency)
+        if raw:
+            return np.round(self._ai_block * (65536 / self.simulator.range)).clip(-32768, 32767).astype(np.int16)
+        return self._ai_block
 
-        :param volt:
-        :type volt:
-        :param channel:
-        :type channel:
-        :return:
-        :rtype:
+    def capture_frame(self, timeout=1.0, raw=False):
+        """
+        Simulated version of capture_frame().
+        Simulates acquisitions until the trigger condition is found in the signal (and waits for the time that would
+        take). Only the 'analog_in' trigger source is simulated: 'none', 'pc' and the analog out sources capture
+        immediately and the other sources only capture after the auto timeout.
+
+        :param timeout: time (s) to wait for a trigger (on top of the duration of the frame) (default: 1.0)
+        :type timeout: float
+        :param raw: return raw int16 values instead of voltages (default: False)
+        :type raw: bool
+        :return: array of shape (2, buffer size) (or None if no trigger occurred within the timeout)
+        :rtype: numpy.ndarray
         """
-        if channel == 0 or channel == -1:
-            self._analog_in_values[0] = volt
-        if channel == 1 or channel == -1:
-            self._analog_in_values[1] = volt
+        trigger = self.trigger
+        if trigger is None or trigger['source'] in ('none', 'pc', 'analog_out1', 'analog_out2'):
+            return self.read_analog_block(raw)
+        self._simulated_ai_configure(1, 0)
+        n = int(self.ai.bufferSizeGet())
+        duration = 2 * n / self.simulator.frequency
+        pre = int(round(trigger['position'] * n))
+        waited = 0
+        while True:
+            # search for a trigger with enough samples before and after it
+            data = self.simulator.acquire(2 * n)
+            self.clock.sleep(duration)
+            waited += duration
+            index = None
+            if trigger['source'] == 'analog_in':
+                index = find_trigger(data[trigger['channel']], trigger['level'], trigger['hysteresis'],
+                                     trigger['edge'], start=pre, stop=pre + n)
+            if index is not None:
+                frame = data[:, index - pre:index - pre + n]
+                break
+            if trigger['auto_timeout'] and waited >= trigger['auto_timeout']:
+                frame = data[:, :n]
+                break
+            if waited >= timeout + n / self.simulator.frequency:
+                self.logger.debug('no trigger within timeout')
+                return None
+        if self._ai_block.shape[1] != n:
+            self._ai_block = np.empty((2, n))
+        self._ai_block[:] = frame
+        if raw:
+            return np.round(self._ai_block * (65536 / self.simulator.range)).clip(-32768, 32767).astype(np.int16)
+        return self._ai_block
 
     def wait_for_ai_acquisition(self, start_timestamp=None):
         """
@@ -499,15 +1387,15 @@ class SimulatedDfwController:
         :param start_timestamp: is ignored in simulated version
         :type start_timestamp: float or None
         """
-        time.sleep(0.1)
+        self.clock.sleep(0.1)
 
     def wait_for_stabilization(self):
         """Simulated version of wait_for_stabilization(). Waits for 0.1s."""
-        time.sleep(0.1)
+        self.clock.sleep(0.1)
 
     def preset_basic_analog(self, n=80, freq=10000, range=50.0, return_std=False):
         """
-        Simulated version of preset_basic_analog. Basically does nothing.
+        Simulated version of preset_basic_analog. Applies the settings to the simulator.
 
         :param n:     number of datapoints to collect and average (default 85)
         :type n:      int
@@ -518,10 +1406,30 @@ class SimulatedDfwController:
         :param return_std: also returns the standard deviations (default False)
         :type return_std:  bool
         """
+        self.ao.reset()
+        self._ao_state = [{'function': self.ao.FUNC.DC, 'enable': True}, {'function': self.ao.FUNC.DC, 'enable': True}]
+        self._last_ao0 = 0
+        self._last_ao1 = 0
+        self.trigger = None
+        self.ai.bufferSizeSet(n)
         self.ai.frequencySet(freq)
-        self.ai.channelRangeSet(-1, int(range))
+        self.ai.channelRangeSet(-1, range)
+        self.ai.configure(1, 0)  # apply config to AI, but not start
+        self._ai_state = {'n': n, 'freq': freq, 'range': range}
+        self.register_profile('basic', n, freq, range, return_std)  # to return to these settings with apply_profile()
+        self.active_profile = 'basic'
         self.basic_analog_return_std = return_std
 
+    def verify_settings(self):
+        """Simulated version of verify_settings(). The simulated settings are always consistent."""
+        return {}
+
+    def invalidate_settings(self):
+        """Simulated version of invalidate_settings()."""
+        self._ao_state = [{}, {}]
+        self._ai_state = {}
+        self._do_uploaded = {}
+
     def close(self):
         pass
 
@@ -544,6 +1452,34 @@ class SimulatedDfwController:
         """Dummy method for "simulated device". See DfwController for intended use."""
         pass
 
+    def record_digital(self, duration, frequency=1e6, callback=None, timeout=1.0):
+        """
+        Simulated version of record_digital().
+        The lines show a binary counter (see DigitalSimulator in labphew.controller.digilent.simulation), generated in
+        blocks of 65536 samples (waiting for the time each block would take).
+
+        :param duration: duration of the recording (s)
+        :type duration: float
+        :param frequency: sample rate (Hz), rounded to a divider of the (simulated) 100MHz clock (default: 1e6)
+        :type frequency: float
+        :param callback: function that is called with every block of samples, return True from it to stop recording
+        :type callback: callable or None
+        :param timeout: is ignored in simulated version
+        :type timeout: float
+        :return: the capture
+        :rtype: DigitalCapture
+        """
+        sample_rate = 100e6 / max(1, int(round(100e6 / frequency)))
+        n = int(round(duration * sample_rate))
+        capture = DigitalCapture(sample_rate)
+        for start in range(0, n, 2**16):
+            block = self.digital_simulator.acquire(min(2**16, n - start), sample_rate)
+            self.clock.sleep(len(block) / sample_rate)
+            capture.append(block)
+            if callback is not None and callback(block):
+                break
+        return capture
+
     def get_IO_pin_mode(self, as_list=True):
         """Dummy method for "simulated device". See DfwController for intended use."""
         if as_list:
@@ -552,81 +1488,153 @@ class SimulatedDfwController:
             return 0
 
 
+# Registry of the open Digilent devices in this process (keyed by serial number), see open_device()
+device_registry = DeviceRegistry()
+
+
+def open_device(serial_number=None, config=0, clock=None, simulated=False):
+    """
+    Get a shared, reference-counted handle to a DfwController.
+    The first call for a device opens it, later calls (e.g. from other operators or windows) share the open connection.
+    The handle can be used like a DfwController, its methods are called while holding a per-device lock.
+    Call release() on the handle when you're done: the device is closed when the last handle is released.
+    Note that config and clock are only used when the device is actually opened.
+
+    :param serial_number: serial number of the device (default: None, meaning the first device found)
+    :type serial_number: str or None
+    :param config: configuration number (default: 0)
+    :type config: int
+    :param clock: clock used for timing, see labphew.core.tools.clock (default: None, meaning the wall clock)
+    :type clock: WallClock or None
+    :param simulated: share a SimulatedDfwController instead (serial_number is used as name) (default: False)
+    :type simulated: bool
+    :return: handle to the controller (None if the device is not found or can't be opened)
+    :rtype: labphew.core.tools.device_registry.DeviceHandle
+    """
+    if simulated:
+        key = 'simulated' if serial_number is None else serial_number
+        return device_registry.acquire(key, lambda: SimulatedDfwController(clock=clock))
+    for device_number, device in enumerate(enumerate_devices()):
+        sn = device['info']['SN']
+        if serial_number is None or sn == serial_number:
+            return device_registry.acquire(sn, lambda: DfwController(device_number, config, clock))
+    logging.getLogger(__name__).error(f'Digilent device {serial_number} not found')
+
+
 def close_all():
     """Close all Digilent "WaveForms" devices"""
     dwf.FDwfDeviceCloseAll()
 
 
-def enumerate_devices():
+# Cache of enumerate_devices(): the static information (maxAIfreq and configs) is stored per serial number
+_enumeration_cache = {'time': None, 'count': None, 'devices': [], 'static': {}}
+
+
+def _device_config_info(index, device):
     """
-    List connected devices and their possible configurations.
+    Read the maximum analog in frequency and the possible configurations of an (unopened) device.
+    Note that this opens the device, which can take seconds.
+
+    :return: dictionary with maxAIfreq and configs
+    :rtype: dict
+    """
+    ch = lambda n=0, b=0: {'ch': n, 'buf': b}
+    dwf_ai = dwf.DwfAnalogIn(device)
+    channel = dwf_ai.channelCount()
+    _, hzFreq = dwf_ai.frequencyInfo()
+    dwf_ai.close()
+    configs = []
+    n_configs = dwf.FDwfEnumConfig(index)
+    for iCfg in range(0, n_configs):
+        aic = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogInChannelCount)  # 1
+        aib = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogInBufferSize)  # 7
+        aoc = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogOutChannelCount)  # 2
+        aob = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogOutBufferSize)  # 8
+        dic = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalInChannelCount)  # 4
+        dib = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalInBufferSize)  # 9
+        doc = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalOutChannelCount)  # 5
+        dob = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalOutBufferSize)  # 10
+        configs.append({'ai': ch(aic, aib), 'ao': ch(aoc, aob), 'di': ch(dic, dib), 'do': ch(doc, dob)})
+    return {'maxAIfreq': hzFreq, 'configs': configs}
+
+
+def enumerate_devices(config_info=False, max_age=30.0):
+    """
+    List connected devices and (optionally) their possible configurations.
     Note: Use print_device_list() to easily display the result in readable form.
 
+    The result is cached. The cached list is returned if it's younger than max_age and the number of connected devices
+    didn't change. Reading the configurations requires opening the device, which can take seconds per device. Therefore
+    they are only read if config_info is True, and stored per serial number so they are read only once per device.
+    Without config info the 'configs' entry is an empty list.
+
+    :param config_info: also read the maximum analog in frequency and the possible configurations (default: False)
+    :type config_info: bool
+    :param max_age: maximum age (s) of the cached list (default: 30), use 0 to force a new enumeration
+    :type max_age: float
     :return: list of dictionaries containing information about the devices found
     :rtype: list
     """
+    cache = _enumeration_cache
     devices = []
     try:
         last_err_msg = dwf.FDwfGetLastErrorMsg()
         if last_err_msg:
             logging.getLogger(__name__).warning(last_err_msg)
-        # enumerate devices
-        devs = dwf.DwfEnumeration()
-        ch = lambda n=0, b=0: {'ch': n, 'buf': b}
-
-        for i, device in enumerate(devs):
+        # enumerate devices (this also detects added or removed devices)
+        count = dwf.FDwfEnum(dwf.enumfilterAll)
+        if cache['count'] == count and cache['time'] is not None and time.monotonic() - cache['time'] < max_age:
+            if not config_info or all(type(dev['configs']) is list and dev['configs'] for dev in cache['devices']):
+                return _copy_devices(cache['devices'])
+
+        for i in range(count):
+            device = dwf.DwfDevice(i)
             dev_dict = {'info': {}, 'configs': []}
             dev_dict['info']['SN'] = device.SN()
             dev_dict['info']['deviceName'] = device.deviceName()
             dev_dict['info']['userName'] = device.userName()
             dev_dict['dev'] = device
 
-            if device.isOpened():
-                logging.getLogger(__name__).warning(f"Can't connect to device {i} ({dev_dict['info']['SN']}), a connection is already open.\n"
-                                                     "Note that the list was stored in "+__name__+".devices at the moment of import.")
-                dev_dict['configs'] = "Couldn't connect to device for further information"
-            else:
-                dwf_ai = dwf.DwfAnalogIn(device)
-                channel = dwf_ai.channelCount()
-                _, hzFreq = dwf_ai.frequencyInfo()
-                dev_dict['info']['maxAIfreq'] = hzFreq
-                dwf_ai.close()
-
-                n_configs = dwf.FDwfEnumConfig(i)
-                for iCfg in range(0, n_configs):
-                    aic = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogInChannelCount)  # 1
-                    aib = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogInBufferSize)  # 7
-                    aoc = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogOutChannelCount)  # 2
-                    aob = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIAnalogOutBufferSize)  # 8
-                    dic = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalInChannelCount)  # 4
-                    dib = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalInBufferSize)  # 9
-                    doc = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalOutChannelCount)  # 5
-                    dob = dwf.FDwfEnumConfigInfo(iCfg, dwf.DECIDigitalOutBufferSize)  # 10
-                    dev_dict['configs'].append({'ai': ch(aic, aib), 'ao': ch(aoc, aob), 'di': ch(dic, dib), 'do': ch(doc, dob)})
-                dwf_ai.close()
+            static = cache['static'].get(dev_dict['info']['SN'])
+            if static is None and config_info:
+                if device.isOpened():
+                    logging.getLogger(__name__).warning(f"Can't connect to device {i} ({dev_dict['info']['SN']}), a connection is already open.\n"
+                                                         "Note that config info is cached per device, so enumerate with config_info=True before opening it.")
+                    dev_dict['configs'] = "Couldn't connect to device for further information"
+                else:
+                    static = _device_config_info(i, device)
+                    cache['static'][dev_dict['info']['SN']] = static
+            if static is not None:
+                dev_dict['info']['maxAIfreq'] = static['maxAIfreq']
+                dev_dict['configs'] = static['configs']
             devices.append(dev_dict)
+        cache.update({'time': time.monotonic(), 'count': count, 'devices': devices})
     except:
         from sys import exc_info
-        logging.getLogger(__name__).warning("Exception occured while enumerating devices:\n", exc_info()[0])
-    return devices
+        logging.getLogger(__name__).warning(f"Exception occured while enumerating devices: {exc_info()[0]}")
+    return _copy_devices(devices)
+
 
+def _copy_devices(devices):
+    """Copy of a list of enumerate_devices(), such that changing it doesn't change the cache (the DwfDevice is shared)."""
+    return [dict(dev, info=dict(dev['info']), configs=copy.deepcopy(dev['configs'])) for dev in devices]
 
-# Run enumerate_devices() once when loading the module to make the list available afterwards
+
+# Run enumerate_devices() once when loading the module to make the list available afterwards (without config info, which is fast)
 devices = enumerate_devices()
 
 
 def print_device_list(devices_list=None):
     """
     Prints the information in the list generated by enumerate_devices() in a readable form.
-    If no argument is given it prints the list stored at time of importing the module.
+    If no argument is given it prints the (cached) list including configurations (see enumerate_devices()).
 
-    :param devices: the list generated by enumerate_devices() (or None (default) to print the list stored at import)
+    :param devices: the list generated by enumerate_devices() (or None (default) to print the list with configurations)
     :type devices: list
     """
     incomplete = False
     if devices_list is None:
-        global devices
-        devices_list = list(devices)
+        devices_list = enumerate_devices(config_info=True)
         incomplete = None
     for i, device in enumerate(devices_list):
         print("------------------------------")
@@ -650,7 +1658,7 @@ def print_device_list(devices_list=None):
                           conf['do']['ch'], conf['do']['buf']))
     if incomplete:
         print("\nThe device list appears to be incomplete. "
-              "Try "+__name__+".devices_list() without argument to print the list stored at time of import")
+              "Try "+__name__+".print_device_list() without argument before opening a connection to the device(s)")
 
 
 if __name__ == '__main__':
@@ -659,7 +1667,7 @@ if __name__ == '__main__':
     import matplotlib.pyplot as plt
 
     # Display a list of devices and their possible configurations
-    devs = enumerate_devices()
+    devs = enumerate_devices(config_info=True)
     print_device_list(devs)
 
     # Create object for device number 0, with config number 0
@@ -748,6 +1756,26 @@ if __name__ == '__main__':
     plt.xlabel("time (s)")
     plt.ylabel("analog in channel 0 (V)")
 
+    # Example of an arbitrary waveform (a gaussian pulse, 0 to 1V) on analog out channel 0 at 1kHz:
+    t = np.linspace(0, 1, 1024, endpoint=False)
+    daq.write_waveform(np.exp(-((t - 0.5) / 0.05) ** 2), 1000, channel=0)
+    daq.write_waveform(np.exp(-((t - 0.5) / 0.05) ** 2), 1000, channel=0, amplitude=0.25)  # no data is transferred
+    daq.stop_analog_out(0)
+
+    # Example of playing a pattern on digital pins 0 (clock) and 1 (data), repeated 10 times:
+    print("\nPlaying a 16 sample pattern at 1MHz on pins 0 and 1")
+    bits = np.column_stack((np.tile([0, 1], 8), np.repeat([1, 0, 1, 1, 0, 0, 1, 0], 2)))
+    pattern = daq.play_digital_pattern(bits, 1e6, repeat=10, wait=True)
+    daq.play_digital_pattern(pattern, repeat=10, wait=True)  # playing it again doesn't upload it again
+    daq.stop_digital_pattern()
+
+    # Example of recording the digital lines (logic analyzer):
+    print("\nRecording the 16 digital lines for 1s at 1MHz")
+    capture = daq.record_digital(1.0, 1e6)
+    if capture is not None:
+        print(f"{len(capture)} transitions, {capture.lost} samples lost, "
+              f"{len(capture.edges(0, 'rising'))} rising edges on line 0")
+
     # to close the device:
     # daq.close()
 
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+================
+Simulated camera
+================
+
+A camera that generates frames in software. It implements the BaseCamera API so it can stand in for a real camera
+(like the BaslerCamera) when developing or benchmarking without hardware.
+
+The frames consist of a constant background with a few Gaussian spots that drift slowly, plus Gaussian read noise.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import logging
+import time
+import numpy as np
+
+from labphew.core.base.camera_base import BaseCamera
+
+
+class SimulatedCamera(BaseCamera):
+    """
+    Simulated camera that produces uint16 frames of configurable size.
+    """
+    def __init__(self, camera='simulated', width=1024, height=1024, n_spots=10):
+        """
+        Create a simulated camera.
+
+        :param camera: name of the camera (only used for display)
+        :type camera: str
+        :param width: sensor width in pixels (default: 1024)
+        :type width: int
+        :param height: sensor height in pixels (default: 1024)
+        :type height: int
+        :param n_spots: number of simulated spots in the image (default: 10)
+        :type n_spots: int
+        """
+        super().__init__(camera)
+        self.logger = logging.getLogger(__name__)
+        self.mode = self.MODE_SINGLE_SHOT
+        self._width = width
+        self._height = height
+        self._rng = np.random.default_rng()
+        self._spots = self._rng.uniform(0, 1, size=(n_spots, 2)) * [width, height]
+        self.exposure = 10  # ms
+        self.gain = 1
+        self.X = [0, width - 1]
+        self.Y = [0, height - 1]
+        self._triggered = False
+        self.logger.debug('SimulatedCamera object created')
+
+    def initialize(self):
+        """ Initializes the simulated camera. """
+        self.max_width = self.GetCCDWidth()
+        self.max_height = self.GetCCDHeight()
+        return True
+
+    def GetCCDWidth(self):
+        return self._width
+
+    def GetCCDHeight(self):
+        return self._height
+
+    def get_size(self):
+        """ Returns the size of the frames (width, height) as set by the ROI. """
+        return self.X[1] - self.X[0] + 1, self.Y[1] - self.Y[0] + 1
+
+    def set_ROI(self, X, Y):
+        """
+        Set the region of interest.
+
+        :param list X: first and last pixel in x
+        :param list Y: first and last pixel in y
+        :return: X, Y
+        """
+        self.X = [max(0, int(X[0])), min(self._width - 1, int(X[1]))]
+        self.Y = [max(0, int(Y[0])), min(self._height - 1, int(Y[1]))]
+        return self.X, self.Y
+
+    def set_exposure(self, exposure):
+        """ Sets the exposure in ms. Only scales the simulated intensity, it does not sleep. """
+        self.exposure = float(exposure)
+        return self.exposure
+
+    def set_gain(self, gain):
+        self.gain = float(gain)
+        return self.gain
+
+    def trigger_camera(self):
+        self._triggered = True
+
+    def acquisition_ready(self):
+        return self._triggered or self.mode == self.MODE_CONTINUOUS
+
+    def read_camera(self):
+        """
+        Generate a frame.
+
+        :return: list containing one frame (as in BaslerCamera.read_camera())
+        :rtype: list of numpy.ndarray
+        """
+        if self.mode == self.MODE_SINGLE_SHOT and not self._triggered:
+            self.logger.warning('You need to trigger the camera before reading')
+            return []
+        self._triggered = False
+        width, height = self.get_size()
+        x = np.arange(self.X[0], self.X[0] + width, dtype=np.float32)
+        y = np.arange(self.Y[0], self.Y[0] + height, dtype=np.float32)
+        self._spots += self._rng.normal(0, 0.5, size=self._spots.shape)
+        # Separable Gaussians: the image is a sum of outer products of 1D profiles
+        gx = np.exp(-(x[None, :] - self._spots[:, 0:1]) ** 2 / 8)
+        gy = np.exp(-(y[None, :] - self._spots[:, 1:2]) ** 2 / 8)
+        signal = gx.T @ gy * (50 * self.exposure)
+        signal += 100
+        frame = signal * self.gain + self._rng.normal(0, 5, size=signal.shape)
+        img = np.clip(frame, 0, 65535).astype(self.data_type)
+        self.temp_image = img
+        return [img]
+
+    def stop_camera(self):
+        self._triggered = False
+
+    def __str__(self):
+        return f"Simulated Camera {self.cam_num}"
+
+
+if __name__ == "__main__":
+    import labphew  # Import labphew, for labphew style logging
+
+    cam = SimulatedCamera()
+    cam.initialize()
+    cam.set_ROI([0, 255], [0, 127])
+    t0 = time.time()
+    for i in range(100):
+        cam.trigger_camera()
+        frame = cam.read_camera()[0]
+    print(f'{frame.shape} frames at {100 / (time.time() - t0):.1f} fps')
@@ -27,7 +27,6 @@
 """
 import numpy as np
 
-from labphew import Q_
 #from experimentor.lib.log import get_logger
 
 #logger = get_logger(__name__)
@@ -102,7 +101,8 @@ class BaseCamera():
                 exposure = properties['exposure_time']
                 #self.logger.info(f'Updating exposure to {exposure}')
                 if isinstance(exposure, str):
-                    exposure = Q_(exposure)
+                    from pint import UnitRegistry  # only needed for exposure given as string, like '10 ms'
+                    exposure = UnitRegistry().Quantity(exposure)
 
                 new_exp = self.set_exposure(exposure)
                 self.config['exposure_time'] = new_exp
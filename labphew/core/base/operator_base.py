@@ -70,6 +70,58 @@ class OperatorBase:
         your GUI to actually use those save methods. 
         """)
 
+    def write_dataset(self, filename, data, append=False):
+        """
+        Save a dataset to a netCDF4 file and add it to the catalog (see add_to_catalog()), to be called by save_scan().
+        With append the dataset is appended as new run to a container file (see labphew.data.container), which is
+        created if it doesn't exist.
+
+        :param filename: full path and filename
+        :type filename: str
+        :param data: the dataset
+        :type data: xarray.Dataset
+        :param append: append to a container file (default: False)
+        :type append: bool
+        """
+        if not append:
+            data.to_netcdf(filename)
+            self.logger.info('Data saved in {}'.format(filename))
+            self.add_to_catalog(filename, data)
+            return
+        from labphew.data.container import append_run
+        try:
+            run = append_run(filename, data)
+        except (OSError, ValueError) as e:
+            self.logger.error(f'could not append to {filename} ({e})')
+            return
+        self.logger.info(f'Data saved as run {run} in {filename}')
+        self.add_to_catalog(filename, data, run)
+
+    def add_to_catalog(self, filename, data=None, run=None):
+        """
+        Add a saved file (or run of a container file) to the catalog of saved datasets (see labphew.data.catalog)
+        (called by write_dataset()).
+        The catalog file is properties['catalog'] (default: labphew.data.catalog.default_path), a value of
+        None (null in the config file) turns the catalog off.
+        Errors are logged, but don't affect saving.
+
+        :param filename: the saved file
+        :type filename: str
+        :param data: the saved dataset (default: None, meaning the file is read)
+        :type data: xarray.Dataset or None
+        :param run: index of the run, if data was appended to a container file (default: None)
+        :type run: int or None
+        """
+        from labphew.data.catalog import Catalog, default_path
+        path = getattr(self, 'properties', {}).get('catalog', default_path)
+        if not path:
+            return
+        try:
+            with Catalog(path) as catalog:
+                catalog.add(filename if data is None else data, filename, run)
+        except Exception as e:
+            self.logger.warning(f'could not add {filename} to the catalog {path} ({e})')
+
     def disconnect_devices(self):
         self.logger.warning(f"Your {self.__class__.__name__} is missing the disconnect_devices method. Use that to disconnect from your devices when required.")
 
@@ -38,7 +38,7 @@ def _check_method_presence(cls, base, method):
         # last option: cls has a different implementation of the method
         return True, True
 
-def check_method_presence_and_warn(cls, required, recommended):
+def check_method_presence_and_warn(cls, required, recommended, base=None):
     """
     Test if required or recommended methods are present in the class and warns the user with print messages.
     Uses _check_method_presence() to check if the method is in the class itself or in the parent/base class and also
@@ -51,8 +51,12 @@ def check_method_presence_and_warn(cls, required, recommended):
     :type required: list
     :param recommended: recommended method names
     :type recommended: list
+    :param base: the base class (default: None, meaning the parent of cls). Methods that cls inherits from a class in
+                 between (e.g. a subclass of a working Monitor window) are considered present.
+    :type base: python class
     """
-    base = cls.mro()[1]
+    if base is None:
+        base = cls.mro()[1]
     missing_required = []
     for method in required:
         if _check_method_presence(cls, base, method)[0] != True:
@@ -30,7 +30,7 @@ class MonitorWindowBase(QMainWindow):
         """
         required = ['__init__']
         recommended = ['closeEvent', 'load_scan_guis', 'open_scan_window', 'start_monitor', 'stop_monitor', 'update_monitor']
-        check_method_presence_and_warn(cls, required, recommended)
+        check_method_presence_and_warn(cls, required, recommended, base=MonitorWindowBase)
         return super().__new__(cls)
 
     def __init__(self, parent=None, *args, **kwargs):
@@ -138,7 +138,7 @@ class ScanWindowBase(QMainWindow):
         """
         required = ['__init__']
         recommended = ['closeEvent', 'mod_scan_config', 'reset_fields', 'start_scan', 'pause_scan', 'stop_scan', 'kill_scan', 'update_scan']
-        check_method_presence_and_warn(cls, required, recommended)
+        check_method_presence_and_warn(cls, required, recommended, base=ScanWindowBase)
         return super().__new__(cls)
 
     def __init__(self, parent=None, *args, **kwargs):
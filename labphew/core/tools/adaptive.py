@@ -0,0 +1,119 @@
+"""
+labphew.core.tools.adaptive
+===========================
+
+Adaptive sampling of a 1D response, for scans that resolve sharp features without measuring flat regions in detail.
+
+The AdaptiveSampler starts with a coarse uniform grid and then repeatedly proposes the midpoint of the interval with
+the largest loss. The loss of an interval is the largest of:
+
+- the change of the response over the interval
+- the curvature at both ends of the interval (the deviation of a point from the straight line through its neighbours)
+
+both relative to the total range of the measured response. Sampling is done when no interval has a loss above the
+tolerance (or when intervals become smaller than min_step). The measured points are kept sorted.
+
+Use it with ask() and tell():
+
+    sampler = AdaptiveSampler(0, 5, tolerance=0.02)
+    x = sampler.ask()
+    while x is not None:
+        sampler.tell(x, measure(x))
+        x = sampler.ask()
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+from bisect import bisect_left
+import numpy as np
+
+
+class AdaptiveSampler:
+    """
+    Proposes points to measure, refining where the response changes or curves most.
+    """
+    def __init__(self, start, stop, tolerance=0.02, initial_points=11, min_step=None):
+        """
+        :param start: start of the range
+        :type start: float
+        :param stop: end of the range
+        :type stop: float
+        :param tolerance: maximum loss of an interval, relative to the range of the response (default: 0.02)
+        :type tolerance: float
+        :param initial_points: number of points of the initial uniform grid (default: 11)
+        :type initial_points: int
+        :param min_step: intervals smaller than this are not refined (default: 1/1000 of the range)
+        :type min_step: float or None
+        """
+        self.tolerance = tolerance
+        self.min_step = abs(stop - start) / 1000 if min_step is None else abs(min_step)
+        self.x = []  # sorted measured positions
+        self.y = []  # corresponding measured values
+        self.order = []  # for each point in x, the index in order of measurement
+        self._pending = list(np.linspace(start, stop, max(int(initial_points), 2)))
+
+    def tell(self, x, y):
+        """
+        Add a measured point.
+
+        :param x: position
+        :type x: float
+        :param y: measured value
+        :type y: float
+        """
+        i = bisect_left(self.x, x)
+        self.x.insert(i, x)
+        self.y.insert(i, y)
+        self.order.insert(i, len(self.order))
+
+    def losses(self):
+        """
+        The loss of each interval between neighbouring points.
+
+        :return: array of length len(x)-1
+        :rtype: numpy.ndarray
+        """
+        x = np.asarray(self.x, dtype=float)
+        y = np.asarray(self.y, dtype=float)
+        if len(x) < 2:
+            return np.zeros(0)
+        scale = y.max() - y.min()
+        if scale == 0:
+            return np.zeros(len(x) - 1)
+        loss = np.abs(np.diff(y))
+        if len(x) > 2:
+            # deviation of each inner point from the line through its neighbours
+            fraction = (x[1:-1] - x[:-2]) / (x[2:] - x[:-2])
+            deviation = np.abs(y[1:-1] - (y[:-2] + fraction * (y[2:] - y[:-2])))
+            loss[:-1] = np.maximum(loss[:-1], deviation)  # left end of the interval
+            loss[1:] = np.maximum(loss[1:], deviation)  # right end of the interval
+        loss /= scale
+        loss[np.diff(x) < 2 * self.min_step] = 0  # halving these would make intervals smaller than min_step
+        return loss
+
+    def ask(self):
+        """
+        Propose the next point to measure.
+
+        :return: position to measure next, or None if the response is resolved within the tolerance
+        :rtype: float or None
+        """
+        if self._pending:
+            return self._pending.pop(0)
+        loss = self.losses()
+        if not len(loss):
+            return
+        i = int(np.argmax(loss))
+        if loss[i] <= self.tolerance:
+            return
+        return (self.x[i] + self.x[i + 1]) / 2
+
+
+if __name__ == '__main__':
+    response = lambda x: np.tanh((x - 2.5) * 20) + 0.1 * x
+    sampler = AdaptiveSampler(0, 5, tolerance=0.01)
+    x = sampler.ask()
+    while x is not None:
+        sampler.tell(x, response(x))
+        x = sampler.ask()
+    steps = np.diff(sampler.x)
+    print(f'{len(sampler.x)} points, smallest step {steps.min():.4f} (a uniform scan would need {5 / steps.min() + 1:.0f})')
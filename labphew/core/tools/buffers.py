@@ -0,0 +1,339 @@
+"""
+labphew.core.tools.buffers
+==========================
+
+Preallocated buffers for data that is produced continuously (e.g. by a monitor or a feedback loop).
+
+- RingBuffer keeps the last 'capacity' rows of a fixed number of columns. Appending overwrites the oldest row, so the
+  memory use is constant and appending doesn't allocate.
+- TieredHistory keeps a full-rate RingBuffer plus RingBuffers of the minimum, maximum and mean of blocks of 10, 100
+  and 1000 samples, so hours (or days) of a monitor can be plotted at the resolution that fits the visible range.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import os
+import threading
+import time
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Circular buffer of the last capacity rows (of width columns).
+    Rows can be appended one at a time with append() or as a block with extend(). Reading with data() returns a copy in
+    chronological order.
+    """
+    def __init__(self, capacity, width=1, dtype=float):
+        """
+        :param capacity: number of rows to keep
+        :type capacity: int
+        :param width: number of columns (default: 1)
+        :type width: int
+        :param dtype: data type (default: float)
+        :type dtype: numpy.dtype
+        """
+        self.capacity = int(capacity)
+        self.width = int(width)
+        self._data = np.zeros((self.capacity, self.width), dtype=dtype)
+        self._index = 0  # row that will be written next
+        self.count = 0  # total number of rows appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def clear(self):
+        """Remove all rows (the memory is kept)."""
+        self._index = 0
+        self.count = 0
+
+    def append(self, row):
+        """
+        Append one row.
+
+        :param row: the values of the columns (or a single value if width is 1)
+        :type row: array_like or float
+        """
+        self._data[self._index] = row
+        self._index += 1
+        if self._index == self.capacity:
+            self._index = 0
+        self.count += 1
+
+    def extend(self, rows):
+        """
+        Append a block of rows (vectorized).
+
+        :param rows: array of shape (n, width) (or (n,) if width is 1)
+        :type rows: array_like
+        """
+        rows = np.asarray(rows).reshape(-1, self.width)
+        n = len(rows)
+        self.count += n
+        if n >= self.capacity:
+            self._data[:] = rows[-self.capacity:]
+            self._index = 0
+            return
+        end = self._index + n
+        if end <= self.capacity:
+            self._data[self._index:end] = rows
+        else:
+            split = self.capacity - self._index
+            self._data[self._index:] = rows[:split]
+            self._data[:n - split] = rows[split:]
+        self._index = end % self.capacity
+
+    def data(self):
+        """
+        :return: copy of the rows in chronological order, of shape (len(self), width)
+        :rtype: numpy.ndarray
+        """
+        if self.count < self.capacity:
+            return self._data[:self._index].copy()
+        return np.concatenate((self._data[self._index:], self._data[:self._index]))
+
+    def last(self, n=1):
+        """
+        :param n: number of rows (default: 1)
+        :type n: int
+        :return: copy of the last n rows (at most len(self)) in chronological order
+        :rtype: numpy.ndarray
+        """
+        n = min(n, len(self))
+        indices = np.arange(self._index - n, self._index) % self.capacity
+        return self._data[indices]
+
+    def rows(self, start=0, stop=None):
+        """
+        :param start: index of the first row (in chronological order, 0 is the oldest row) (default: 0)
+        :type start: int
+        :param stop: index after the last row (default: None, meaning len(self))
+        :type stop: int or None
+        :return: copy of the rows start to stop in chronological order
+        :rtype: numpy.ndarray
+        """
+        n = len(self)
+        stop = n if stop is None else min(stop, n)
+        start = max(start, 0)
+        if stop <= start:
+            return self._data[:0].copy()
+        first = self._index - n  # physical index of the oldest row (may be negative)
+        return self._data[np.arange(first + start, first + stop) % self.capacity]
+
+    def searchsorted(self, value, column=0, side='left'):
+        """
+        Binary search in a column that increases in chronological order (like a time column).
+
+        :param value: value to search
+        :type value: float
+        :param column: the column (default: 0)
+        :type column: int
+        :param side: 'left' or 'right', see numpy.searchsorted (default: 'left')
+        :type side: str
+        :return: chronological index at which value would be inserted
+        :rtype: int
+        """
+        if self.count < self.capacity:
+            return int(np.searchsorted(self._data[:self._index, column], value, side))
+        older = self._data[self._index:, column]
+        index = int(np.searchsorted(older, value, side))
+        if index < len(older):
+            return index
+        return len(older) + int(np.searchsorted(self._data[:self._index, column], value, side))
+
+
+class TieredHistory:
+    """
+    History of one or more channels at multiple resolutions, for plotting long time spans:
+
+    - level 0 keeps the last capacity samples at full rate (time and value of each channel)
+    - level k keeps the minimum, maximum and mean of blocks of factors[k-1] samples, also for the last capacity blocks
+
+    With the default factors (10, 100, 1000) and capacity the levels span 1, 10, 100 and 1000 times capacity samples.
+    query() returns the finest level that shows a time range in at most max_points points.
+    Optionally all rows of all levels are also appended to files in a spill directory, so the full history is kept on
+    disk (and queried from there with numpy.memmap), while memory use stays constant. Every TieredHistory writes to a
+    new subdirectory (named after the date and time), so the history of a previous session is kept.
+    Appending and querying are thread-safe, so a monitor loop can append while a gui queries.
+    """
+    def __init__(self, channels=1, capacity=100000, factors=(10, 100, 1000), spill=None):
+        """
+        :param channels: number of channels (default: 1)
+        :type channels: int
+        :param capacity: number of rows kept in memory per level (at least the largest factor) (default: 100000)
+        :type capacity: int
+        :param factors: number of samples per block of the aggregated levels, each a multiple of the previous one
+                        (default: (10, 100, 1000))
+        :type factors: tuple of int
+        :param spill: directory to save the rows of all levels to, in a new subdirectory session_<date>_<time> (see
+                      spill_directory) (default: None, meaning nothing is saved)
+        :type spill: str or None
+        """
+        self.channels = int(channels)
+        self.factors = (1,) + tuple(int(factor) for factor in factors)
+        if any(b % a for a, b in zip(self.factors, self.factors[1:])):
+            raise ValueError('each factor should be a multiple of the previous one')
+        capacity = max(int(capacity), self.factors[-1])
+        self.widths = [1 + self.channels] + [1 + 3 * self.channels] * (len(self.factors) - 1)
+        self.levels = [RingBuffer(capacity, width) for width in self.widths]
+        self.count = 0  # total number of samples appended
+        self._pending = [None] + [np.zeros((0, width)) for width in self.widths[1:]]  # rows waiting for a full block
+        self._lock = threading.Lock()
+        self.spill = spill
+        self.spill_directory = None  # the subdirectory of spill with the files of this session
+        self._files = []
+        if spill is not None:
+            self.spill_directory = self._new_session_directory(spill)
+            self._files = [open(self._spill_path(level), 'wb') for level in range(len(self.factors))]
+
+    @staticmethod
+    def _new_session_directory(spill):
+        """Create a new (not yet existing) subdirectory of spill for this session."""
+        name = os.path.join(spill, time.strftime('session_%Y%m%d_%H%M%S'))
+        path, i = name, 1
+        while True:
+            try:
+                os.makedirs(path)
+                return path
+            except FileExistsError:
+                i += 1
+                path = f'{name}_{i}'
+
+    def _spill_path(self, level):
+        return os.path.join(self.spill_directory, f'level{level}.bin')
+
+    def close(self):
+        """Close the spill files (the history in memory can still be used)."""
+        for file in self._files:
+            file.close()
+        self._files = []
+
+    def append(self, time, values):
+        """
+        Append one sample.
+
+        :param time: time of the sample
+        :type time: float
+        :param values: the value of each channel (or a single value)
+        :type values: array_like or float
+        """
+        self.extend([time], np.reshape(values, (1, self.channels)))
+
+    def extend(self, times, values):
+        """
+        Append a block of samples (vectorized).
+
+        :param times: times of the samples, increasing
+        :type times: array_like
+        :param values: values of shape (n, channels) (or (n,) for a single channel)
+        :type values: array_like
+        """
+        times = np.asarray(times, dtype=float).reshape(-1)
+        values = np.asarray(values, dtype=float).reshape(len(times), self.channels)
+        with self._lock:
+            self._add(0, np.column_stack((times, values)))
+            self.count += len(times)
+            # raw samples are blocks of one sample: minimum, maximum and mean are the value itself
+            rows = np.column_stack((times, values, values, values))
+            for level in range(1, len(self.factors)):
+                ratio = self.factors[level] // self.factors[level - 1]
+                pending = np.concatenate((self._pending[level], rows))
+                complete = len(pending) // ratio * ratio
+                self._pending[level] = pending[complete:]
+                if not complete:
+                    break
+                rows = self._aggregate(pending[:complete].reshape(-1, ratio, self.widths[level]))
+                self._add(level, rows)
+
+    def _aggregate(self, blocks):
+        """Reduce blocks of shape (m, k, 1 + 3 * channels) to rows of time, minimum, maximum and mean."""
+        c = self.channels
+        return np.column_stack((blocks[:, :, 0].mean(axis=1), blocks[:, :, 1:1 + c].min(axis=1),
+                                blocks[:, :, 1 + c:1 + 2 * c].max(axis=1), blocks[:, :, 1 + 2 * c:].mean(axis=1)))
+
+    def _add(self, level, rows):
+        self.levels[level].extend(rows)
+        if self._files:
+            self._files[level].write(rows.tobytes())
+
+    def _level_range(self, level, start, stop):
+        """
+        The rows of a level (the RingBuffer, or a memmap of the spill file), the indices of the first and last rows in
+        [start, stop], and whether the level still holds start.
+        """
+        if self._files:
+            self._files[level].flush()
+            size = os.path.getsize(self._spill_path(level)) // (8 * self.widths[level])
+            if not size:
+                return np.zeros((0, self.widths[level])), 0, 0, True
+            data = np.memmap(self._spill_path(level), dtype=float, mode='r', shape=(size, self.widths[level]))
+            return data, int(np.searchsorted(data[:, 0], start)), int(np.searchsorted(data[:, 0], stop, 'right')), True
+        ring = self.levels[level]
+        first, last = ring.searchsorted(start), ring.searchsorted(stop, side='right')
+        covers = ring.count <= ring.capacity or first > 0 or ring.rows(0, 1)[0, 0] <= start
+        return ring, first, last, covers
+
+    def query(self, start=None, stop=None, max_points=2000):
+        """
+        The history in a time range, at the finest level that has at most max_points points in the range (and that
+        still holds the start of the range). The last (incomplete) block of an aggregated level is included.
+
+        :param start: start of the time range (default: None, meaning the oldest sample)
+        :type start: float or None
+        :param stop: end of the time range (default: None, meaning the newest sample)
+        :type stop: float or None
+        :param max_points: maximum number of points (default: 2000)
+        :type max_points: int
+        :return: dictionary with the level, its factor, and arrays of time (n,), and min, max and mean (n, channels)
+                 (at level 0 min, max and mean are the values)
+        :rtype: dict
+        """
+        start = -np.inf if start is None else start
+        stop = np.inf if stop is None else stop
+        with self._lock:
+            for level in range(len(self.factors)):
+                data, first, last, covers = self._level_range(level, start, stop)
+                if covers and last - first <= max_points:
+                    break
+            rows = data.rows(first, last) if isinstance(data, RingBuffer) else np.array(data[first:last])
+            tail = self.count % self.factors[level]
+            if level and tail:
+                # the incomplete last block, aggregated from the raw samples
+                raw = self.levels[0].last(tail)
+                if start <= raw[:, 0].mean() <= stop:
+                    rows = np.concatenate((rows, self._aggregate(np.column_stack((raw, raw[:, 1:], raw[:, 1:]))[None])))
+        c = self.channels
+        if level == 0:
+            values = rows[:, 1:]
+            return {'level': 0, 'factor': 1, 'time': rows[:, 0], 'min': values, 'max': values, 'mean': values}
+        return {'level': level, 'factor': self.factors[level], 'time': rows[:, 0], 'min': rows[:, 1:1 + c],
+                'max': rows[:, 1 + c:1 + 2 * c], 'mean': rows[:, 1 + 2 * c:]}
+
+    def last(self, n=1):
+        """
+        :param n: number of samples (default: 1)
+        :type n: int
+        :return: times (n,) and values (n, channels) of the last n samples at full rate (at most capacity)
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        with self._lock:
+            rows = self.levels[0].last(n)
+        return rows[:, 0], rows[:, 1:]
+
+    def clear(self):
+        """Remove all samples (and truncate the spill files)."""
+        with self._lock:
+            for ring in self.levels:
+                ring.clear()
+            self._pending = [None] + [np.zeros((0, width)) for width in self.widths[1:]]
+            self.count = 0
+            for file in self._files:
+                file.seek(0)
+                file.truncate()
+
+
+if __name__ == '__main__':
+    buffer = RingBuffer(10000, width=3)
+    t0 = time.time()
+    for i in range(100000):
+        buffer.append((i, i ** 2, -i))
+    print(f'{100000 / (time.time() - t0):.0f} appends/s, {len(buffer)} rows, last row: {buffer.last()[0]}')
@@ -0,0 +1,123 @@
+"""
+labphew.core.tools.clock
+========================
+
+Clocks that can be injected into controllers and operators to decide how they keep time.
+
+- WallClock uses the real time (time.time() and time.sleep()). This is the default everywhere.
+- VirtualClock only advances when something sleeps on it, and then it advances instantly. Simulated devices and
+  operator loops that use a VirtualClock produce the same timestamps (in the same order) as with a WallClock, but they
+  don't actually wait. This allows to run long simulated scans and monitors in tests and benchmarks in a fraction of
+  the time.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import threading
+import time
+
+
+class WallClock:
+    """
+    Clock that uses the real time.
+    """
+    def time(self):
+        """
+        :return: current time (s) since the epoch, like time.time()
+        :rtype: float
+        """
+        return time.time()
+
+    def sleep(self, seconds):
+        """
+        Sleep for a number of seconds (negative values are ignored).
+
+        :param seconds: time to sleep (s)
+        :type seconds: float
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait_until(self, timestamp, interrupt=None, poll_time=0.005):
+        """
+        Wait until the clock reaches timestamp.
+        Optionally a function can be passed that will be checked regularly (every poll_time) to interrupt waiting.
+
+        :param timestamp: time to wait for (in time of this clock)
+        :type timestamp: float
+        :param interrupt: optional function that returns True to stop waiting
+        :type interrupt: callable or None
+        :param poll_time: maximum time (s) between checks of interrupt (default: 0.005)
+        :type poll_time: float
+        :return: True if waiting was interrupted
+        :rtype: bool
+        """
+        while True:
+            if interrupt is not None and interrupt():
+                return True
+            remaining = timestamp - self.time()
+            if remaining <= 0:
+                return False
+            self.sleep(min(remaining, poll_time))
+
+    def sleep_until(self, timestamp, spin=0.0005):
+        """
+        Wait until the clock reaches timestamp, more precisely than with sleep(): it sleeps until spin seconds before the
+        timestamp and busy-waits for the remainder (the resolution of sleep depends on the operating system).
+
+        :param timestamp: time to wait for (in time of this clock)
+        :type timestamp: float
+        :param spin: time (s) to busy-wait at the end (default: 0.0005)
+        :type spin: float
+        """
+        self.sleep(timestamp - spin - self.time())
+        while self.time() < timestamp:
+            pass
+
+
+class VirtualClock(WallClock):
+    """
+    Clock that advances instantly when sleeping.
+    By default it starts at the real time of its creation, so timestamps look like normal timestamps.
+    It is thread safe: when multiple threads sleep on the same clock, the time advances by the sum of the sleeps.
+    """
+    def __init__(self, start=None):
+        """
+        :param start: start time (s), defaults to the current (real) time
+        :type start: float or None
+        """
+        self._lock = threading.Lock()
+        self._now = time.time() if start is None else float(start)
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.advance(seconds)
+
+    def advance(self, seconds):
+        """
+        Move the clock forward.
+
+        :param seconds: time (s) to move forward
+        :type seconds: float
+        """
+        with self._lock:
+            self._now += seconds
+
+    def sleep_until(self, timestamp, spin=0.0005):
+        self.sleep(timestamp - self.time())
+
+
+# The clock used when no clock is specified
+wall_clock = WallClock()
+
+
+if __name__ == '__main__':
+    clock = VirtualClock()
+    t0 = time.time()
+    v0 = clock.time()
+    for i in range(1000):
+        clock.sleep(0.1)
+    print(f'Slept {clock.time() - v0:.1f}s on the virtual clock in {time.time() - t0:.4f}s')
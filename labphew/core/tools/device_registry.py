@@ -0,0 +1,201 @@
+"""
+labphew.core.tools.device_registry
+==================================
+
+A process-wide registry of open device connections.
+
+Opening a device can take seconds, and most devices can only be opened once. With a DeviceRegistry multiple users
+(operators, scan windows, scripts) in one process share one open connection:
+
+- acquire() returns a DeviceHandle. The first call opens the device (with the factory that is passed), later calls for
+  the same key (e.g. the serial number) return a handle to the same controller.
+- The handle behaves like the controller itself. Every method call is done while holding the lock of the device, so
+  calls from different threads don't interfere. This includes the methods of nested objects (like the instruments
+  handle.ai or handle.ao of a DfwController). To do a sequence of calls without interruption use: with handle.lock:
+- The device is closed when the last handle is released (handle.release(), or using the handle as a context manager).
+
+For Digilent devices see labphew.controller.digilent.waveforms.open_device()
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import logging
+import numbers
+import threading
+
+# Attribute values that are returned as they are (not wrapped to lock the methods)
+_plain_types = (type, numbers.Number, str, bytes, list, tuple, dict, set, frozenset)
+
+
+def _locked(attr, lock):
+    """Wrap a method, or an object (to lock its methods), such that it's used while holding the lock."""
+    if attr is None or isinstance(attr, _plain_types):
+        return attr
+    if callable(attr):
+        def locked_call(*args, **kwargs):
+            with lock:
+                return attr(*args, **kwargs)
+        return locked_call
+    if type(attr).__module__ in ('numpy', 'builtins'):
+        return attr
+    return _LockedObject(attr, lock)
+
+
+class _LockedObject:
+    """
+    Proxy to an object of a controller (e.g. an instrument like DfwController.ai), of which the methods are called while
+    holding the lock of the device.
+    """
+    def __init__(self, obj, lock):
+        object.__setattr__(self, '_obj', obj)
+        object.__setattr__(self, '_lock', lock)
+
+    def __getattr__(self, item):
+        return _locked(getattr(self._obj, item), self._lock)
+
+    def __setattr__(self, key, value):
+        with self._lock:
+            setattr(self._obj, key, value)
+
+    def __repr__(self):
+        return f'<locked {self._obj!r}>'
+
+
+class DeviceHandle:
+    """
+    Shared, reference-counted handle to a controller in a DeviceRegistry.
+    Attributes and methods of the controller are accessible through the handle, methods (also those of nested objects
+    like instruments) are called while holding the lock of the device.
+    """
+    def __init__(self, registry, key, entry):
+        self._registry = registry
+        self._key = key
+        self._entry = entry
+        self._released = False
+
+    @property
+    def key(self):
+        """The key (e.g. serial number) of the device in the registry."""
+        return self._key
+
+    @property
+    def controller(self):
+        """The shared controller object (use with care: access through the controller is not locked)."""
+        return self._entry['controller']
+
+    @property
+    def lock(self):
+        """The (re-entrant) lock of the device, shared by all handles to the same device."""
+        return self._entry['lock']
+
+    def __getattr__(self, item):
+        """Called for all attributes that don't exist in the handle itself, i.e. those of the controller"""
+        if self._released:
+            raise RuntimeError(f'handle to device {self._key} was already released')
+        return _locked(getattr(self._entry['controller'], item), self._entry['lock'])
+
+    def release(self):
+        """
+        Release this handle. When the last handle to a device is released, the device is closed.
+        Releasing a handle more than once has no effect.
+        """
+        if not self._released:
+            self._released = True
+            self._registry._release(self._key, self._entry)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class DeviceRegistry:
+    """
+    Registry of shared device connections, keyed by e.g. the serial number of the device.
+    """
+    def __init__(self):
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def acquire(self, key, factory):
+        """
+        Get a handle to the device with this key. If the device is not open yet, factory() is called to open it.
+
+        :param key: key of the device (e.g. its serial number)
+        :type key: hashable
+        :param factory: function without arguments that opens the device and returns the controller
+        :type factory: callable
+        :return: a handle to the shared controller (None if opening the device failed)
+        :rtype: DeviceHandle
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = {'controller': None, 'count': 0, 'lock': threading.RLock()}
+                self._entries[key] = entry
+            entry['count'] += 1
+        with entry['lock']:
+            if entry['controller'] is None:
+                self.logger.info(f'opening device {key}')
+                try:
+                    entry['controller'] = factory()
+                except Exception as e:
+                    self.logger.error(f'failed to open device {key}: {e}')
+                    self._release(key, entry)
+                    return
+            else:
+                self.logger.debug(f'sharing open connection to device {key}')
+        return DeviceHandle(self, key, entry)
+
+    def _release(self, key, entry):
+        with entry['lock']:
+            with self._lock:
+                entry['count'] -= 1
+                last = entry['count'] == 0
+                if last and self._entries.get(key) is entry:
+                    del self._entries[key]
+            if last and entry['controller'] is not None:
+                self.logger.info(f'closing device {key}')
+                try:
+                    entry['controller'].close()
+                except Exception as e:
+                    self.logger.error(f'failed to close device {key}: {e}')
+                entry['controller'] = None
+
+    def users(self, key):
+        """
+        :param key: key of the device
+        :return: the number of handles in use for the device (0 if it's not open)
+        :rtype: int
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            return 0 if entry is None else entry['count']
+
+    def keys(self):
+        """
+        :return: keys of the open devices
+        :rtype: list
+        """
+        with self._lock:
+            return list(self._entries)
+
+
+if __name__ == '__main__':
+    class FakeController:
+        def __init__(self):
+            print('opening (slow)')
+
+        def read(self):
+            return 42
+
+        def close(self):
+            print('closing')
+
+    registry = DeviceRegistry()
+    h1 = registry.acquire('SN:123', FakeController)
+    h2 = registry.acquire('SN:123', FakeController)  # doesn't open again
+    print(h1.read(), h2.controller is h1.controller, registry.users('SN:123'))
+    h1.release()
+    h2.release()  # closes the device
@@ -0,0 +1,370 @@
+"""
+labphew.core.tools.digital
+==========================
+
+Vectorized handling of digital (logic analyzer) samples, where every sample is a 16 bit integer with one bit per line
+(e.g. the samples streamed by DfwController.record_digital()).
+
+- unpack_bits() and pack_bits() convert between samples and an array of the separate lines (using np.unpackbits).
+- transitions() finds the samples at which (a subset of) the lines change.
+- DigitalCapture stores a capture in run-length form: only the index and the new value of every transition are kept.
+  Logic signals usually change rarely compared to the sample rate, so a capture takes a small fraction of the memory of
+  the raw samples and minute-long captures of all lines fit in memory. Edges and patterns are searched in the
+  transitions directly (without decoding the samples), and a capture can be saved to a compact (compressed) .npz file.
+- DigitalPattern is a sequence of output states compiled for the custom pattern generators of DigitalOut (e.g. for
+  DfwController.play_digital_pattern()): a packed bit sequence per pin with a digest, so identical sequences can be
+  recognized without comparing them.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import hashlib
+import numpy as np
+
+
+def unpack_bits(samples, lines=16):
+    """
+    Split samples into their separate lines.
+
+    :param samples: 16 bit samples (or a single sample)
+    :type samples: array_like
+    :param lines: number of lines to return (the lowest bits) (default: 16)
+    :type lines: int
+    :return: array of 0's and 1's of shape (n, lines), where column k is line k
+    :rtype: numpy.ndarray
+    """
+    samples = np.ascontiguousarray(samples, dtype='<u2').reshape(-1, 1)
+    return np.unpackbits(samples.view(np.uint8), axis=-1, bitorder='little')[:, :lines]
+
+
+def pack_bits(bits):
+    """
+    Combine separate lines into 16 bit samples (the inverse of unpack_bits()).
+
+    :param bits: array of shape (n, lines) with lines <= 16, where column k is line k (non-zero means high)
+    :type bits: array_like
+    :return: samples of shape (n,)
+    :rtype: numpy.ndarray
+    """
+    bits = np.asarray(bits)
+    if bits.ndim != 2 or bits.shape[1] > 16:
+        raise ValueError('bits should have a shape of (n, lines) with at most 16 lines')
+    padded = np.zeros((len(bits), 16), dtype=bool)
+    padded[:, :bits.shape[1]] = bits
+    return np.packbits(padded, axis=-1, bitorder='little').view('<u2').reshape(-1).astype(np.uint16)
+
+
+def transitions(samples, mask=0xFFFF, previous=None):
+    """
+    Indices of the samples where the (masked) value differs from the sample before it.
+
+    :param samples: 16 bit samples
+    :type samples: numpy.ndarray
+    :param mask: only consider the lines of which the bit is set (default: 0xFFFF, all lines)
+    :type mask: int
+    :param previous: value of the sample before the block, to also detect a transition at index 0 (default: None)
+    :type previous: int or None
+    :return: indices of the transitions
+    :rtype: numpy.ndarray
+    """
+    masked = np.asarray(samples) & mask
+    indices = np.flatnonzero(masked[1:] != masked[:-1]) + 1
+    if previous is not None and len(masked) and masked[0] != previous & mask:
+        indices = np.concatenate(([0], indices))
+    return indices
+
+
+class DigitalCapture:
+    """
+    Run-length encoded capture of digital samples: the sample index at which each run starts (indices) and the value
+    during the run (values). Blocks of samples can be appended while they are being acquired.
+    """
+    def __init__(self, sample_rate, lines=16):
+        """
+        :param sample_rate: sample rate (Hz)
+        :type sample_rate: float
+        :param lines: number of lines that were recorded (default: 16)
+        :type lines: int
+        """
+        self.sample_rate = float(sample_rate)
+        self.lines = int(lines)
+        self.n_samples = 0
+        self.lost = 0  # number of samples that were lost during acquisition (see append())
+        self._blocks = []  # (indices, values) of the appended blocks, concatenated when needed
+        self._last = None  # value of the last appended sample
+        self._indices = np.zeros(0, dtype=np.int64)
+        self._values = np.zeros(0, dtype=np.uint16)
+
+    @classmethod
+    def from_samples(cls, samples, sample_rate, lines=16):
+        """
+        Create a capture from an array of samples.
+
+        :param samples: 16 bit samples
+        :type samples: array_like
+        :param sample_rate: sample rate (Hz)
+        :type sample_rate: float
+        :param lines: number of lines (default: 16)
+        :type lines: int
+        :rtype: DigitalCapture
+        """
+        capture = cls(sample_rate, lines)
+        capture.append(samples)
+        return capture
+
+    def __len__(self):
+        """The number of runs."""
+        return len(self.indices)
+
+    def append(self, samples, gap=0):
+        """
+        Append a block of samples.
+
+        :param samples: 16 bit samples
+        :type samples: array_like
+        :param gap: number of samples that were lost before this block; they are counted in lost and the value of the
+                    previous run is assumed for them (default: 0)
+        :type gap: int
+        """
+        samples = np.asarray(samples, dtype=np.uint16)
+        self.n_samples += gap
+        self.lost += gap
+        if not len(samples):
+            return
+        # after a gap the block starts a new run, to mark where the data continues
+        indices = transitions(samples, previous=None if self._last is None or gap else self._last)
+        if self._last is None or gap:
+            indices = np.concatenate(([0], indices))
+        self._blocks.append((indices + self.n_samples, samples[indices]))
+        self._last = samples[-1]
+        self.n_samples += len(samples)
+
+    def _merge(self):
+        if self._blocks:
+            indices, values = zip(*self._blocks)
+            self._indices = np.concatenate((self._indices,) + indices)
+            self._values = np.concatenate((self._values,) + values)
+            self._blocks = []
+
+    @property
+    def indices(self):
+        """Sample index of the start of every run."""
+        self._merge()
+        return self._indices
+
+    @property
+    def values(self):
+        """Value of every run."""
+        self._merge()
+        return self._values
+
+    @property
+    def times(self):
+        """Time (s) of the start of every run."""
+        return self.indices / self.sample_rate
+
+    @property
+    def duration(self):
+        """Duration of the capture (s)."""
+        return self.n_samples / self.sample_rate
+
+    @property
+    def run_lengths(self):
+        """Number of samples of every run."""
+        return np.diff(self.indices, append=self.n_samples)
+
+    @property
+    def nbytes(self):
+        """Memory used by the runs (bytes), compared to 2 * n_samples for the raw samples."""
+        return self.indices.nbytes + self.values.nbytes
+
+    def samples(self, start=0, stop=None):
+        """
+        Decode (part of) the capture to samples.
+
+        :param start: index of the first sample (default: 0)
+        :type start: int
+        :param stop: index after the last sample (default: None, meaning the end of the capture)
+        :type stop: int or None
+        :return: 16 bit samples
+        :rtype: numpy.ndarray
+        """
+        stop = self.n_samples if stop is None else min(stop, self.n_samples)
+        if stop <= start:
+            return np.zeros(0, dtype=np.uint16)
+        first, last = np.searchsorted(self.indices, [start, stop], side='right') - 1
+        starts = np.clip(self.indices[first:last + 1], start, stop)
+        lengths = np.diff(starts, append=stop)
+        return np.repeat(self.values[first:last + 1], lengths)
+
+    def value_at(self, index):
+        """
+        Value at sample index (or indices).
+
+        :param index: sample index (or array of indices)
+        :type index: int or numpy.ndarray
+        :return: the value(s)
+        :rtype: int or numpy.ndarray
+        """
+        return self.values[np.searchsorted(self.indices, index, side='right') - 1]
+
+    def line(self, line):
+        """
+        The runs of a single line (merging runs in which that line doesn't change).
+
+        :param line: line number (0 to 15)
+        :type line: int
+        :return: sample index of the start of every run and the state (0 or 1) of the line during the run
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        state = (self.values >> line) & 1
+        keep = transitions(state)
+        keep = np.concatenate(([0], keep)) if len(state) else keep
+        return self.indices[keep], state[keep].astype(np.uint8)
+
+    def edges(self, line, edge='both', as_time=True):
+        """
+        Edges of a single line.
+
+        :param line: line number (0 to 15)
+        :type line: int
+        :param edge: 'rising', 'falling' or 'both' (default: 'both')
+        :type edge: str
+        :param as_time: return times (s) instead of sample indices (default: True)
+        :type as_time: bool
+        :return: times (or indices) of the edges
+        :rtype: numpy.ndarray
+        """
+        indices, state = self.line(line)
+        indices, state = indices[1:], state[1:]  # the start of the capture is not an edge
+        if edge == 'rising':
+            indices = indices[state == 1]
+        elif edge == 'falling':
+            indices = indices[state == 0]
+        return indices / self.sample_rate if as_time else indices
+
+    def find(self, pattern, mask=0xFFFF, as_time=True):
+        """
+        Find where the (masked) lines start to match a pattern.
+
+        :param pattern: the value to find
+        :type pattern: int
+        :param mask: only compare the lines of which the bit is set (default: 0xFFFF, all lines)
+        :type mask: int
+        :param as_time: return times (s) instead of sample indices (default: True)
+        :type as_time: bool
+        :return: times (or indices) at which the pattern starts
+        :rtype: numpy.ndarray
+        """
+        match = (self.values & mask) == (pattern & mask)
+        start = match & ~np.concatenate(([False], match[:-1]))
+        indices = self.indices[start]
+        return indices / self.sample_rate if as_time else indices
+
+    def save(self, filename):
+        """
+        Save the capture to a compressed .npz file. The run starts are stored as differences, which compress well.
+
+        :param filename: the filename
+        :type filename: str
+        """
+        steps = np.diff(self.indices, prepend=0)
+        np.savez_compressed(filename, sample_rate=self.sample_rate, lines=self.lines, n_samples=self.n_samples,
+                            lost=self.lost, steps=steps.astype(np.uint32 if steps.max(initial=0) < 2**32 else np.int64),
+                            values=self.values)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a capture saved with save().
+
+        :param filename: the filename
+        :type filename: str
+        :rtype: DigitalCapture
+        """
+        with np.load(filename) as data:
+            capture = cls(float(data['sample_rate']), int(data['lines']))
+            capture._indices = np.cumsum(data['steps'], dtype=np.int64)
+            capture._values = data['values'].astype(np.uint16)
+            capture.n_samples = int(data['n_samples'])
+            capture.lost = int(data['lost'])
+        if len(capture._values):
+            capture._last = capture._values[-1]
+        return capture
+
+
+class DigitalPattern:
+    """
+    Output states of the digital pins at a fixed sample rate, compiled for uploading to DigitalOut: the bits of every
+    pin are packed (lsb first, as the device expects) and get a digest of the sequence.
+    """
+    def __init__(self, states, sample_rate, pins=None):
+        """
+        :param states: 16 bit states of shape (n,), or bits of shape (n, lines) where column k is pin k
+        :type states: array_like
+        :param sample_rate: sample rate (Hz)
+        :type sample_rate: float
+        :param pins: the pins to drive (default: None, meaning all 16 pins for states, or the first lines pins for bits)
+        :type pins: list of int or None
+        """
+        states = np.asarray(states)
+        if states.ndim == 2:
+            if pins is None:
+                pins = range(states.shape[1])
+            states = pack_bits(states)
+        elif states.ndim != 1:
+            raise ValueError('states should have a shape of (n,) or (n, lines)')
+        if not len(states):
+            raise ValueError('the pattern is empty')
+        self.states = states.astype(np.uint16)
+        self.sample_rate = float(sample_rate)
+        self.pins = tuple(range(16) if pins is None else sorted(set(int(pin) for pin in pins)))
+        if not all(0 <= pin < 16 for pin in self.pins):
+            raise ValueError('pins should be in the range 0 to 15')
+        bits = unpack_bits(self.states)
+        self.data = {}  # packed bits per pin
+        self.digests = {}  # digest of the sequence per pin
+        for pin in self.pins:
+            self.data[pin] = np.packbits(bits[:, pin], bitorder='little')
+            self.digests[pin] = hashlib.sha1(self.data[pin].tobytes() + len(self).to_bytes(8, 'little')).hexdigest()
+
+    def __len__(self):
+        """The number of samples."""
+        return len(self.states)
+
+    @property
+    def duration(self):
+        """Duration of one period of the pattern (s)."""
+        return len(self) / self.sample_rate
+
+    @property
+    def mask(self):
+        """The driven pins as a 16 bit integer."""
+        return sum(1 << pin for pin in self.pins)
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    import time
+    # a 16 bit counter incrementing at 1kHz, sampled at 1MHz for 60s, generated in blocks
+    rate, block = 1e6, 2**20
+    capture = DigitalCapture(rate)
+    t0 = time.time()
+    for start in range(0, int(60 * rate), block):
+        capture.append((np.arange(start, start + block) // 1000).astype(np.uint16))
+    print(f'encoded {capture.n_samples / (time.time() - t0) / 1e6:.0f} Msamples/s, {len(capture)} runs, '
+          f'{capture.nbytes / 1e6:.2f}MB instead of {2 * capture.n_samples / 1e6:.0f}MB')
+    t0 = time.time()
+    rising = capture.edges(3, 'rising')
+    print(f'{len(rising)} rising edges of line 3 found in {(time.time() - t0) * 1e3:.1f}ms, first at {rising[0]}s')
+    print(f'pattern 0x1234 starts at {capture.find(0x1234)}s')
+    filename = os.path.join(tempfile.gettempdir(), 'capture.npz')
+    capture.save(filename)
+    print(f'saved to {os.path.getsize(filename) / 1e3:.0f}kB, '
+          f'equal after loading: {np.array_equal(DigitalCapture.load(filename).samples(0, 5000), capture.samples(0, 5000))}')
+    print(unpack_bits(capture.value_at(0x1234 * 1000))[0], pack_bits(unpack_bits([1, 2, 0xFFFF])))
+    # a pattern of a clock on pin 0 and a data line on pin 1
+    clock = np.tile([0, 1], 8)
+    pattern = DigitalPattern(np.column_stack((clock, np.repeat([1, 0, 1, 1, 0, 0, 1, 0], 2))), 1e6)
+    print(f'pattern of {len(pattern)} samples ({pattern.duration * 1e6:.0f}us) on pins {pattern.pins}: '
+          f'{[f"{state:04x}" for state in pattern.states]}')
@@ -0,0 +1,296 @@
+"""
+labphew.core.tools.feedback
+===========================
+
+Closed-loop feedback control (e.g. for locking a laser or stabilizing a temperature).
+
+- PID is a PID controller with output limits and anti-windup: the integral only accumulates while the output is not
+  saturated (or when the error drives the output back into range), and the derivative acts on the measurement (so
+  setpoint changes don't cause a kick).
+- FeedbackLoop runs a PID controller on a dedicated thread: at every period it reads the measurement, updates the PID
+  and writes the output. The loop is paced by deadlines (start + k * period) rather than by sleeping a fixed time, so
+  timing errors don't accumulate, and deadlines that are missed are skipped rather than caught up in a burst.
+  Setpoint, measurement, error, output and latency of each iteration are logged in a RingBuffer, and the loop interval
+  and latency (from the deadline until the output is written) are counted in histograms.
+
+The thread tries to raise its priority (see set_thread_priority()), which mostly reduces the jitter caused by other
+processes. Note that other Python threads (like a gui) still compete for the interpreter.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import ctypes
+import logging
+import os
+import sys
+import threading
+import numpy as np
+from labphew.core.tools.clock import wall_clock
+from labphew.core.tools.buffers import RingBuffer
+from labphew.core.tools.statistics import Histogram
+
+
+def set_thread_priority():
+    """
+    Try to raise the scheduling priority of the calling thread (time critical on Windows, real-time FIFO scheduling or a
+    lower nice value on Linux). This usually requires administrator rights (or CAP_SYS_NICE on Linux).
+
+    :return: True if the priority was raised
+    :rtype: bool
+    """
+    logger = logging.getLogger(__name__)
+    try:
+        if sys.platform == 'win32':
+            kernel32 = ctypes.windll.kernel32
+            return bool(kernel32.SetThreadPriority(kernel32.GetCurrentThread(), 15))  # THREAD_PRIORITY_TIME_CRITICAL
+        if hasattr(os, 'sched_setscheduler'):
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(50))  # 0 is the calling thread on Linux
+                return True
+            except PermissionError:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), -10)
+                return True
+    except (OSError, AttributeError) as e:
+        logger.info(f'could not raise thread priority ({e})')
+        return False
+    logger.info(f'raising thread priority is not supported on {sys.platform}')
+    return False
+
+
+class PID:
+    """
+    PID controller with output limits and anti-windup.
+    """
+    def __init__(self, kp, ki=0.0, kd=0.0, setpoint=0.0, output_limits=(None, None)):
+        """
+        :param kp: proportional gain
+        :type kp: float
+        :param ki: integral gain (1/s)
+        :type ki: float
+        :param kd: derivative gain (s)
+        :type kd: float
+        :param setpoint: the setpoint (default: 0)
+        :type setpoint: float
+        :param output_limits: lower and upper limit of the output (None for no limit)
+        :type output_limits: (float or None, float or None)
+        """
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.setpoint = setpoint
+        lower, upper = output_limits
+        self.output_limits = (-np.inf if lower is None else lower, np.inf if upper is None else upper)
+        self.reset()
+
+    def reset(self, output=0.0):
+        """
+        Reset the controller.
+
+        :param output: initial output, the integral starts at this value for a bumpless start (default: 0)
+        :type output: float
+        """
+        lower, upper = self.output_limits
+        self.integral = min(max(output, lower), upper)
+        self.error = 0.0
+        self.output = self.integral
+        self._last_measurement = None
+
+    def update(self, measurement, dt):
+        """
+        Calculate the new output.
+
+        :param measurement: the measured value
+        :type measurement: float
+        :param dt: time since the previous update (s)
+        :type dt: float
+        :return: the output (within the output limits)
+        :rtype: float
+        """
+        lower, upper = self.output_limits
+        self.error = error = self.setpoint - measurement
+        derivative = 0.0
+        if self._last_measurement is not None and dt > 0:
+            derivative = -self.kd * (measurement - self._last_measurement) / dt
+        self._last_measurement = measurement
+        proportional = self.kp * error
+        integral = self.integral + self.ki * error * dt
+        output = proportional + integral + derivative
+        # anti-windup: only integrate if the output is in range or if the error moves it back into range
+        if (output > upper and error > 0) or (output < lower and error < 0):
+            output = proportional + self.integral + derivative
+        else:
+            self.integral = min(max(integral, lower), upper)
+        self.output = min(max(output, lower), upper)
+        return self.output
+
+
+class FeedbackLoop:
+    """
+    Runs a PID controller on a dedicated thread with deadline pacing, and logs every iteration.
+    """
+    columns = ('time', 'setpoint', 'measurement', 'error', 'output', 'latency')
+
+    def __init__(self, read, write, pid, period, clock=None, history=10000, high_priority=True, histogram_bin=1e-4,
+                 histogram_bins=1000):
+        """
+        :param read: function that returns the measurement (None if the measurement failed, exceptions are counted as
+                     failed reads as well)
+        :type read: callable
+        :param write: function that applies the output (exceptions are counted as failed writes)
+        :type write: callable
+        :param pid: the controller
+        :type pid: PID
+        :param period: loop period (s)
+        :type period: float
+        :param clock: clock for timing the loop (default: None, meaning the wall clock)
+        :type clock: WallClock or None
+        :param history: number of iterations kept in the log (default: 10000)
+        :type history: int
+        :param high_priority: try to raise the priority of the thread (default: True)
+        :type high_priority: bool
+        :param histogram_bin: bin width of the interval and latency histograms (s) (default: 1e-4)
+        :type histogram_bin: float
+        :param histogram_bins: number of bins of the histograms (default: 1000)
+        :type histogram_bins: int
+        """
+        self.logger = logging.getLogger(__name__)
+        self.read = read
+        self.write = write
+        self.pid = pid
+        self.period = period
+        self.clock = wall_clock if clock is None else clock
+        self.high_priority = high_priority
+        self.log = RingBuffer(history, len(self.columns))
+        self.interval_histogram = Histogram(histogram_bin, histogram_bins)
+        self.latency_histogram = Histogram(histogram_bin, histogram_bins)
+        self.iterations = 0
+        self.missed_deadlines = 0
+        self.failed_reads = 0
+        self.failed_writes = 0
+        self.elapsed = 0.0
+        self._thread = None
+        self._stop = False
+
+    @property
+    def running(self):
+        """True while the loop thread is running."""
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """
+        Start the loop thread (and reset the log and statistics).
+        """
+        if self.running:
+            self.logger.warning('feedback loop is already running')
+            return
+        self.log.clear()
+        self.interval_histogram.reset()
+        self.latency_histogram.reset()
+        self.iterations = self.missed_deadlines = self.failed_reads = self.failed_writes = 0
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name='FeedbackLoop')
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stop the loop thread and wait for it to finish.
+
+        :param timeout: maximum time (s) to wait for the thread (default: None, meaning no limit)
+        :type timeout: float or None
+        :return: the statistics, see statistics()
+        :rtype: dict
+        """
+        self._stop = True
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.statistics()
+
+    def _run(self):
+        if self.high_priority:
+            set_thread_priority()
+        clock, pid, period = self.clock, self.pid, self.period
+        start = clock.time()
+        previous = None
+        k = 0
+        while not self._stop:
+            deadline = start + k * period
+            clock.sleep_until(deadline)
+            now = clock.time()
+            try:
+                measurement = self.read()
+            except Exception as e:
+                if not self.failed_reads:  # log only the first one, the loop may run at kHz
+                    self.logger.error(f'feedback loop: read failed ({type(e).__name__}: {e})')
+                measurement = None
+            if measurement is None:
+                self.failed_reads += 1
+            else:
+                dt = period if previous is None else now - previous
+                output = pid.update(measurement, dt)
+                try:
+                    self.write(output)
+                except Exception as e:
+                    if not self.failed_writes:
+                        self.logger.error(f'feedback loop: write failed ({type(e).__name__}: {e})')
+                    self.failed_writes += 1
+                latency = clock.time() - deadline
+                if previous is not None:
+                    self.interval_histogram.add(now - previous)
+                self.latency_histogram.add(latency)
+                self.log.append((now - start, pid.setpoint, measurement, pid.error, output, latency))
+                previous = now
+                self.iterations += 1
+            self.elapsed = clock.time() - start
+            # the next deadline, skipping the ones that have passed already
+            k += 1
+            late = int((clock.time() - start) / period) - k
+            if late >= 0:
+                self.missed_deadlines += late + 1
+                k += late + 1
+
+    def history(self):
+        """
+        The logged iterations.
+
+        :return: dictionary with an array for each of the columns (time, setpoint, measurement, error, output, latency)
+        :rtype: dict
+        """
+        data = self.log.data()
+        return {name: data[:, i] for i, name in enumerate(self.columns)}
+
+    def statistics(self):
+        """
+        Statistics of the loop timing.
+
+        :return: dictionary with the number of iterations, missed deadlines, failed reads and failed writes, the loop rate
+                 (Hz) and the mean, median, 99th percentile and maximum of the interval and latency (s)
+        :rtype: dict
+        """
+        stats = {'iterations': self.iterations, 'missed_deadlines': self.missed_deadlines,
+                 'failed_reads': self.failed_reads, 'failed_writes': self.failed_writes, 'rate': self.iterations / self.elapsed if self.elapsed else np.nan}
+        for name, histogram in (('interval', self.interval_histogram), ('latency', self.latency_histogram)):
+            stats[f'{name}_mean'] = histogram.mean
+            stats[f'{name}_median'] = histogram.percentile(50)
+            stats[f'{name}_p99'] = histogram.percentile(99)
+            stats[f'{name}_max'] = histogram.max
+        return stats
+
+
+if __name__ == '__main__':
+    import time
+    # a first order system with a time constant of 20ms, simulated in real time
+    state = {'value': 0.0, 'input': 0.0, 'time': time.time()}
+
+    def read():
+        now = time.time()
+        state['value'] += (state['input'] - state['value']) * (1 - np.exp(-(now - state['time']) / 0.02))
+        state['time'] = now
+        return state['value']
+
+    def write(value):
+        state['input'] = value
+
+    loop = FeedbackLoop(read, write, PID(2.0, 100.0, setpoint=1.0, output_limits=(-5, 5)), period=0.001)
+    loop.start()
+    time.sleep(1)
+    stats = loop.stop()
+    print(f"{stats['rate']:.0f} Hz, latency median {stats['latency_median'] * 1e3:.2f}ms, "
+          f"p99 {stats['latency_p99'] * 1e3:.2f}ms, missed {stats['missed_deadlines']}, "
+          f"final error {loop.history()['error'][-1]:.4f}")
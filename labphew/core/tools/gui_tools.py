@@ -36,7 +36,8 @@ class SaverWidget(QWidget):
     Simple widget for saving, consisting of a line edit to enter the filename and a save button.
     It overwrites existing files without confirmation, but the line edit turns red to warn the user that the file exists.
     In addition it has the option to save through a browse window.
-    And it has the option to store the entire properties dictionary in a yaml file (of the same name).
+    And it has the option to store the entire properties dictionary in a yaml file (of the same name), and to append the
+    data as new run to a container file (see labphew.data.container) instead of overwriting it.
     """
     def __init__(self, save_button_callback):
         """
@@ -55,28 +56,38 @@ class SaverWidget(QWidget):
 
         self.filename = QLineEdit(r'C:\Temp\data.nc')
         self.filename.textChanged.connect(self.check_file_exists)
-        self.check_file_exists()
         self.browse_button = QPushButton('Browse')
         self.browse_button.clicked.connect(self.browse)
 
         self.save_button = QPushButton('Save')
         self.save_button.clicked.connect(self.save)
         self.conf_checkbox = QCheckBox('Store config', checked=True, statusTip='Stores the current operator properties into a yaml config file of the same name')
+        self.append_checkbox = QCheckBox('Append', checked=False, statusTip='Appends the data as new run to a container file instead of overwriting the file')
+        self.append_checkbox.stateChanged.connect(self.check_file_exists)
+        self.check_file_exists()
 
         top_layout.addWidget(self.filename)
         top_layout.addWidget(self.browse_button)
         bottom_layout.addWidget(self.conf_checkbox)
+        bottom_layout.addWidget(self.append_checkbox)
         bottom_layout.addWidget(self.save_button)
 
 
     def save(self):
         """ Calls the saving method (of operator) and then calls check_file_exists to turn the filename red."""
-        self.__save_button_callback(self.filename.text(), store_conf=self.conf_checkbox.isChecked())
+        self.__save_button_callback(self.filename.text(), **self._options())
         self.check_file_exists()
 
+    def _options(self):
+        """ The keyword arguments for the saving method (append is only passed if it's checked). """
+        options = {'store_conf': self.conf_checkbox.isChecked()}
+        if self.append_checkbox.isChecked():
+            options['append'] = True
+        return options
+
     def check_file_exists(self):
-        """ Makes the filename line edit red if file exists, or black otherwise."""
-        if os.path.exists(self.filename.text()):
+        """ Makes the filename line edit red if file exists (and would be overwritten), or black otherwise."""
+        if os.path.exists(self.filename.text()) and not self.append_checkbox.isChecked():
             self.filename.setStyleSheet("color: red;")
         else:
             self.filename.setStyleSheet("color: black;")
@@ -88,7 +99,7 @@ class SaverWidget(QWidget):
             fname = os.path.join(labphew.parent_path, 'data.nc')
         fname = QFileDialog.getSaveFileName(self, 'Save data as', fname,
                                                 filter="netCDF4 (*.nc);;All Files (*.*)")
-        self.__save_button_callback(fname[0], store_conf=self.conf_checkbox.isChecked())
+        self.__save_button_callback(fname[0], **self._options())
         self.filename.setText(fname[0])
 
 
@@ -312,6 +323,103 @@ class ValueLabelItem(pg.LabelItem):
     def __getattr__(self, item):
         return getattr(self._ValueLabel, item)
 
+def minmax_decimate(x, y, buckets, x_range=None):
+    """
+    Reduce a curve to the minimum and maximum of y in each of a number of equal intervals of x (e.g. one per pixel
+    column), so that the drawn curve looks the same as the full curve: spikes remain visible, unlike with plain
+    downsampling. Each interval gives two points at the x of its first sample (min, then max), which are drawn as a
+    vertical line.
+
+    :param x: x values, increasing
+    :type x: numpy.ndarray
+    :param y: y values (NaN's are ignored)
+    :type y: numpy.ndarray
+    :param buckets: number of intervals
+    :type buckets: int
+    :param x_range: only return the points in this range (plus one point on either side) (default: None, meaning all)
+    :type x_range: (float, float) or None
+    :return: the decimated x and y (or the original ones if there are no more than 2 * buckets points)
+    :rtype: numpy.ndarray, numpy.ndarray
+    """
+    x, y = np.asarray(x), np.asarray(y)
+    if x_range is not None:
+        first = max(int(np.searchsorted(x, x_range[0], side='left')) - 1, 0)
+        last = min(int(np.searchsorted(x, x_range[1], side='right')) + 1, len(x))
+        x, y = x[first:last], y[first:last]
+    if len(x) <= 2 * buckets:
+        return x, y
+    edges = np.linspace(x[0], x[-1], int(buckets) + 1)[:-1]
+    starts = np.unique(np.searchsorted(x, edges, side='left'))  # the first sample of every non-empty interval
+    decimated = np.empty((len(starts), 2))
+    decimated[:, 0] = np.fmin.reduceat(y, starts)
+    decimated[:, 1] = np.fmax.reduceat(y, starts)
+    return np.repeat(x[starts], 2), decimated.ravel()
+
+
+class DecimatedCurve:
+    """
+    A curve (pyqtgraph PlotDataItem) that only receives about points_per_pixel points per pixel column of the plot,
+    using minmax_decimate(). It keeps the full data and decimates the visible part again only when new data is set or
+    when the visible x range or the size of the plot changes, so the cost of a redraw is bounded by the width of the
+    plot rather than by the size of the data.
+    It can be used like the PlotDataItem itself (other methods are passed on to it).
+    Data of which x is not monotonic, or plots with a logarithmic x axis, are passed on without decimation.
+    """
+    def __init__(self, plot, points_per_pixel=2, **kwargs):
+        """
+        :param plot: the plot to add the curve to
+        :type plot: pyqtgraph.PlotItem
+        :param points_per_pixel: number of points per pixel column (default: 2, the minimum and the maximum)
+        :type points_per_pixel: int
+        :param kwargs: arguments for the curve, see pyqtgraph.PlotItem.plot() (e.g. pen)
+        """
+        self.curve = plot.plot(**kwargs)
+        self.view_box = plot.getViewBox()
+        self.points_per_pixel = points_per_pixel
+        self._x = self._y = None
+        self._monotonic = False
+        self._key = None  # the visible range and width used for the current decimation
+        self.view_box.sigXRangeChanged.connect(self.update)
+        self.view_box.sigResized.connect(self.update)
+
+    def setData(self, x, y):
+        """
+        Set new data (and draw the decimated visible part).
+
+        :param x: x values
+        :type x: array_like
+        :param y: y values
+        :type y: array_like
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        if len(x) > 1 and x[0] > x[-1]:
+            x, y = x[::-1], y[::-1]
+        self._x, self._y = x, y
+        self._monotonic = bool(np.all(x[1:] >= x[:-1]))
+        self._key = None
+        self.update()
+
+    def update(self):
+        """Decimate the visible part of the data again, if the visible range or the width of the plot changed."""
+        x, y = self._x, self._y
+        if x is None:
+            return
+        pixels = max(int(self.view_box.width()), 100)
+        auto_range = self.view_box.autoRangeEnabled()[0]
+        x_range = None if auto_range else tuple(self.view_box.viewRange()[0])
+        key = (pixels, x_range)
+        if key == self._key:
+            return
+        self._key = key
+        buckets = pixels * self.points_per_pixel // 2
+        if len(x) > 2 * buckets and self._monotonic and not self.curve.opts['logMode'][0]:
+            x, y = minmax_decimate(x, y, buckets, x_range)
+        self.curve.setData(x, y)
+
+    def __getattr__(self, item):
+        return getattr(self.curve, item)
+
+
 def fit_on_screen(self):
     """Function to move and resize a QMainWindow (or maybe any QWidget) to fit on the available space of the current desktop screen."""
     frameGm = self.frameGeometry()
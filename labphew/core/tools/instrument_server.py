@@ -0,0 +1,373 @@
+"""
+labphew.core.tools.instrument_server
+====================================
+
+Share one controller (e.g. a DfwController or a camera) between several processes on the same computer.
+
+Most devices can only be opened by one process. An InstrumentServer owns the controller and serves method calls of
+local clients (for example a gui, a scripted scan and a logging daemon). Clients use an InstrumentProxy, which has the
+same API as the controller:
+
+- Methods (also of nested objects, e.g. proxy.ai.frequencySet(10000)) are called on the server and return the result.
+- Attributes can be read and set. Reading or setting an attribute that doesn't exist (or is private) raises
+  AttributeError, other exceptions on the server are raised in the client as RemoteError (with the message of the
+  server).
+- Large NumPy arrays (like acquired data blocks or camera frames) are not sent through the connection but written to
+  shared memory, from which the client copies them.
+- stream() repeatedly calls a method and yields the results.
+
+Calls of all clients are executed one at a time (under a lock), so they don't interfere on the device.
+The connection is a Unix domain socket (a named pipe on Windows), see server_address(). Clients are authenticated with
+a secret key that is stored in a file only readable by the user (see authkey()), so only processes of the same user can
+connect. Private attributes (names starting with _) of the controller can't be accessed.
+A simulated controller can be served as well, which is convenient for testing.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import inspect
+import logging
+import os
+import sys
+import tempfile
+import threading
+from functools import reduce
+from multiprocessing import shared_memory
+from multiprocessing.connection import Listener, Client, AuthenticationError
+import numpy as np
+
+
+default_authkey_path = os.path.join(os.path.expanduser('~'), '.labphew', 'instrument_server.key')
+
+
+def authkey(path=default_authkey_path):
+    """
+    The secret key to authenticate clients of InstrumentServers. It's generated the first time, and stored in a file that
+    only the user can read.
+
+    :param path: the file with the key (default: default_authkey_path)
+    :type path: str
+    :return: the key
+    :rtype: bytes
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read()
+    key = os.urandom(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def server_address(name):
+    """
+    The address of the InstrumentServer with this name.
+
+    :param name: name of the server (e.g. 'ad2')
+    :type name: str
+    :return: path of the Unix domain socket (or the named pipe on Windows)
+    :rtype: str
+    """
+    if sys.platform == 'win32':
+        return r'\\.\pipe\labphew-' + name
+    return os.path.join(tempfile.gettempdir(), f'labphew-{name}.sock')
+
+
+# Types of attributes that are sent to the client as values (other objects are accessed through a proxy)
+_value_types = (type(None), bool, int, float, complex, str, bytes, list, tuple, dict, set, np.ndarray, np.generic)
+
+
+class InstrumentServer:
+    """
+    Serves the methods and attributes of a controller to InstrumentProxy clients in other processes.
+    """
+    def __init__(self, controller, name='instrument', shm_threshold=65536):
+        """
+        :param controller: the controller object to serve
+        :param name: name of the server, used to determine the address (default: 'instrument')
+        :type name: str
+        :param shm_threshold: NumPy arrays of at least this number of bytes are passed via shared memory (default: 65536)
+        :type shm_threshold: int
+        """
+        self.logger = logging.getLogger(__name__)
+        self.controller = controller
+        self.name = name
+        self.address = server_address(name)
+        self.shm_threshold = shm_threshold
+        self._authkey = authkey()
+        self._lock = threading.RLock()
+        self._listener = None
+        self._thread = None
+        self._running = False
+        self.calls = 0  # number of calls served
+
+    def start(self):
+        """
+        Start serving in a background thread.
+        Nothing is started if another server with the same name is running.
+        """
+        if self._running:
+            self.logger.warning(f'server {self.name} is already running')
+            return
+        try:
+            Client(self.address, authkey=self._authkey).close()
+        except (FileNotFoundError, ConnectionRefusedError):
+            if sys.platform != 'win32' and os.path.exists(self.address):
+                os.remove(self.address)  # left over from a server that didn't stop properly
+        except Exception as e:
+            self.logger.error(f'not starting server {self.name}: {self.address} is in use ({type(e).__name__})')
+            return
+        else:
+            self.logger.error(f'not starting server {self.name}: another server is running on {self.address}')
+            return
+        self._listener = Listener(self.address, authkey=self._authkey)
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, daemon=True)
+        self._thread.start()
+        self.logger.info(f'instrument server {self.name} listening on {self.address}')
+
+    def serve_forever(self):
+        """
+        Start serving and block until stop() is called (or KeyboardInterrupt).
+        """
+        self.start()
+        try:
+            while self._running:
+                self._thread.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def stop(self):
+        """
+        Stop accepting new clients and close the listener.
+        """
+        if not self._running:
+            return
+        self._running = False
+        try:
+            Client(self.address, authkey=self._authkey).close()  # wake up the accept loop
+        except OSError:
+            pass
+        self._thread.join()
+        self._listener.close()
+        self.logger.info(f'instrument server {self.name} stopped')
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                conn = self._listener.accept()
+            except (AuthenticationError, EOFError):
+                self.logger.warning(f'rejected a client of {self.name} (wrong key)')
+                continue
+            except OSError:
+                break
+            if not self._running:
+                conn.close()
+                break
+            threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+
+    def _resolve(self, path):
+        """The attribute of the controller at a dotted path (private attributes are not accessible)."""
+        return reduce(getattr, _public_parts(path), self.controller)
+
+    def _check_defined(self, path):
+        """
+        Raise AttributeError if the attribute at path is not defined, but only produced by a __getattr__ that returns
+        None for unknown names (like the one of SimulatedDfwController).
+        """
+        parent, _, attr = path.rpartition('.')
+        try:
+            inspect.getattr_static(self._resolve(parent) if parent else self.controller, attr)
+        except AttributeError:
+            raise AttributeError(f'{path} is not defined') from None
+
+    def _serve_client(self, conn):
+        self.logger.debug(f'client connected to {self.name}')
+        shm = None  # shared memory block of this client, grows when needed
+        try:
+            while True:
+                try:
+                    request = conn.recv()
+                except (EOFError, OSError):
+                    break
+                kind, path = request[0], request[1]
+                try:
+                    with self._lock:
+                        if kind == 'call':
+                            result = self._resolve(path)(*request[2], **request[3])
+                        elif kind == 'getattr':
+                            result = self._resolve(path)
+                            if result is None:
+                                self._check_defined(path)
+                            if callable(result) and not isinstance(result, type):
+                                conn.send(('callable', None))
+                                continue
+                            if not isinstance(result, _value_types):
+                                conn.send(('object', None))
+                                continue
+                        elif kind == 'setattr':
+                            parent, _, attr = path.rpartition('.')
+                            setattr(self._resolve(parent) if parent else self.controller, _public_parts(attr)[0],
+                                    request[2])
+                            result = None
+                        else:
+                            raise ValueError(f'unknown request {kind}')
+                        self.calls += 1
+                except Exception as e:
+                    conn.send(('error', (type(e).__name__, str(e))))
+                    continue
+                if isinstance(result, np.ndarray) and result.nbytes >= self.shm_threshold:
+                    if shm is None or shm.size < result.nbytes:
+                        if shm is not None:
+                            shm.close()
+                            shm.unlink()
+                        shm = shared_memory.SharedMemory(create=True, size=result.nbytes)
+                    np.ndarray(result.shape, result.dtype, buffer=shm.buf)[...] = result
+                    conn.send(('shm', (shm.name, result.shape, result.dtype.str)))
+                else:
+                    conn.send(('value', result))
+        finally:
+            conn.close()
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            self.logger.debug(f'client disconnected from {self.name}')
+
+
+class RemoteError(Exception):
+    """An exception raised on the InstrumentServer (the message includes the type and message of the original)."""
+
+
+def _public_parts(path):
+    """The parts of a dotted path, raises AttributeError if one of them is private (starts with _)."""
+    parts = path.split('.')
+    for part in parts:
+        if part.startswith('_'):
+            raise AttributeError(f'{part} is private')
+    return parts
+
+
+def _attach_shared_memory(name):
+    shm = shared_memory.SharedMemory(name=name)
+    if sys.platform != 'win32':
+        # The server owns the block. Prevent the resource tracker of this process from removing it at exit.
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class InstrumentProxy:
+    """
+    Client of an InstrumentServer that can be used like the controller that is served.
+    """
+    def __init__(self, name='instrument', _path='', _connection=None):
+        """
+        :param name: name of the server (default: 'instrument')
+        :type name: str
+        """
+        object.__setattr__(self, '_path', _path)
+        if _connection is None:
+            _connection = {'conn': Client(server_address(name), authkey=authkey()), 'lock': threading.Lock(), 'shm': {}, 'kinds': {},
+                           'logger': logging.getLogger(__name__)}
+        object.__setattr__(self, '_connection', _connection)
+
+    def _full_path(self, item):
+        return f'{self._path}.{item}' if self._path else item
+
+    def _request(self, *request):
+        c = self._connection
+        with c['lock']:
+            c['conn'].send(request)
+            kind, value = c['conn'].recv()
+            if kind == 'shm':
+                name, shape, dtype = value
+                if name not in c['shm']:
+                    for old in c['shm'].values():  # the server replaced the block by a larger one
+                        old.close()
+                    c['shm'] = {name: _attach_shared_memory(name)}
+                # copy, because the next call may overwrite the shared memory
+                value = np.ndarray(shape, np.dtype(dtype), buffer=c['shm'][name].buf).copy()
+        if kind == 'error':
+            error, message = value
+            if error == 'AttributeError' and request[0] in ('getattr', 'setattr'):
+                raise AttributeError(message)
+            raise RemoteError(f'{request[1]} failed on server: {error}: {message}')
+        return kind, value
+
+    def __getattr__(self, item):
+        """Called for all attributes that don't exist in the proxy itself, i.e. those of the controller"""
+        if item.startswith('__'):
+            raise AttributeError(item)
+        path = self._full_path(item)
+        kinds = self._connection['kinds']
+        kind = kinds.get(path)
+        if kind is None:
+            kind, value = self._request('getattr', path)
+            if kind in ('callable', 'object'):
+                kinds[path] = kind  # remember, so the next access doesn't need a round trip
+            else:
+                return value
+        if kind == 'object':
+            return InstrumentProxy(_path=path, _connection=self._connection)
+
+        def remote_call(*args, **kwargs):
+            return self._request('call', path, args, kwargs)[1]
+        return remote_call
+
+    def __setattr__(self, key, value):
+        self._request('setattr', self._full_path(key), value)
+
+    def stream(self, method, *args, count=None, **kwargs):
+        """
+        Repeatedly call a method on the server and yield the results.
+
+        :param method: name of the method, e.g. 'read_analog_block'
+        :type method: str
+        :param count: number of results (default: None, meaning infinite)
+        :type count: int or None
+        """
+        path = self._full_path(method)
+        i = 0
+        while count is None or i < count:
+            yield self._request('call', path, args, kwargs)[1]
+            i += 1
+
+    def close(self):
+        """
+        Close the connection to the server.
+        """
+        c = self._connection
+        with c['lock']:
+            for shm in c['shm'].values():
+                shm.close()
+            c['shm'] = {}
+            c['conn'].close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == '__main__':
+    import labphew  # import this to use labphew style logging
+    import time
+    from labphew.controller.digilent.waveforms import SimulatedDfwController
+
+    server = InstrumentServer(SimulatedDfwController(), name='ad2-test')
+    server.start()
+
+    # Normally the proxy would be used in another process:
+    with InstrumentProxy('ad2-test') as daq:
+        daq.write_analog(1.2, 1)
+        print(daq.read_analog())
+        daq.preset_basic_analog(n=100000, freq=1e6)
+        t0 = time.time()
+        for block in daq.stream('read_analog_block', count=20):
+            pass
+        print(f'{20 * block.nbytes / (time.time() - t0) / 1e6:.0f} MB/s')
+
+    server.stop()
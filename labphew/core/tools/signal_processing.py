@@ -0,0 +1,236 @@
+"""
+labphew.core.tools.signal_processing
+====================================
+
+Signal processing on streams of data blocks (e.g. from DfwController.read_analog_block()).
+The classes keep their state between blocks and reuse their buffers, so they can keep up with continuous acquisition.
+
+- WelchPSD estimates the power spectral density with Welch's method (averaging over overlapping windowed segments
+  within a block, and over blocks).
+- DecimatingLowPass is a low-pass filter (cascaded first order sections, like a lock-in amplifier) followed by
+  decimation, which carries its state across blocks.
+- LockInDemodulator does I/Q demodulation of blocks with a precomputed reference table and a DecimatingLowPass.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import fft, signal
+
+
+class WelchPSD:
+    """
+    Welch-averaged power spectral density of one or more channels, updated block by block.
+    Within a block the PSD is averaged over all (overlapping) segments. Between blocks the average is a running mean for
+    the first 'averages' blocks and an exponential moving average after that.
+    """
+    def __init__(self, segment_length, frequency, window='hann', overlap=0.5, averages=10, channels=1):
+        """
+        :param segment_length: number of samples per segment (sets the frequency resolution: frequency/segment_length)
+        :type segment_length: int
+        :param frequency: sample rate (Hz)
+        :type frequency: float
+        :param window: window function, see scipy.signal.get_window (default: 'hann')
+        :type window: str or tuple
+        :param overlap: overlap of the segments (fraction) (default: 0.5)
+        :type overlap: float
+        :param averages: number of blocks to average (default: 10)
+        :type averages: int
+        :param channels: number of channels (default: 1)
+        :type channels: int
+        """
+        self.segment_length = int(segment_length)
+        self.frequency = float(frequency)
+        self.step = max(1, int(round(self.segment_length * (1 - overlap))))
+        self.averages = max(1, int(averages))
+        self.window = signal.get_window(window, self.segment_length)
+        # scaling to a one-sided density (V^2/Hz)
+        self._scale = np.full(self.segment_length // 2 + 1, 2 / (self.frequency * (self.window ** 2).sum()))
+        self._scale[0] /= 2
+        if self.segment_length % 2 == 0:
+            self._scale[-1] /= 2
+        self.frequencies = fft.rfftfreq(self.segment_length, 1 / self.frequency)
+        self.psd = np.zeros((channels, len(self.frequencies)))
+        self.count = 0  # number of blocks averaged
+        self._segments = np.zeros((0,))
+        self._power = np.zeros((0,))
+
+    def reset(self):
+        """Restart averaging."""
+        self.psd[:] = 0
+        self.count = 0
+
+    def update(self, block):
+        """
+        Add a block of samples.
+
+        :param block: samples of shape (channels, n) (or (n,) for a single channel), with n >= segment_length
+        :type block: numpy.ndarray
+        :return: the averaged psd of shape (channels, len(frequencies))
+        :rtype: numpy.ndarray
+        """
+        block = np.atleast_2d(block)
+        if block.shape[-1] < self.segment_length:
+            raise ValueError(f'block of {block.shape[-1]} samples is shorter than the segment length')
+        segments = sliding_window_view(block, self.segment_length, axis=-1)[:, ::self.step]
+        if self._segments.shape != segments.shape:
+            self._segments = np.empty(segments.shape)
+            self._power = np.empty(segments.shape[:2] + (len(self.frequencies),))
+        # remove the mean of each segment and apply the window, in the reused buffer
+        np.subtract(segments, segments.mean(axis=-1, keepdims=True), out=self._segments)
+        self._segments *= self.window
+        spectrum = fft.rfft(self._segments, axis=-1, overwrite_x=True, workers=-1)
+        np.multiply(spectrum.real, spectrum.real, out=self._power)
+        self._power += spectrum.imag ** 2
+        block_psd = self._power.mean(axis=1) * self._scale
+        self.count += 1
+        weight = 1 / min(self.count, self.averages)
+        self.psd *= 1 - weight
+        self.psd += weight * block_psd
+        return self.psd
+
+    def rms(self, f_min=0, f_max=None):
+        """
+        RMS value (of each channel) in a frequency band, calculated from the averaged psd.
+
+        :param f_min: lower bound of the band (Hz) (default: 0)
+        :type f_min: float
+        :param f_max: upper bound of the band (Hz) (default: None, meaning the Nyquist frequency)
+        :type f_max: float or None
+        :return: rms value per channel
+        :rtype: numpy.ndarray
+        """
+        band = self.frequencies >= f_min
+        if f_max is not None:
+            band &= self.frequencies <= f_max
+        return np.sqrt(self.psd[:, band].sum(axis=1) * self.frequency / self.segment_length)
+
+
+class DecimatingLowPass:
+    """
+    Low-pass filter of cascaded identical first order sections (the filter of a lock-in amplifier, with a roll-off of
+    6dB/octave per order), followed by decimation. The filter state and the decimation phase are carried across blocks,
+    so a stream of blocks gives the same result as one long block.
+    """
+    def __init__(self, time_constant, sample_rate, order=4, decimation=1, channels=1):
+        """
+        :param time_constant: time constant of each section (s)
+        :type time_constant: float
+        :param sample_rate: sample rate of the input (Hz)
+        :type sample_rate: float
+        :param order: number of sections (default: 4)
+        :type order: int
+        :param decimation: keep one of every decimation samples (default: 1)
+        :type decimation: int
+        :param channels: number of channels (default: 1)
+        :type channels: int
+        """
+        self.time_constant = time_constant
+        self.sample_rate = float(sample_rate)
+        self.order = int(order)
+        self.decimation = max(1, int(decimation))
+        alpha = 1 - np.exp(-1 / (time_constant * self.sample_rate))
+        b, a = np.array([alpha]), np.array([1.0, alpha - 1])
+        self.b, self.a = b, a
+        for i in range(self.order - 1):
+            self.b, self.a = np.convolve(self.b, b), np.convolve(self.a, a)
+        self.channels = channels
+        self.reset()
+
+    def reset(self):
+        """Reset the filter state (the next block starts in the steady state of its first sample)."""
+        self._state = None
+        self._offset = 0  # index in the next block of the first sample to keep
+
+    def filter(self, x):
+        """
+        Filter and decimate a block.
+
+        :param x: samples of shape (channels, n) (may be complex)
+        :type x: numpy.ndarray
+        :return: filtered samples of shape (channels, m), and the indices (in x) of the kept samples
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        if self._state is None:
+            self._state = signal.lfilter_zi(self.b, self.a)[None, :] * x[:, :1]
+        y, self._state = signal.lfilter(self.b, self.a, x, axis=-1, zi=self._state)
+        indices = np.arange(self._offset, x.shape[-1], self.decimation)
+        self._offset = (self._offset - x.shape[-1]) % self.decimation
+        return y[:, indices], indices
+
+
+class LockInDemodulator:
+    """
+    Dual-phase (I/Q) demodulation of a stream of blocks.
+    The input is multiplied by a precomputed complex reference table, low-pass filtered and decimated.
+    The output X + iY is in V rms, with the phase relative to a cosine reference.
+    """
+    def __init__(self, sample_rate, reference_frequency, time_constant, order=4, output_rate=None, channels=1,
+                 reference_phase=0.0):
+        """
+        :param sample_rate: sample rate of the input (Hz)
+        :type sample_rate: float
+        :param reference_frequency: frequency to demodulate (Hz)
+        :type reference_frequency: float
+        :param time_constant: time constant of the low-pass filter sections (s)
+        :type time_constant: float
+        :param order: order of the low-pass filter (default: 4)
+        :type order: int
+        :param output_rate: approximate rate of the output (Hz) (default: None, meaning the sample rate)
+        :type output_rate: float or None
+        :param channels: number of channels (default: 1)
+        :type channels: int
+        :param reference_phase: phase of the reference (degrees), e.g. -90 to measure relative to a sine (default: 0)
+        :type reference_phase: float
+        """
+        self.sample_rate = float(sample_rate)
+        self.reference_frequency = float(reference_frequency)
+        self.reference_phase = reference_phase
+        decimation = 1 if output_rate is None else max(1, int(round(self.sample_rate / output_rate)))
+        self.output_rate = self.sample_rate / decimation
+        self.lowpass = DecimatingLowPass(time_constant, self.sample_rate, order, decimation, channels)
+        self._table = np.zeros(0, dtype=complex)
+        self.sample_index = 0  # index of the next sample in the stream
+
+    def reset(self):
+        """Reset the filter and the time of the stream."""
+        self.lowpass.reset()
+        self.sample_index = 0
+
+    def _reference(self, n):
+        if len(self._table) != n:
+            self._table = np.exp(-2j * np.pi * self.reference_frequency * np.arange(n) / self.sample_rate)
+        # the table is the same for every block, the start phase of the block is applied as a single factor
+        phase = 2 * np.pi * self.reference_frequency * self.sample_index / self.sample_rate
+        return self._table * np.exp(-1j * (phase + np.radians(self.reference_phase)))
+
+    def demodulate(self, block):
+        """
+        Demodulate the next block of the stream.
+
+        :param block: samples of shape (channels, n) (or (n,) for a single channel)
+        :type block: numpy.ndarray
+        :return: times (s) of the output samples, and X + iY of shape (channels, m) (V rms)
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        block = np.atleast_2d(block)
+        n = block.shape[-1]
+        mixed = block * self._reference(n)
+        z, indices = self.lowpass.filter(mixed)
+        t = (self.sample_index + indices) / self.sample_rate
+        self.sample_index += n
+        return t, z * np.sqrt(2)
+
+
+if __name__ == '__main__':
+    import time
+    fs, n = 1e6, 2**16
+    psd = WelchPSD(4096, fs, channels=2)
+    rng = np.random.default_rng()
+    t0 = time.time()
+    for i in range(50):
+        block = rng.normal(scale=1e-3, size=(2, n))  # white noise of 1mV rms
+        block[0] += np.sin(2 * np.pi * 10e3 * (i * n + np.arange(n)) / fs)
+        psd.update(block)
+    print(f'{50 / (time.time() - t0):.0f} blocks/s, noise density {np.sqrt(np.median(psd.psd[1])) * 1e6:.2f} uV/sqrt(Hz)'
+          f' (expected {1e-3 / np.sqrt(fs / 2) * 1e6:.2f}), rms {psd.rms()}')
@@ -0,0 +1,280 @@
+"""
+labphew.core.tools.statistics
+=============================
+
+Online statistics for repeated scans.
+
+RunningStatistics keeps the per-point mean, variance, minimum and maximum of repeated runs (e.g. sweeps) in
+preallocated arrays, using Welford's algorithm. The memory use only depends on the number of points, not on the number
+of runs. Optionally a bounded reservoir of complete raw runs is kept (a uniform random sample of all runs).
+
+Histogram counts values (e.g. loop latencies) in preallocated linear bins, so percentiles of long running processes can
+be reported without keeping all values.
+
+PersistenceHistogram accumulates many frames (e.g. oscilloscope captures) in a preallocated 2D histogram of sample
+index versus value, like the persistence display of an oscilloscope.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import numpy as np
+
+
+class RunningStatistics:
+    """
+    Per-point running statistics of repeated runs.
+    Values can be added point by point with add() (call end_run() after each run), or a complete run at once with
+    add_run().
+    """
+    def __init__(self, n_points, reservoir_size=0, seed=None):
+        """
+        :param n_points: number of points per run
+        :type n_points: int
+        :param reservoir_size: number of raw runs to keep (default: 0)
+        :type reservoir_size: int
+        :param seed: seed for the random number generator of the reservoir
+        :type seed: int or None
+        """
+        self.n_points = int(n_points)
+        self.reservoir_size = int(reservoir_size)
+        self.rng = np.random.default_rng(seed)
+        self.count = np.zeros(self.n_points, dtype=np.int64)
+        self.mean = np.full(self.n_points, np.nan)
+        self._m2 = np.zeros(self.n_points)  # sum of squared differences from the mean
+        self.min = np.full(self.n_points, np.inf)
+        self.max = np.full(self.n_points, -np.inf)
+        self.runs = 0  # number of completed runs
+        self.reservoir = np.full((self.reservoir_size, self.n_points), np.nan)
+        self._current = np.full(self.n_points, np.nan)  # the run in progress (for the reservoir)
+
+    def add(self, index, value):
+        """
+        Add one value of the current run.
+
+        :param index: index of the point
+        :type index: int
+        :param value: measured value
+        :type value: float
+        """
+        n = self.count[index] + 1
+        self.count[index] = n
+        mean = self.mean[index] if n > 1 else 0.0
+        delta = value - mean
+        mean += delta / n
+        self.mean[index] = mean
+        self._m2[index] += delta * (value - mean)
+        if value < self.min[index]:
+            self.min[index] = value
+        if value > self.max[index]:
+            self.max[index] = value
+        if self.reservoir_size:
+            self._current[index] = value
+
+    def end_run(self):
+        """
+        Mark the end of a run that was added with add(). Updates the reservoir.
+        """
+        self.runs += 1
+        if self.reservoir_size:
+            self._to_reservoir(self._current)
+            self._current = np.full(self.n_points, np.nan)
+
+    def add_run(self, values):
+        """
+        Add a complete run (vectorized).
+
+        :param values: the values of all points (NaN for points that were not measured)
+        :type values: array_like
+        """
+        values = np.asarray(values, dtype=float)
+        measured = ~np.isnan(values)
+        mean = np.where(self.count > 0, self.mean, 0.0)
+        self.count += measured
+        n = np.where(measured, self.count, 1)
+        delta = np.where(measured, values - mean, 0.0)
+        mean = mean + delta / n
+        self._m2 += delta * np.where(measured, values - mean, 0.0)
+        self.mean = np.where(self.count > 0, mean, np.nan)
+        np.fmin(self.min, values, out=self.min)
+        np.fmax(self.max, values, out=self.max)
+        self.runs += 1
+        if self.reservoir_size:
+            self._to_reservoir(values)
+
+    def _to_reservoir(self, run):
+        # Algorithm R: every run ends up in the reservoir with probability reservoir_size / runs
+        if self.runs <= self.reservoir_size:
+            self.reservoir[self.runs - 1] = run
+        else:
+            j = self.rng.integers(self.runs)
+            if j < self.reservoir_size:
+                self.reservoir[j] = run
+
+    @property
+    def variance(self):
+        """Sample variance per point (NaN for points with fewer than 2 values)."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.count > 1, self._m2 / (self.count - 1), np.nan)
+
+    @property
+    def std(self):
+        """Sample standard deviation per point."""
+        return np.sqrt(self.variance)
+
+    @property
+    def sem(self):
+        """Standard error of the mean per point."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.std / np.sqrt(self.count)
+
+    @property
+    def reservoir_runs(self):
+        """The raw runs in the reservoir (only the filled rows)."""
+        return self.reservoir[:min(self.runs, self.reservoir_size)]
+
+
+class Histogram:
+    """
+    Histogram with linear bins from 0 to bins * bin_width. Values above the range are counted in the last bin (and
+    negative values in the first), the largest value is kept separately.
+    """
+    def __init__(self, bin_width, bins=1000):
+        """
+        :param bin_width: width of the bins
+        :type bin_width: float
+        :param bins: number of bins (default: 1000)
+        :type bins: int
+        """
+        self.bin_width = bin_width
+        self.bins = int(bins)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.edges = np.arange(self.bins + 1) * bin_width
+        self.reset()
+
+    def reset(self):
+        """Set all counts to 0."""
+        self.counts[:] = 0
+        self.total = 0
+        self.sum = 0.0
+        self.max = -np.inf
+
+    def add(self, value):
+        """
+        Count one value.
+
+        :param value: the value
+        :type value: float
+        """
+        i = int(value / self.bin_width)
+        self.counts[0 if i < 0 else (i if i < self.bins else self.bins - 1)] += 1
+        self.total += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        """The mean of the values (NaN if empty)."""
+        return self.sum / self.total if self.total else np.nan
+
+    def percentile(self, q):
+        """
+        Estimate a percentile from the counts (the upper edge of the bin that contains it).
+
+        :param q: percentile (0 to 100)
+        :type q: float
+        :return: the estimated percentile (NaN if empty)
+        :rtype: float
+        """
+        if not self.total:
+            return np.nan
+        i = int(np.searchsorted(np.cumsum(self.counts), q / 100 * self.total))
+        return float(self.edges[min(i, self.bins - 1) + 1])
+
+
+class PersistenceHistogram:
+    """
+    2D histogram of frames: for each sample index of the frame the number of times each value range occurred.
+    Frames are added vectorized (also many at once). Optionally older frames fade out exponentially. Rather than
+    multiplying all counts by the decay for every frame, new frames get a growing weight (and the counts are rescaled
+    once in a while), so the counts are only relative.
+    """
+    def __init__(self, samples, bins=256, range=(-5.0, 5.0), decay=None):
+        """
+        :param samples: number of samples per frame
+        :type samples: int
+        :param bins: number of value bins (default: 256)
+        :type bins: int
+        :param range: lower and upper value of the bins (default: (-5, 5))
+        :type range: (float, float)
+        :param decay: factor by which the counts are multiplied for every added frame, None for no decay (default: None)
+        :type decay: float or None
+        """
+        self.samples = int(samples)
+        self.bins = int(bins)
+        self.range = range
+        self.decay = decay
+        self.counts = np.zeros((self.samples, self.bins))
+        self.frames = 0
+        self._weight = 1.0  # weight of the next frame
+        self._offsets = np.arange(self.samples) * self.bins  # offset of each sample (row) in the flattened counts
+
+    def reset(self):
+        """Set all counts to 0."""
+        self.counts[:] = 0
+        self.frames = 0
+        self._weight = 1.0
+
+    def add(self, frames):
+        """
+        Add one or more frames. Values outside the range are counted in the first or last bin.
+
+        :param frames: array of shape (samples,) or (number of frames, samples)
+        :type frames: numpy.ndarray
+        """
+        frames = np.atleast_2d(frames)
+        lower, upper = self.range
+        index = ((frames - lower) * (self.bins / (upper - lower))).astype(np.intp)
+        np.clip(index, 0, self.bins - 1, out=index)
+        index += self._offsets
+        flat = self.counts.reshape(-1)
+        if self.decay is None and len(frames) > 16:
+            flat += np.bincount(index.ravel(), minlength=flat.size)
+        else:
+            # within one frame every row is hit once, so the counts can be incremented by indexing
+            for row in index:
+                if self.decay is not None:
+                    self._weight /= self.decay
+                flat[row] += self._weight
+            if self._weight > 1e100:
+                self.counts /= self._weight
+                self._weight = 1.0
+        self.frames += len(frames)
+
+    def image(self, log=True):
+        """
+        The counts scaled from 0 to 1, for display.
+        For logarithmic scaling the counts are first normalized to the weight of the newest frame (1 for a hit by that
+        frame), so the image doesn't depend on the internal scale of the counts.
+
+        :param log: logarithmic scaling, which shows rare events better (default: True)
+        :type log: bool
+        :return: array of shape (samples, bins)
+        :rtype: numpy.ndarray
+        """
+        image = np.log1p(self.counts / self._weight) if log else self.counts.copy()
+        peak = image.max()
+        if peak > 0:
+            image /= peak
+        return image
+
+
+if __name__ == '__main__':
+    import time
+    points, runs = 1000, 500
+    truth = np.sin(np.linspace(0, 6, points))
+    stats = RunningStatistics(points, reservoir_size=10, seed=0)
+    t0 = time.time()
+    for r in range(runs):
+        stats.add_run(truth + np.random.normal(scale=0.5, size=points))
+    print(f'{runs} runs in {time.time() - t0:.3f}s, max error of mean: {np.abs(stats.mean - truth).max():.3f}, '
+          f'mean std: {stats.std.mean():.3f}, reservoir: {stats.reservoir_runs.shape}')
@@ -0,0 +1,15 @@
+"""
+labphew.data
+============
+
+Tools for working with saved labphew datasets (the netCDF files written by Operator.save_scan()).
+
+- reader: lazy (chunked) opening, coordinate range selection and block-wise iteration for files that don't fit in memory
+- catalog: SQLite catalog of saved files (attributes, shapes and summary statistics) that can be queried
+- container: many runs of a scan in one file, along a 'run' dimension (ragged runs are padded)
+- batch: parallel analysis of many files (and runs of containers), with the results combined along a 'scan' dimension
+  and cached
+"""
+from labphew.data.reader import open_scan, iter_chunks, summary
+from labphew.data.catalog import Catalog
+from labphew.data.batch import map_files
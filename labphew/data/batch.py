@@ -0,0 +1,283 @@
+"""
+labphew.data.batch
+==================
+
+Batch analysis of many saved datasets (e.g. all scans of a measurement campaign).
+
+map_files() applies a function (a fit, a reduction, feature extraction, ...) to each file in parallel worker processes
+and combines the results into one Dataset with a 'scan' dimension (with the file and run of each scan as coordinates).
+Each run of a container file (see labphew.data.container) is processed separately, the run coordinate is its index
+(-1 for normal files).
+
+- The function receives the dataset opened lazily (see labphew.data.reader.open_scan()), so only the data it uses is
+  read. For files that don't fit in memory it can process the data block by block with iter_chunks(). Runs of
+  container files are read into memory (see labphew.data.container.read_run()).
+- The function returns a dict of scalars and arrays, an xarray DataArray or Dataset, or a single value. Results of
+  different length (e.g. of scans that were stopped early) are padded with NaN.
+- Results are cached on disk, keyed by a hash of the file content (and the run) and the version of the function (by
+  default derived from its source code), so running it again only processes new or changed files.
+- Progress is logged (and optionally passed to a callback).
+
+Note that the function is sent to the worker processes, so it has to be defined at the top level of a module (not a
+lambda), and on Windows map_files() should be called under if __name__ == '__main__'.
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import xarray as xr
+from labphew.data.reader import open_scan
+from labphew.data.container import ScanContainer, is_container
+
+default_cache_path = os.path.join(os.path.expanduser('~'), '.labphew', 'batch_cache')
+
+
+def file_hash(path, block_size=2**20):
+    """
+    :param path: the file
+    :type path: str
+    :param block_size: number of bytes read at a time (default: 2**20)
+    :type block_size: int
+    :return: SHA-1 hash of the content of the file
+    :rtype: str
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def function_version(func):
+    """
+    :param func: the function
+    :type func: callable
+    :return: version of a function: its name and a hash of its source code (or only the name if there is no source)
+    :rtype: str
+    """
+    name = f'{func.__module__}.{getattr(func, "__qualname__", type(func).__name__)}'
+    try:
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        return name
+    return f'{name}-{hashlib.sha1(source.encode()).hexdigest()[:12]}'
+
+
+def _to_dataset(result):
+    """Convert the result of a function to a Dataset (dimensions without coordinate get an integer coordinate)."""
+    if isinstance(result, xr.DataArray):
+        result = result.to_dataset(name=result.name or 'result')
+    elif not isinstance(result, xr.Dataset):
+        if not isinstance(result, dict):
+            result = {'result': result}
+        variables = {}
+        for name, value in result.items():
+            if isinstance(value, xr.DataArray):
+                variables[name] = value
+            else:
+                value = np.asarray(value)
+                variables[name] = (tuple(f'{name}_dim_{i}' for i in range(value.ndim)), value)
+        result = xr.Dataset(variables)
+    missing = {dim: np.arange(size) for dim, size in result.sizes.items() if dim not in result.coords}
+    return result.assign_coords(missing).load()
+
+
+def _cached(compute, cached):
+    """
+    The result from the cache file, or computed (and saved in the cache file).
+
+    :param compute: function without arguments that returns the result (as Dataset)
+    :param cached: the cache file (None for no cache)
+    :return: (result, True if it was read from the cache)
+    """
+    if cached is not None and os.path.isfile(cached):
+        return xr.load_dataset(cached), True
+    result = compute()
+    if cached is not None:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        temporary = f'{cached}.{os.getpid()}.tmp'
+        result.to_netcdf(temporary)
+        os.replace(temporary, cached)  # other processes never see a partially written file
+    return result, False
+
+
+def _process(func, path, run, known_hash, version, cache, chunks):
+    """
+    Process one file, or one run of a container file (in a worker process). A container file without run is processed
+    run by run.
+
+    :return: (path, hash, list of (run, result), number of results from cache, error message)
+    """
+    def compute_file():
+        with open_scan(path, chunks=chunks) as dataset:
+            return _to_dataset(func(dataset))
+
+    try:
+        digest = known_hash or file_hash(path)
+        directory = None if cache is None else os.path.join(cache, version)
+        cached = None if cache is None else os.path.join(directory, digest + '.nc')
+        if run is None and (cached is not None and os.path.isfile(cached) or not is_container(path)):
+            result, from_cache = _cached(compute_file, cached)
+            return path, digest, [(None, result)], int(from_cache), None
+        results, from_cache = [], 0
+        with ScanContainer(path, mode='r') as container:
+            for index in range(len(container)) if run is None else [run]:
+                cached = None if cache is None else os.path.join(directory, f'{digest}_run{index}.nc')
+                result, hit = _cached(lambda: _to_dataset(func(container[index])), cached)
+                results.append((index, result))
+                from_cache += hit
+        return path, digest, results, from_cache, None
+    except Exception as e:
+        return path, known_hash, None, 0, f'{type(e).__name__}: {e}'
+
+
+def _file_list(files):
+    """
+    A list of (path, run) from a glob pattern, a list of paths, or a list of catalog records (run is None, except for
+    records of runs of container files).
+    """
+    if isinstance(files, (str, os.PathLike)):
+        return [(path, None) for path in sorted(glob.glob(os.fspath(files), recursive=True))]
+    return list(dict.fromkeys((os.fspath(f['path']), f.get('run')) if isinstance(f, dict) else (os.fspath(f), None)
+                              for f in files))
+
+
+def map_files(func, files, workers=None, version=None, cache=default_cache_path, chunks=None, progress=None):
+    """
+    Apply a function to saved datasets (and the runs of container files) in parallel and combine the results along a
+    'scan' dimension. Files that fail are logged and left out.
+
+    Example:
+    >>> def peak(dat):
+    >>>     return {'position': float(dat.measured_voltage.idxmax()), 'height': float(dat.measured_voltage.max())}
+    >>> results = map_files(peak, catalog.find(user='X'))
+
+    :param func: function that takes a dataset and returns a dict, DataArray, Dataset or value (see module docstring)
+    :type func: callable
+    :param files: glob pattern (e.g. 'C:/data/**/*.nc'), list of paths, or list of records of Catalog.find()
+    :type files: str or list
+    :param workers: number of worker processes (default: None, meaning the number of processors; 0 means no workers:
+                    process the files in this process)
+    :type workers: int or None
+    :param version: version of the function for the cache, change it to invalidate the cached results (default: None,
+                    meaning derived from the source code, see function_version())
+    :type version: str or None
+    :param cache: directory of the cache (default: default_cache_path), None for no cache
+    :type cache: str or None
+    :param chunks: chunks of the opened datasets, see open_scan() (default: None, meaning lazily indexed arrays)
+    :type chunks: str or int or dict or None
+    :param progress: function that is called after each file (or run) as progress(done, total) (default: None)
+    :type progress: callable or None
+    :return: the results, with coordinates file and run (-1 for normal files) of each scan (and the version of the
+             function as attribute)
+    :rtype: xarray.Dataset
+    """
+    logger = logging.getLogger(__name__)
+    items = _file_list(files)
+    version = function_version(func) if version is None else version
+    version = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in version)  # safe as directory name
+    hashes = _load_hashes(cache)
+    stats = {path: os.stat(path) for path, run in items if os.path.isfile(path)}
+    known = {}
+    for path, stat in stats.items():
+        entry = hashes.get(os.path.abspath(path))
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            known[path] = entry[2]
+    for path in dict.fromkeys(path for path, run in items if path not in stats):
+        logger.warning(f'file not found: {path}')
+
+    results, from_cache = {}, 0
+    start = last_report = time.time()
+    todo = [(path, run) for path, run in items if path in stats]
+    executor = None if workers == 0 else ProcessPoolExecutor(max_workers=workers)
+    try:
+        if executor is None:
+            outcomes = (_process(func, path, run, known.get(path), version, cache, chunks) for path, run in todo)
+        else:
+            outcomes = (future.result() for future in as_completed(
+                [executor.submit(_process, func, path, run, known.get(path), version, cache, chunks)
+                 for path, run in todo]))
+        for done, (path, digest, runs, cached, error) in enumerate(outcomes, 1):
+            if error is not None:
+                logger.warning(f'could not process {path} ({error})')
+            else:
+                for run, result in runs:
+                    results[path, run] = result
+                from_cache += cached
+                stat = stats[path]
+                hashes[os.path.abspath(path)] = [stat.st_size, stat.st_mtime_ns, digest]
+            if progress is not None:
+                progress(done, len(todo))
+            now = time.time()
+            if now - last_report >= 5 or done == len(todo):
+                last_report = now
+                rate = done / max(now - start, 1e-9)
+                logger.info(f'processed {done} of {len(todo)} files ({from_cache} results from cache), '
+                            f'{rate:.1f} files/s, {(len(todo) - done) / rate:.0f}s left')
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        _save_hashes(cache, hashes)
+
+    # in the order of the list, with the runs of a container file that was listed without run in order of run
+    position = {item: i for i, item in enumerate(todo)}
+    ordered = sorted(results, key=lambda key: (position.get(key, position.get((key[0], None))),
+                                               -1 if key[1] is None else key[1]))
+    if not ordered:
+        return xr.Dataset(coords={'file': ('scan', np.array([], dtype=str)), 'run': ('scan', np.array([], dtype=int))})
+    combined = xr.concat([results[key] for key in ordered], dim='scan', join='outer', combine_attrs='drop',
+                         fill_value=np.nan)
+    combined.attrs['version'] = version
+    return combined.assign_coords(file=('scan', [path for path, run in ordered]),
+                                  run=('scan', [-1 if run is None else run for path, run in ordered]))
+
+
+def _load_hashes(cache):
+    """The known file hashes {path: [size, mtime_ns, hash]} (so unchanged files don't have to be read again)."""
+    if cache is None or not os.path.isfile(os.path.join(cache, 'hashes.json')):
+        return {}
+    try:
+        with open(os.path.join(cache, 'hashes.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hashes(cache, hashes):
+    if cache is None:
+        return
+    os.makedirs(cache, exist_ok=True)
+    temporary = os.path.join(cache, f'hashes.json.{os.getpid()}.tmp')
+    with open(temporary, 'w') as f:
+        json.dump(hashes, f)
+    os.replace(temporary, os.path.join(cache, 'hashes.json'))
+
+
+def peak(dataset):
+    """Example analysis function: position and height of the maximum of the first data variable."""
+    var = dataset[list(dataset.data_vars)[0]]
+    index = int(np.argmax(var.values))
+    return {'position': float(var[var.dims[0]][index]), 'height': float(var[index]), 'mean': float(var.mean())}
+
+
+if __name__ == '__main__':
+    import tempfile
+    directory = tempfile.mkdtemp()
+    for i in range(20):
+        voltages = np.linspace(0, 5, 101 + 10 * i)
+        xr.Dataset(coords={'scan_voltage': ('scan_voltage', voltages, {'units': 'V'})},
+                   data_vars={'measured_voltage': ('scan_voltage', np.exp(-(voltages - 0.1 * i) ** 2))}
+                   ).to_netcdf(os.path.join(directory, f'scan {i:02d}.nc'))
+    cache = os.path.join(directory, 'cache')
+    for attempt in range(2):
+        t0 = time.time()
+        results = map_files(peak, os.path.join(directory, '*.nc'), workers=4, cache=cache)
+        print(f'{results.sizes["scan"]} scans in {time.time() - t0:.2f}s')
+    print(results)
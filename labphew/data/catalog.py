@@ -0,0 +1,443 @@
+"""
+labphew.data.catalog
+====================
+
+A searchable catalog (an SQLite database) of saved labphew datasets, so scans can be found without opening thousands of
+files.
+
+For each file the catalog stores the path, size and modification time, the time of the measurement (the 'time'
+attribute), all attributes (e.g. user, config_file and the scan parameters), and for each variable its dimensions,
+shape, data type, units and summary statistics (count, mean, std, min, max).
+Container files (see labphew.data.container) are cataloged per run: a record for each run, with the index of the run
+(for normal files the run is None).
+
+- Catalog.add() adds (or updates) one file, or one run of a container. Operators do this automatically in save_scan()
+  (see OperatorBase.add_to_catalog()), for the catalog set in properties['catalog'] (default: default_path).
+- Catalog.scan() adds the files in a directory that are new or changed since they were cataloged, reading them in
+  parallel worker processes. Catalog.rebuild() catalogs all of them again. From the command line:
+  labphew catalog <directory> [--rebuild] [--workers N] [--catalog <file>]
+- Catalog.find() returns the records of the files (and runs) that match conditions on the time, attributes and
+  variables, and Catalog.open() yields the matching datasets, opened lazily (see labphew.data.reader.open_scan()).
+
+Conditions on attributes are keywords: a value for equality, or a (low, high) tuple for a range (None for no limit).
+For example all scans by user X with step < 0.01 of the last month:
+>>> catalog.find(user='X', step=(None, 0.01), since=datetime.now() - timedelta(days=30))
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, date
+import numpy as np
+import xarray as xr
+from labphew.data.reader import open_scan, summary
+from labphew.data.container import ScanContainer, is_container, read_run
+
+default_path = os.path.join(os.path.expanduser('~'), '.labphew', 'catalog.sqlite')
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT NOT NULL, run INTEGER, size INTEGER, mtime REAL,
+                                  time TEXT, sizes TEXT, UNIQUE (path, run));
+CREATE TABLE IF NOT EXISTS attrs (file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE, key TEXT NOT NULL,
+                                  value TEXT, number REAL, kind TEXT);
+CREATE TABLE IF NOT EXISTS variables (file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+                                      name TEXT NOT NULL, dims TEXT, shape TEXT, dtype TEXT, units TEXT, count INTEGER,
+                                      mean REAL, std REAL, min REAL, max REAL);
+CREATE INDEX IF NOT EXISTS files_time ON files (time);
+CREATE INDEX IF NOT EXISTS attrs_key_number ON attrs (key, number);
+CREATE INDEX IF NOT EXISTS attrs_key_value ON attrs (key, value);
+CREATE INDEX IF NOT EXISTS attrs_file ON attrs (file_id);
+CREATE INDEX IF NOT EXISTS variables_file ON variables (file_id);
+CREATE INDEX IF NOT EXISTS variables_name ON variables (name);
+"""
+
+
+def _measurement_time(attrs, mtime):
+    """The 'time' attribute (as written by save_scan) in ISO format, or the modification time if it can't be parsed."""
+    value = attrs.get('time')
+    if isinstance(value, str):
+        for parse in (lambda s: datetime.strptime(s, '%d-%m-%YT%H:%M:%S'), datetime.fromisoformat):
+            try:
+                return parse(value).isoformat(timespec='seconds')
+            except ValueError:
+                pass
+    return datetime.fromtimestamp(mtime).isoformat(timespec='seconds')
+
+
+def _iso(value):
+    """Convert a datetime or date to an ISO string (strings are passed on)."""
+    if isinstance(value, datetime):
+        return value.isoformat(timespec='seconds')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _plain(value):
+    """Convert numpy scalars and arrays to python types (for the database and json)."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _attribute_row(value):
+    """
+    The value, number and kind columns of an attribute. Values other than strings are stored as json, so they are
+    returned with their original type (e.g. int, float or bool), and numbers (and booleans) also as number for range
+    queries. The kind is 'str', 'int', 'float', 'bool' or 'json'.
+    """
+    if isinstance(value, str):
+        return value, None, 'str'
+    if isinstance(value, (bool, int, float)):
+        return json.dumps(value), value, type(value).__name__
+    return json.dumps(value), None, 'json'
+
+
+def _attribute_value(row):
+    """The value of an attribute row (see _attribute_row())."""
+    return row['value'] if row['kind'] == 'str' else json.loads(row['value'])
+
+
+def describe(source, path=None, run=None):
+    """
+    The catalog record of a dataset.
+
+    :param source: full path and filename, or a dataset (e.g. the one that was just saved)
+    :type source: str or os.PathLike or xarray.Dataset
+    :param path: the file of the dataset (default: None, meaning source)
+    :type path: str or None
+    :param run: index of the run if the dataset is a run of a container file (default: None)
+    :type run: int or None
+    :return: dictionary with path, run, size, mtime, time, sizes (of the dimensions), attrs and variables (a list of
+             dictionaries with name, dims, shape, dtype, units and the summary statistics)
+    :rtype: dict
+    """
+    path = os.path.abspath(source if path is None else path)
+    stat = os.stat(path)
+    dataset = open_scan(source, chunks=None) if not isinstance(source, xr.Dataset) else source
+    try:
+        stats = summary(dataset)
+        variables = []
+        for name, var in dataset.variables.items():
+            variables.append(dict(name=name, dims=list(var.dims), shape=list(var.shape), dtype=str(var.dtype),
+                                  units=var.attrs.get('units'), **stats.get(name, {})))
+        attrs = {key: _plain(value) for key, value in dataset.attrs.items()}
+        sizes = dict(dataset.sizes)
+    finally:
+        if not isinstance(source, xr.Dataset):
+            dataset.close()
+    return {'path': path, 'run': run, 'size': stat.st_size, 'mtime': stat.st_mtime,
+            'time': _measurement_time(attrs, stat.st_mtime), 'sizes': sizes, 'attrs': attrs, 'variables': variables}
+
+
+def _describe_file(path):
+    """
+    The records of a file (one for each run of a container file), for a worker process.
+
+    :return: (path, records, None), or (path, None, error message)
+    """
+    try:
+        if is_container(path):
+            with ScanContainer(path, mode='r') as container:
+                return path, [describe(container[run], path, run) for run in range(len(container))], None
+        return path, [describe(path)], None
+    except Exception as e:
+        return path, None, f'{type(e).__name__}: {e}'
+
+
+class Catalog:
+    """
+    SQLite catalog of saved datasets.
+    It can be used in a with block (to close the database).
+    """
+    def __init__(self, path=None):
+        """
+        :param path: the database file, created if it doesn't exist (default: None, meaning default_path)
+        :type path: str or None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.path = default_path if path is None else os.path.expanduser(path)
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._db = sqlite3.connect(self.path, timeout=30)  # wait for other processes that are writing
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA foreign_keys = ON')
+        self._db.executescript(_schema)
+
+    def close(self):
+        """Close the database."""
+        self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def add(self, source, path=None, run=None):
+        """
+        Add a dataset to the catalog (or update it if the file or run is cataloged already).
+        A container file (given as filename) is added with all its runs.
+
+        :param source: full path and filename, or a dataset (e.g. the one that was just saved)
+        :type source: str or os.PathLike or xarray.Dataset
+        :param path: the file of the dataset, required if source is a dataset (default: None, meaning source)
+        :type path: str or None
+        :param run: index of the run if the dataset is a run of a container file (default: None)
+        :type run: int or None
+        """
+        if run is not None and not isinstance(source, xr.Dataset):
+            records = [describe(read_run(source, run), source if path is None else path, run)]
+        elif isinstance(source, xr.Dataset):
+            records = [describe(source, path, run)]
+        else:
+            _, records, error = _describe_file(source)
+            if error is not None:
+                raise OSError(error)
+        with self._db:
+            if run is None:
+                self._db.execute('DELETE FROM files WHERE path = ?', (records[0]['path'],))
+            for record in records:
+                self._insert(record)
+
+    def _insert(self, record):
+        """Insert a record (replacing the one of the same path and run). The caller commits."""
+        self._db.execute('DELETE FROM files WHERE path = ? AND run IS ?', (record['path'], record['run']))
+        file_id = self._db.execute('INSERT INTO files (path, run, size, mtime, time, sizes) VALUES (?, ?, ?, ?, ?, ?)',
+                                   (record['path'], record['run'], record['size'], record['mtime'], record['time'],
+                                    json.dumps(record['sizes']))).lastrowid
+        self._db.executemany('INSERT INTO attrs (file_id, key, value, number, kind) VALUES (?, ?, ?, ?, ?)',
+                             [(file_id, key, *_attribute_row(value)) for key, value in record['attrs'].items()])
+        self._db.executemany(
+            'INSERT INTO variables (file_id, name, dims, shape, dtype, units, count, mean, std, min, max) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(file_id, v['name'], json.dumps(v['dims']), json.dumps(v['shape']), v['dtype'], v['units'],
+              v.get('count'), v.get('mean'), v.get('std'), v.get('min'), v.get('max')) for v in record['variables']])
+
+    def remove(self, path):
+        """
+        Remove a file (with all its runs) from the catalog (the file itself is not deleted).
+
+        :param path: the file
+        :type path: str
+        """
+        with self._db:
+            self._db.execute('DELETE FROM files WHERE path = ?', (os.path.abspath(path),))
+
+    def scan(self, directory, pattern='*.nc', recursive=True, workers=None, force=False):
+        """
+        Catalog the files in a directory that are new or that changed (size or modification time) since they were
+        cataloged, and remove the files from the catalog that don't exist anymore.
+        The files are read in parallel by worker processes (on Windows, call this under if __name__ == '__main__').
+
+        :param directory: the directory
+        :type directory: str
+        :param pattern: file name pattern (default: '*.nc')
+        :type pattern: str
+        :param recursive: include subdirectories (default: True)
+        :type recursive: bool
+        :param workers: number of worker processes (default: None, meaning the number of processors; 0 means no
+                        workers: read the files in this process)
+        :type workers: int or None
+        :param force: catalog all files again, also if they didn't change (default: False)
+        :type force: bool
+        :return: the number of files that were (re)cataloged
+        :rtype: int
+        """
+        directory = os.path.abspath(directory)
+        pattern = os.path.join(directory, '**', pattern) if recursive else os.path.join(directory, pattern)
+        files = {os.path.abspath(f): os.stat(f) for f in glob.glob(pattern, recursive=recursive) if os.path.isfile(f)}
+        prefix = os.path.join(directory, '')
+        # for containers the size and modification time after the last cataloged run
+        known = {row['path']: (row['size'], row['mtime']) for row in self._db.execute(
+            'SELECT path, size, mtime FROM files WHERE substr(path, 1, ?) = ? ORDER BY mtime', (len(prefix), prefix))}
+        with self._db:
+            for path in set(known) - set(files):
+                self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+        todo = sorted(path for path, stat in files.items()
+                      if force or known.get(path) != (stat.st_size, stat.st_mtime))
+        if not todo:
+            return 0
+        self.logger.info(f'cataloging {len(todo)} files in {directory}')
+        if workers == 0:
+            results = map(_describe_file, todo)
+            executor = None
+        else:
+            executor = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, len(todo) // (4 * (workers or os.cpu_count() or 1)))
+            results = executor.map(_describe_file, todo, chunksize=chunksize)
+        count = 0
+        try:
+            for i, (path, records, error) in enumerate(results):
+                if error is not None:
+                    self.logger.warning(f'could not catalog {path} ({error})')
+                    continue
+                self._db.execute('DELETE FROM files WHERE path = ?', (path,))
+                for record in records:
+                    self._insert(record)
+                count += 1
+                if count % 100 == 0:
+                    self._db.commit()
+                    self.logger.info(f'cataloged {i + 1} of {len(todo)} files')
+        finally:
+            self._db.commit()
+            if executor is not None:
+                executor.shutdown()
+        return count
+
+    def rebuild(self, directory, pattern='*.nc', recursive=True, workers=None):
+        """
+        Catalog all files in a directory again (see scan()).
+
+        :return: the number of files that were cataloged
+        :rtype: int
+        """
+        return self.scan(directory, pattern, recursive, workers, force=True)
+
+    def find(self, since=None, until=None, path=None, variable=None, limit=None, **attrs):
+        """
+        The records of the files (and runs of container files) that match all conditions, in order of measurement
+        time.
+
+        :param since: earliest measurement time (default: None)
+        :type since: datetime or date or str or None
+        :param until: latest measurement time (default: None)
+        :type until: datetime or date or str or None
+        :param path: pattern the path should match, with wildcards * and ? (default: None)
+        :type path: str or None
+        :param variable: name of a variable the dataset should contain (default: None)
+        :type variable: str or None
+        :param limit: maximum number of records (default: None)
+        :type limit: int or None
+        :param attrs: conditions on attributes: a value for equality or a (low, high) tuple for a range (None for no
+                      limit)
+        :return: records (dictionaries) with path, run (None for a normal file), size, mtime, time, sizes and attrs
+        :rtype: list of dict
+        """
+        where, params = [], []
+        if since is not None:
+            where.append('f.time >= ?')
+            params.append(_iso(since))
+        if until is not None:
+            where.append('f.time <= ?')
+            params.append(_iso(until))
+        if path is not None:
+            where.append('f.path GLOB ?')
+            params.append(path)
+        if variable is not None:
+            where.append('f.id IN (SELECT file_id FROM variables WHERE name = ?)')
+            params.append(variable)
+        for key, value in attrs.items():
+            condition = 'key = ?'
+            params.append(key)
+            if isinstance(value, tuple):
+                low, high = value
+                if low is not None:
+                    condition += ' AND number >= ?'
+                    params.append(low)
+                if high is not None:
+                    condition += ' AND number <= ?'
+                    params.append(high)
+            elif isinstance(value, str):
+                condition += ' AND value = ?'
+                params.append(value)
+            else:
+                condition += ' AND number = ?'
+                params.append(value)
+            where.append(f'f.id IN (SELECT file_id FROM attrs WHERE {condition})')
+        sql = 'SELECT f.* FROM files f'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY f.time, f.path, f.run'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        records = {row['id']: {'path': row['path'], 'run': row['run'], 'size': row['size'], 'mtime': row['mtime'],
+                               'time': row['time'], 'sizes': json.loads(row['sizes']), 'attrs': {}}
+                   for row in self._db.execute(sql, params)}
+        sql = sql.replace('SELECT f.*', 'SELECT f.id', 1)
+        for row in self._db.execute(f'SELECT file_id, key, value, number, kind FROM attrs WHERE file_id IN ({sql})',
+                                    params):
+            records[row['file_id']]['attrs'][row['key']] = _attribute_value(row)
+        return list(records.values())
+
+    def variables(self, path, run=None):
+        """
+        The cataloged variables of a file.
+
+        :param path: the file
+        :type path: str
+        :param run: the run of a container file (default: None, for a normal file)
+        :type run: int or None
+        :return: dictionaries with name, dims, shape, dtype, units, count, mean, std, min and max
+        :rtype: list of dict
+        """
+        rows = self._db.execute('SELECT v.* FROM variables v JOIN files f ON v.file_id = f.id '
+                                'WHERE f.path = ? AND f.run IS ?', (os.path.abspath(path), run))
+        return [{key: json.loads(row[key]) if key in ('dims', 'shape') else row[key] for key in row.keys()
+                 if key != 'file_id'} for row in rows]
+
+    def open(self, chunks='auto', **conditions):
+        """
+        Open the datasets that match the conditions (see find()) lazily, one at a time (see
+        labphew.data.reader.open_scan()). Each dataset is closed when the next one is requested (use load() to keep
+        the data in memory). Files that don't exist anymore are skipped. Runs of container files are read (in memory)
+        with labphew.data.container.read_run().
+
+        :param chunks: chunks of the dask arrays (default: 'auto'), see open_scan()
+        :type chunks: str or int or dict or None
+        :param conditions: conditions, see find()
+        :return: generator of (record, dataset) tuples
+        :rtype: generator
+        """
+        for record in self.find(**conditions):
+            if not os.path.isfile(record['path']):
+                self.logger.warning(f"cataloged file doesn't exist anymore: {record['path']}")
+                continue
+            if record['run'] is not None:
+                yield record, read_run(record['path'], record['run'])
+                continue
+            with open_scan(record['path'], chunks=chunks) as dataset:
+                yield record, dataset
+
+
+def main(args=None):
+    """
+    Command line interface: catalog the files in a directory (see Catalog.scan()).
+    """
+    parser = argparse.ArgumentParser(prog='labphew catalog', description='Catalog the saved datasets in a directory.')
+    parser.add_argument('directory')
+    parser.add_argument('--catalog', default=None, help=f'catalog file (default: {default_path})')
+    parser.add_argument('--pattern', default='*.nc', help="file name pattern (default: '*.nc')")
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: all cores)')
+    parser.add_argument('--rebuild', action='store_true', help='catalog all files again, also unchanged ones')
+    args = parser.parse_args(args)
+    with Catalog(args.catalog) as catalog:
+        count = catalog.scan(args.directory, args.pattern, workers=args.workers, force=args.rebuild)
+        print(f'cataloged {count} files, {len(catalog)} files in {catalog.path}')
+
+
+if __name__ == '__main__':
+    import tempfile
+    directory = tempfile.mkdtemp()
+    for i, step in enumerate([0.1, 0.01, 0.005]):
+        voltages = np.arange(0, 1, step)
+        xr.Dataset(coords={'scan_voltage': ('scan_voltage', voltages, {'units': 'V'})},
+                   data_vars={'measured_voltage': ('scan_voltage', voltages ** 2, {'units': 'V'})},
+                   attrs={'time': datetime.now().strftime('%d-%m-%YT%H:%M:%S'), 'user': 'X' if i else 'Y',
+                          'step': step}).to_netcdf(os.path.join(directory, f'scan {i}.nc'))
+
+    with Catalog(os.path.join(directory, 'catalog.sqlite')) as catalog:
+        print(f'cataloged {catalog.scan(directory)} files')
+        for record, dat in catalog.open(user='X', step=(None, 0.01)):
+            print(record['path'], record['attrs']['step'], dat.sizes['scan_voltage'])
+        print(catalog.variables(os.path.join(directory, 'scan 2.nc')))
@@ -0,0 +1,298 @@
+"""
+labphew.data.container
+======================
+
+Container files: many scans (runs) in one netCDF4 file, instead of a small file per scan.
+
+ScanContainer appends datasets (like the ones written by Operator.save_scan()) along a 'run' dimension:
+
+- Every variable (including coordinates) is stored with 'run' as first dimension. The other dimensions are stored as
+  '<dim>_index' (so a dimension of the scan named 'run', like the reservoir of a repeated scan, doesn't clash). All
+  dimensions are unlimited, so runs of different length can be stored: shorter runs are padded with the fill value (which
+  xarray reads as NaN), and the length of each dimension of each run is stored in '<dim>_length' variables.
+- The attributes of each run (time, user, scan parameters, ...) are stored as variables 'attr_<name>' of dimension run.
+  Numbers are stored as float64 (integers are returned as int while all runs have integer values).
+- Variables (and attributes) that a run doesn't have are explicitly filled with the fill value for that run.
+- The variables are chunked per run, so reading one run (container[i]) only reads that run from the file. It returns the
+  dataset as it was appended (trimmed to its own length, with its attributes).
+- attrs() returns the attributes of all runs (e.g. to select runs), and dataset() opens the whole (padded) container
+  lazily.
+
+In the Operators save_scan(filename, append=True) appends to a container (see OperatorBase.write_dataset()).
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import logging
+import os
+import netCDF4
+import numpy as np
+import xarray as xr
+from labphew.data.reader import open_scan
+
+
+class ScanContainer:
+    """
+    A netCDF4 file with many runs of a scan. It can be used in a with block (to close the file).
+    """
+    def __init__(self, filename, mode='a', chunk_size=4096):
+        """
+        :param filename: full path and filename
+        :type filename: str
+        :param mode: 'a' to append (the file is created if it doesn't exist), 'w' to create a new file (overwriting an
+                     existing one), or 'r' to read (default: 'a')
+        :type mode: str
+        :param chunk_size: maximum chunk size along each dimension of the runs (default: 4096)
+        :type chunk_size: int
+        """
+        self.logger = logging.getLogger(__name__)
+        self.filename = filename
+        self.chunk_size = int(chunk_size)
+        if mode == 'a' and not os.path.exists(filename):
+            mode = 'w'
+        self._nc = netCDF4.Dataset(filename, mode, format='NETCDF4')
+        if mode == 'w':
+            self._nc.createDimension('run', None)
+            self._nc.setncattr('labphew_container', 1)
+        elif 'labphew_container' not in self._nc.ncattrs():
+            self._nc.close()
+            raise ValueError(f'{filename} is not a labphew container file')
+
+    def close(self):
+        """Close the file."""
+        self._nc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self):
+        return len(self._nc.dimensions['run'])
+
+    def _variables(self, role):
+        """The netCDF variables with a role attribute ('labphew_length_of' or 'labphew_attribute'), by its value."""
+        return {v.getncattr(role): v for v in self._nc.variables.values() if role in v.ncattrs()}
+
+    def _create(self, name, dtype, dims, sizes, **attrs):
+        """Create a variable (chunked per run) with the fill value as _FillValue (so xarray reads it as missing)."""
+        fill = None if dtype is str else netCDF4.default_fillvals[np.dtype(dtype).str[1:]]
+        chunks = (1,) + tuple(min(max(size, 1), self.chunk_size) for size in sizes) if dtype is not str else None
+        var = self._nc.createVariable(name, dtype, ('run',) + dims, fill_value=fill, chunksizes=chunks)
+        var.setncatts(attrs)
+        return var
+
+    def append(self, data):
+        """
+        Append a dataset as new run.
+        Variables that are not numeric are skipped (with a warning). Variables and attributes of previous runs that the
+        dataset doesn't have are filled with the fill value (missing).
+
+        :param data: the dataset
+        :type data: xarray.Dataset
+        :return: the index of the run
+        :rtype: int
+        """
+        nc = self._nc
+        run = len(self)
+        written = set()  # the netCDF variables written for this run
+        lengths = self._variables('labphew_length_of')
+        for dim, size in data.sizes.items():
+            if dim + '_index' not in nc.dimensions:
+                nc.createDimension(dim + '_index', None)
+            if dim not in lengths:
+                lengths[dim] = self._create(dim + '_length', 'i8', (), (), labphew_length_of=dim)
+            lengths[dim][run] = size
+            written.add(lengths[dim].name)
+        for name, var in data.variables.items():
+            if var.dtype.kind not in 'biuf':
+                self.logger.warning(f'skipping variable {name} of type {var.dtype} (only numbers can be appended)')
+                continue
+            dims = tuple(dim + '_index' for dim in var.dims)
+            if name not in nc.variables:
+                attrs = {key: value for key, value in var.attrs.items() if isinstance(value, (str, int, float))}
+                if name in data.coords:
+                    attrs['labphew_coordinate'] = 1
+                self._create(name, 'i1' if var.dtype.kind == 'b' else var.dtype, dims, var.shape, **attrs)
+            target = nc.variables[name]
+            if target.dimensions[1:] != dims:
+                self.logger.warning(f'skipping variable {name}: dimensions {var.dims} differ from the previous runs')
+                continue
+            target[(run,) + tuple(slice(0, size) for size in var.shape)] = var.values
+            written.add(name)
+        attributes = self._variables('labphew_attribute')
+        for key, value in data.attrs.items():
+            if isinstance(value, np.generic):
+                value = value.item()
+            if key not in attributes:
+                if not isinstance(value, (str, int, float)):
+                    self.logger.warning(f'skipping attribute {key} of type {type(value).__name__}')
+                    continue
+                if isinstance(value, str):
+                    attributes[key] = self._create('attr_' + key, str, (), (), labphew_attribute=key)
+                else:  # all numbers as float64, so a float in a later run isn't truncated
+                    attributes[key] = self._create('attr_' + key, 'f8', (), (), labphew_attribute=key,
+                                                   labphew_integer=int(isinstance(value, int)))
+            target = attributes[key]
+            if target.dtype is str:
+                value = str(value)
+            elif isinstance(value, str):
+                self.logger.warning(f'skipping attribute {key}: {value} is not a number like in the previous runs')
+                continue
+            elif not isinstance(value, int) and target.getncattr('labphew_integer'):
+                target.setncattr('labphew_integer', 0)  # from now on returned as float
+            target[run] = value
+            written.add(target.name)
+        for name, target in nc.variables.items():
+            if name not in written:
+                self._fill(target, run)
+        nc.sync()
+        return run
+
+    def _fill(self, target, run):
+        """Write the fill value (missing) to a variable for a run."""
+        if target.dtype is str:
+            target[run] = ''
+            return
+        shape = tuple(len(self._nc.dimensions[dim]) for dim in target.dimensions[1:])
+        target[(run,) + tuple(slice(0, size) for size in shape)] = np.ma.masked_all(shape, target.dtype)
+
+    def __getitem__(self, index):
+        """
+        Read one run.
+
+        :param index: index of the run (negative values count from the end)
+        :type index: int
+        :return: the run (as it was appended)
+        :rtype: xarray.Dataset
+        """
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError(f'run {index} out of range ({n} runs)')
+        lengths = {}
+        for dim, var in self._variables('labphew_length_of').items():
+            length = var[index]
+            if not np.ma.is_masked(length):
+                lengths[dim] = int(length)
+        coords, data_vars, attrs = {}, {}, {}
+        for name, var in self._nc.variables.items():
+            ncattrs = var.ncattrs()
+            if 'labphew_attribute' in ncattrs:
+                value = var[index]
+                if var.dtype is str:
+                    if value:
+                        attrs[var.getncattr('labphew_attribute')] = value
+                elif not np.ma.is_masked(value):
+                    value = np.ma.getdata(value).item()
+                    if var.getncattr('labphew_integer'):
+                        value = int(value)
+                    attrs[var.getncattr('labphew_attribute')] = value
+                continue
+            if 'labphew_length_of' in ncattrs:
+                continue
+            dims = tuple(dim[:-len('_index')] for dim in var.dimensions[1:])
+            if any(dim not in lengths for dim in dims):
+                continue  # the run doesn't have this dimension
+            values = var[(index,) + tuple(slice(0, lengths[dim]) for dim in dims)]
+            mask = np.ma.getmaskarray(values)
+            if mask.size and mask.all():
+                continue  # the run doesn't have this variable
+            values = np.ma.filled(values.astype(float), np.nan) if mask.any() else np.ma.getdata(values)
+            var_attrs = {key: var.getncattr(key) for key in ncattrs if not key.startswith(('labphew_', '_'))}
+            (coords if 'labphew_coordinate' in ncattrs else data_vars)[name] = (dims, values, var_attrs)
+        return xr.Dataset(data_vars=data_vars, coords=coords, attrs=attrs)
+
+    def attrs(self):
+        """
+        The attributes of all runs (missing values are NaN for numbers and '' for strings).
+
+        :return: a variable for each attribute, of dimension run
+        :rtype: xarray.Dataset
+        """
+        data_vars = {}
+        for key, var in self._variables('labphew_attribute').items():
+            values = var[:]
+            if var.dtype is str:
+                values = np.array(['' if value is None else value for value in values], dtype=str)
+            else:
+                values = np.ma.filled(np.ma.asarray(values).astype(float), np.nan)
+            data_vars[key] = ('run', values)
+        return xr.Dataset(data_vars=data_vars, coords={'run': np.arange(len(self))})
+
+    def dataset(self, chunks='auto'):
+        """
+        Open the whole container lazily (see labphew.data.reader.open_scan()). Shorter runs are padded with NaN. Close it
+        when done.
+
+        :param chunks: chunks of the dask arrays (default: 'auto'), see open_scan()
+        :type chunks: str or int or dict or None
+        :return: the dataset with dimensions run and <dim>_index
+        :rtype: xarray.Dataset
+        """
+        self._nc.sync()
+        return open_scan(self.filename, chunks=chunks)
+
+
+def is_container(filename):
+    """
+    :param filename: full path and filename
+    :type filename: str
+    :return: True if the file is a container file (False if not, or if it can't be read by netCDF4)
+    :rtype: bool
+    """
+    try:
+        with netCDF4.Dataset(filename, 'r') as nc:
+            return 'labphew_container' in nc.ncattrs()
+    except OSError:
+        return False
+
+
+def append_run(filename, data):
+    """
+    Append a dataset as new run to a container file (created if it doesn't exist).
+
+    :param filename: full path and filename
+    :type filename: str
+    :param data: the dataset
+    :type data: xarray.Dataset
+    :return: the index of the run
+    :rtype: int
+    """
+    with ScanContainer(filename) as container:
+        return container.append(data)
+
+
+def read_run(filename, index):
+    """
+    Read one run of a container file.
+
+    :param filename: full path and filename
+    :type filename: str
+    :param index: index of the run (negative values count from the end)
+    :type index: int
+    :return: the run
+    :rtype: xarray.Dataset
+    """
+    with ScanContainer(filename, mode='r') as container:
+        return container[index]
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    filename = os.path.join(tempfile.gettempdir(), 'labphew_container_example.nc')
+    with ScanContainer(filename, mode='w') as container:
+        t0 = time.time()
+        for i in range(1000):
+            voltages = np.arange(0, 5, 0.01)[:500 - i % 100]  # some scans were stopped early
+            container.append(xr.Dataset(
+                coords={'scan_voltage': ('scan_voltage', voltages, {'units': 'V'})},
+                data_vars={'measured_voltage': ('scan_voltage', np.sin(voltages + i), {'units': 'V'})},
+                attrs={'time': f'{i}', 'user': 'X', 'step': 0.01}))
+        print(f'appended {len(container)} runs in {time.time() - t0:.2f}s')
+        t0 = time.time()
+        run = container[537]
+        print(f'read run 537 in {(time.time() - t0) * 1e3:.1f}ms: {run.sizes["scan_voltage"]} points, {run.attrs}')
+        print(container.attrs())
@@ -0,0 +1,164 @@
+"""
+labphew.data.reader
+===================
+
+Lazy reading of saved labphew datasets (the netCDF files written by Operator.save_scan()), for files that don't fit in
+memory (e.g. long monitor recordings).
+
+- open_scan() opens a file without loading the data. If dask is installed the variables are dask arrays (chunked), so
+  computations on them are done chunk by chunk. Otherwise the variables are lazily indexed by xarray: selecting a part
+  (e.g. a coordinate range) and then accessing the values only reads that part from the file.
+  Coordinate ranges can be selected directly, like open_scan(filename, scan_voltage=(0, 1.0)).
+- iter_chunks() yields consecutive blocks of a dataset along one dimension, each loaded in memory, with a bounded size.
+  This allows out-of-core reductions in plain numpy.
+- summary() calculates the count, mean, standard deviation, minimum and maximum of the variables of a dataset chunk by
+  chunk (the chunk results are combined exactly, so the result is the same as for the full data).
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import logging
+import numpy as np
+import xarray as xr
+
+try:
+    import dask
+except ImportError:
+    dask = None
+
+
+def _selection(ranges):
+    """Convert (start, stop) tuples to slices, for Dataset.sel()."""
+    return {name: slice(*value) if isinstance(value, tuple) else value for name, value in ranges.items()}
+
+
+def open_scan(filename, chunks='auto', **ranges):
+    """
+    Open a saved dataset without loading the data into memory.
+    Use it as a context manager (or call close() on the result) to close the file.
+
+    Example:
+    >>> with open_scan('scan.nc', scan_voltage=(0, 1.0)) as dat:
+    >>>     dat.measured_voltage.mean().values
+
+    :param filename: full path and filename
+    :type filename: str
+    :param chunks: chunks of the dask arrays, see xarray.open_dataset (default: 'auto', meaning chunks of about 128MB),
+                   ignored if dask is not installed; None for lazily indexed (not dask) arrays
+    :type chunks: str or int or dict or None
+    :param ranges: coordinates to select, as a value, a slice or a (start, stop) tuple (for a range)
+    :return: the dataset
+    :rtype: xarray.Dataset
+    """
+    if dask is None and chunks is not None:
+        logging.getLogger(__name__).debug('dask is not installed: variables are lazily indexed arrays')
+        chunks = None
+    dataset = xr.open_dataset(filename, chunks=chunks)
+    if ranges:
+        dataset = dataset.sel(_selection(ranges))
+    return dataset
+
+
+def _chunk_length(dataset, dim, max_bytes, variables):
+    """The number of indices along dim for which the variables use at most max_bytes."""
+    bytes_per_index = 0
+    for name in variables:
+        var = dataset[name]
+        if dim in var.dims:
+            bytes_per_index += var.dtype.itemsize * var.size // max(dataset.sizes[dim], 1)
+    return max(int(max_bytes // max(bytes_per_index, 1)), 1)
+
+
+def iter_chunks(source, dim=None, size=None, max_bytes=2**26, variables=None):
+    """
+    Iterate over consecutive blocks of a dataset along one dimension. Each block is loaded in memory (and the file is
+    only read block by block).
+
+    :param source: full path and filename, or an (opened) dataset
+    :type source: str or os.PathLike or xarray.Dataset
+    :param dim: the dimension (default: None, meaning the largest dimension)
+    :type dim: str or None
+    :param size: number of indices along dim per block (default: None, meaning as many as fit in max_bytes)
+    :type size: int or None
+    :param max_bytes: maximum size of a block if size is None (default: 2**26, 64MB)
+    :type max_bytes: int
+    :param variables: names of the variables to load (default: None, meaning all data variables)
+    :type variables: list of str or None
+    :return: generator of (start index, block) tuples
+    :rtype: generator
+    """
+    opened = not isinstance(source, xr.Dataset)
+    dataset = open_scan(source, chunks=None) if opened else source
+    try:
+        if variables is not None:
+            dataset = dataset[list(variables)]
+        if not dataset.sizes:
+            yield 0, dataset.load()
+            return
+        if dim is None:
+            dim = max(dataset.sizes, key=dataset.sizes.get)
+        if size is None:
+            size = _chunk_length(dataset, dim, max_bytes, list(dataset.data_vars))
+        for start in range(0, dataset.sizes[dim], size):
+            yield start, dataset.isel({dim: slice(start, start + size)}).load()
+    finally:
+        if opened:
+            dataset.close()
+
+
+def summary(source, variables=None, dim=None, max_bytes=2**26):
+    """
+    Count, mean, standard deviation, minimum and maximum of the (numeric) variables of a dataset, calculated block by
+    block (see iter_chunks()). NaN's are ignored.
+
+    :param source: full path and filename, or an (opened) dataset
+    :type source: str or os.PathLike or xarray.Dataset
+    :param variables: names of the variables (default: None, meaning all numeric data variables)
+    :type variables: list of str or None
+    :param dim: the dimension to iterate over (default: None, meaning the largest dimension)
+    :type dim: str or None
+    :param max_bytes: maximum size of a block (default: 2**26, 64MB)
+    :type max_bytes: int
+    :return: for each variable a dictionary with count, mean, std, min and max
+    :rtype: dict
+    """
+    stats = {}
+    for _, block in iter_chunks(source, dim=dim, max_bytes=max_bytes, variables=variables):
+        for name, var in block.data_vars.items():
+            if var.dtype.kind not in 'biuf':
+                continue
+            values = np.asarray(var.values, dtype=float).ravel()
+            values = values[np.isfinite(values)]
+            if not len(values):
+                continue
+            n, mean = len(values), values.mean()
+            m2 = ((values - mean) ** 2).sum()
+            if name not in stats:
+                stats[name] = {'count': n, 'mean': mean, 'm2': m2, 'min': values.min(), 'max': values.max()}
+                continue
+            s = stats[name]
+            # combine with the previous blocks (Chan et al.)
+            total = s['count'] + n
+            delta = mean - s['mean']
+            s['m2'] += m2 + delta ** 2 * s['count'] * n / total
+            s['mean'] += delta * n / total
+            s['count'] = total
+            s['min'], s['max'] = min(s['min'], values.min()), max(s['max'], values.max())
+    for s in stats.values():
+        s['std'] = float(np.sqrt(s.pop('m2') / s['count']))
+        s['mean'], s['min'], s['max'] = float(s['mean']), float(s['min']), float(s['max'])
+    return stats
+
+
+if __name__ == '__main__':
+    import os
+    import tempfile
+    filename = os.path.join(tempfile.gettempdir(), 'labphew_reader_example.nc')
+    t = np.arange(10**6) * 1e-3
+    xr.Dataset(coords={'time': ('time', t, {'units': 's'})},
+               data_vars={'voltage': ('time', np.sin(t), {'units': 'V'})}).to_netcdf(filename)
+
+    with open_scan(filename, time=(100, 200)) as dat:
+        print(f'{dat.sizes["time"]} points between 100 and 200 s, mean: {float(dat.voltage.mean()):.4f} V')
+    for start, block in iter_chunks(filename, size=250000):
+        print(f'block at {start}: {block.sizes["time"]} points, max {float(block.voltage.max()):.4f} V')
+    print(summary(filename, max_bytes=2**20))
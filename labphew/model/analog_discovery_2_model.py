@@ -7,7 +7,10 @@ This module contains an example class of an Operator for the Digilent Analog dis
 
 This Operator contains:
 - basic methods to get analog in values, set analog out values
-- a monitor, to provide continuous data for a Monitor gui
+- a monitor, to provide continuous data (and its multi-resolution history) for a Monitor gui
+- a spectrum monitor, to provide continuously updated noise spectra for a Spectrum Monitor gui
+- a scope, to provide triggered frames and persistence histograms for a Scope gui
+- a feedback loop (PID), to stabilize an analog in voltage by controlling an analog out channel
 - an example of a scan that could be run from command line or from a Scan gui
 
 Example usage can be found at the bottom of the file under if __name__=='__main___'
@@ -15,11 +18,18 @@ Example usage can be found at the bottom of the file under if __name__=='__main_
 import os.path
 import numpy as np
 import yaml
-from time import time, sleep, localtime, strftime
+from time import sleep, localtime, strftime
 import logging
 import xarray as xr
 from datetime import datetime
 from labphew.core.base.operator_base import OperatorBase
+from labphew.core.tools.clock import wall_clock
+from labphew.core.tools.statistics import RunningStatistics, PersistenceHistogram
+from labphew.core.tools.adaptive import AdaptiveSampler
+from labphew.core.tools.signal_processing import WelchPSD
+from labphew.core.tools.feedback import PID, FeedbackLoop
+from labphew.core.tools.buffers import TieredHistory
+from labphew.core.tools.device_registry import DeviceHandle
 import labphew
 
 
@@ -27,7 +37,7 @@ class Operator(OperatorBase):
     """
     Example Operator class for Digilent Analog Discovery 2.
     """
-    def __init__(self, instrument, properties={}):
+    def __init__(self, instrument, properties={}, clock=None):
         """
         Create the Operator object for the Digilent Analog Discovery 2.
         The DigilentWaveForms controller object for the instrument needs to be created before and passed as an argument.
@@ -36,21 +46,39 @@ class Operator(OperatorBase):
         :type instrument: DigilentWaveForms controller object
         :param properties: optional properties dictionary, note that this can be loaded from file with load_config()
         :type properties: dict
+        :param clock: clock for timing loops (default: None, meaning the clock of the instrument or the wall clock)
+        :type clock: WallClock or None
         """
         self.logger = logging.getLogger(__name__)
         self.properties = properties
         self.instrument = instrument
+        self.clock = clock or getattr(instrument, 'clock', None) or wall_clock
 
         # Flags controlled by operator:
         self._busy = False  # indicates the operator is busy (e.g. with scan or monitor)
         self._new_scan_data = False  # signal there's new data that could be displayed (a gui would reset this to False after retrieving the data)
         self._new_monitor_data = False  # used to flag gui that new data is available
+        self._new_spectrum_data = False  # used to flag the spectrum gui that a new spectrum is available
+        self._new_scope_data = False  # used to flag the scope gui that a new frame is available
 
         # Flags controlled by external gui to control flow of loops (e.g. scan or monitor)
         self._stop = False  # signal a loop to stop (whenever operator is not busy it should be False)
         self._pause = False  # signal a loop to pause (whenever operator is not busy it should be False)
         self._allow_monitor = False  # monitor should not be run from command line, a gui can set this to True
 
+        self.scan_statistics = None  # running statistics of a repeated scan, see do_scan()
+        self.scan_run = 0  # the current run of a repeated scan
+        self.scan_order = []  # order of measurement of an adaptive scan
+        self.spectrum = None  # WelchPSD object of the spectrum monitor, see _spectrum_loop()
+        self.spectrum_updates = 0
+        self.feedback = None  # FeedbackLoop, see start_feedback()
+        self._previous_profile = None  # the acquisition profile to restore when the feedback loop stops
+        self.scope_frame = None  # the last frame of the scope, see _scope_loop()
+        self.scope_time = None
+        self.persistence = []  # PersistenceHistogram of each analog in channel
+        self.scope_captures = 0
+
+        self.monitor_history = None  # TieredHistory of the monitor, see _monitor_loop()
         self._monitor_start_time = 0
         self.monitor_plot_points = 100
         # Create direct alias for this method of the instrument:
@@ -195,41 +223,212 @@ class Operator(OperatorBase):
             return
         try:
             # Preparations before running the monitor
-            self.analog_monitor_1 = np.zeros(self.properties['monitor']['plot_points'])
-            self.analog_monitor_2 = np.zeros(self.properties['monitor']['plot_points'])
-            # self.analog_monitor_time = np.zeros(self.properties['monitor']['plot_points'])
-            self.analog_monitor_time = np.arange(1-self.properties['monitor']['plot_points'], 1)*self.properties['monitor']['time_step']
+            plot_points = int(self.properties['monitor']['plot_points'])
+            if self.monitor_history is not None:
+                self.monitor_history.close()
+            self.monitor_history = TieredHistory(2, self.properties['monitor'].get('history_capacity', 100000),
+                                                 spill=self.properties['monitor'].get('history_spill', None))
         except:
-            self.logger.error("'plot_points' or 'time_step' missing or invalid in config")
+            self.logger.error("'plot_points' or history settings missing or invalid in config")
             return
         self._busy = True  # set flag to indicate operator is busy
-        self._monitor_start_time = time()
+        self._monitor_start_time = self.clock.time()
         next_time = 0
         while not self._stop:
-            timestamp = time() - self._monitor_start_time
+            timestamp = self.clock.time() - self._monitor_start_time
             analog_in = self.instrument.read_analog()  # read the two analog in channels
-            # To keep the length constant, roll/shift the buffers and add the new datapoints
-            self.analog_monitor_1 = np.roll(self.analog_monitor_1, -1)
-            self.analog_monitor_2 = np.roll(self.analog_monitor_2, -1)
-            self.analog_monitor_time = np.roll(self.analog_monitor_time, -1)
-            self.analog_monitor_1[-1] = analog_in[0]
-            self.analog_monitor_2[-1] = analog_in[1]
-            self.analog_monitor_time[-1] = timestamp
+            # Add the new datapoints to the history, the last plot_points are available for plotting the live data
+            self.monitor_history.append(timestamp, analog_in[:2])
+            self.analog_monitor_time, values = self.monitor_history.last(plot_points)
+            self.analog_monitor_1, self.analog_monitor_2 = values.T
             self._new_monitor_data = True
             # in stead of sleep, calculate when the next datapoint should be acquired and wait until that time arrives
             # this allows to keep the timing correct
             next_time += self.properties['monitor']['time_step']
-            while time()-self._monitor_start_time<next_time:
-                if self._stop: break  # check for stop flag while waiting to move to next point
+            # check for stop flag while waiting to move to next point
+            self.clock.wait_until(self._monitor_start_time + next_time, interrupt=lambda: self._stop)
         self._stop = False  # reset stop flag to false
         self._busy = False  # indicate the operator is not busy anymore
 
+    def _spectrum_loop(self):
+        """
+        Called by GUI SpectrumMonitorWindow to start the spectrum monitor loop.
+        Not intended to be called from Operator. (Which should be blocked)
+        It continuously acquires blocks of both analog in channels (using the settings in the 'spectrum' section of the
+        config) and updates Welch-averaged power spectral densities (in self.spectrum, see
+        labphew.core.tools.signal_processing.WelchPSD).
+        """
+        # First check if monitor is allowed to start
+        if self._busy or not self._allow_monitor:
+            self.logger.warning('Monitor should only be run from GUI and not while Operator is busy')
+            return
+        try:
+            spectrum_properties = self.properties['spectrum']
+            frequency = spectrum_properties['frequency']
+            self.instrument.register_profile('spectrum', n=spectrum_properties['block_size'], freq=frequency,
+                                             range=spectrum_properties.get('range', 50.0))
+            self.spectrum = WelchPSD(spectrum_properties['segment_length'], frequency,
+                                     window=spectrum_properties.get('window', 'hann'),
+                                     averages=spectrum_properties.get('averages', 10), channels=2)
+        except:
+            self.logger.error("'spectrum' section missing or invalid in config")
+            return
+        self._busy = True  # set flag to indicate operator is busy
+        previous_profile = self.instrument.active_profile or 'basic'
+        self.instrument.apply_profile('spectrum')
+        self.spectrum_updates = 0
+        while not self._stop:
+            block = self.instrument.read_analog_block()
+            if block is None:
+                continue
+            self.spectrum.update(block)
+            self.spectrum_updates += 1
+            self._new_spectrum_data = True
+        self.instrument.apply_profile(previous_profile)  # note that this doesn't disturb analog out
+        self._stop = False  # reset stop flag to false
+        self._busy = False  # indicate the operator is not busy anymore
+
+    def _scope_loop(self):
+        """
+        Called by GUI ScopeWindow to start the scope loop.
+        Not intended to be called from Operator. (Which should be blocked)
+        It continuously captures triggered frames of both analog in channels (using the settings in the 'scope' section
+        of the config, see DfwController.configure_trigger()). The last frame is kept in self.scope_frame (with the
+        times relative to the trigger in self.scope_time), and all frames are accumulated in a PersistenceHistogram per
+        channel (self.persistence).
+        """
+        # First check if monitor is allowed to start
+        if self._busy or not self._allow_monitor:
+            self.logger.warning('Monitor should only be run from GUI and not while Operator is busy')
+            return
+        try:
+            scope = self.properties['scope']
+            n, frequency = scope['frame_size'], scope['frequency']
+            scope_range = scope.get('range', 50.0)
+            self.instrument.register_profile('scope', n=n, freq=frequency, range=scope_range)
+            trigger = dict(source=scope['trigger_source'], channel=scope['trigger_channel'] - 1,
+                           level=scope['trigger_level'], edge=scope.get('trigger_edge', 'rising'),
+                           position=scope.get('trigger_position', 0.5), hysteresis=scope.get('hysteresis', 0.01),
+                           auto_timeout=scope.get('auto_timeout', 0.0))
+            self.persistence = [PersistenceHistogram(n, scope.get('persistence_bins', 256),
+                                                     (-scope_range / 2, scope_range / 2),
+                                                     scope.get('persistence_decay', None)) for ch in range(2)]
+        except:
+            self.logger.error("'scope' section missing or invalid in config")
+            return
+        self._busy = True  # set flag to indicate operator is busy
+        previous_profile = self.instrument.active_profile or 'basic'
+        self.instrument.apply_profile('scope')
+        if not self.instrument.configure_trigger(**trigger):
+            self.instrument.apply_profile(previous_profile)
+            self._busy = False
+            return
+        self.scope_time = (np.arange(n) - round(trigger['position'] * n)) / frequency
+        self.scope_frame = np.zeros((2, n))
+        self.scope_captures = 0
+        while not self._stop:
+            frame = self.instrument.capture_frame(timeout=scope.get('stop_timeout', 1) / 2)
+            if frame is None:
+                continue
+            for ch in range(2):
+                self.persistence[ch].add(frame[ch])
+            self.scope_frame[:] = frame
+            self.scope_captures += 1
+            self._new_scope_data = True
+        self.instrument.disable_trigger()
+        self.instrument.apply_profile(previous_profile)
+        self._stop = False  # reset stop flag to false
+        self._busy = False  # indicate the operator is not busy anymore
+
+    def start_feedback(self, param=None):
+        """
+        Start a feedback loop (based on the 'pid' parameters in the config file) that keeps the voltage on an analog in
+        channel at the setpoint by controlling an analog out channel. The output is limited to the limits of the analog
+        out channel in properties['ao'].
+        The loop runs on a separate (high priority) thread at a fixed period. While it runs the Operator is busy.
+        The setpoint can be changed while running, with self.feedback.pid.setpoint.
+        The log of the loop (setpoint, error, output, ...) is in self.feedback.history() and the timing statistics in
+        self.feedback.statistics() (see labphew.core.tools.feedback.FeedbackLoop).
+
+        :param param: optional dictionary of parameters that will used to update the pid parameters
+        :type param: dict
+        :return: the FeedbackLoop
+        :rtype: FeedbackLoop
+        """
+        if self._busy:
+            self.logger.error('Feedback should not be started while Operator is busy.')
+            return
+        if 'pid' not in self.properties:
+            self.logger.error("The config file or properties dict should contain 'pid' section.")
+            return
+        if type(param) is dict:
+            self.logger.info('Updating pid properties with supplied parameters dictionary.')
+            self.properties['pid'].update(param)
+        pid_properties = self.properties['pid']
+        try:
+            ch_ao = int(pid_properties['ao_channel'])
+            ch_ai = int(pid_properties['ai_channel'])
+            limits = (self.properties['ao'][ch_ao]['lower_limit'], self.properties['ao'][ch_ao]['upper_limit'])
+            pid = PID(pid_properties['kp'], pid_properties.get('ki', 0), pid_properties.get('kd', 0),
+                      setpoint=pid_properties['setpoint'], output_limits=limits)
+            self.instrument.register_profile('pid', n=pid_properties['samples'], freq=pid_properties['frequency'],
+                                             range=pid_properties.get('range', 50.0))
+            period = pid_properties['period']
+        except:
+            self.logger.error("Error occurred while reading pid config values")
+            return
+        if ch_ai not in [1,2] or ch_ao not in [1,2]:
+            self.logger.error("AI and AO channel need to be 1 or 2")
+            return
+
+        def read():
+            return self.instrument.read_analog()[ch_ai - 1]
+
+        def write(value):
+            self.instrument.write_analog(value, ch_ao - 1)
+
+        self._busy = True  # indicate that operator is busy
+        self._previous_profile = self.instrument.active_profile or 'basic'
+        self.instrument.apply_profile('pid')
+        pid.reset(pid_properties.get('initial_output', 0.0))
+        self.feedback = FeedbackLoop(read, write, pid, period, clock=self.clock,
+                                     history=pid_properties.get('history', 10000),
+                                     high_priority=pid_properties.get('high_priority', True))
+        self.feedback.start()
+        return self.feedback
+
+    def stop_feedback(self):
+        """
+        Stop the feedback loop started with start_feedback(). The analog out channel keeps its last value.
+
+        :return: the timing statistics of the loop, see FeedbackLoop.statistics()
+        :rtype: dict
+        """
+        if self.feedback is None or self._previous_profile is None:
+            self.logger.warning('feedback loop is not running')
+            return
+        if not self.feedback.running:
+            self.logger.warning('feedback loop had stopped already (e.g. because of an error)')
+        stats = self.feedback.stop()
+        self.instrument.apply_profile(self._previous_profile)
+        self._previous_profile = None
+        self._busy = False
+        self.logger.info(f"feedback loop stopped: {stats['rate']:.0f} Hz, latency median "
+                         f"{stats['latency_median'] * 1e3:.2f}ms, p99 {stats['latency_p99'] * 1e3:.2f}ms, "
+                         f"{stats['missed_deadlines']} missed deadlines")
+        return stats
+
     def do_scan(self, param=None):
         """
         An example of a method that performs a scan (based on parameters in the config file).
         This method can be run from a GUI, from command line or other script
         This scan sweeps the voltage on one of the AO channels and reads one of the AI channels.
 
+        If 'repeats' in the scan parameters is larger than 1, the scan is repeated and the per-point statistics are kept
+        in self.scan_statistics (a RunningStatistics object, which optionally keeps 'reservoir_size' raw runs).
+        In that case the mean values are returned.
+        If 'adaptive' is True in the scan parameters, an adaptive scan is done instead (see _do_adaptive_scan()).
+
         :param param: optional dictionary of parameters that will used to update the scan parameters
         :type param: dict
         :return: the AO voltage, and the measured AI voltages
@@ -267,25 +466,98 @@ class Operator(OperatorBase):
         else:
             self.logger.info("stabilize_time not found in config, using 0s")
             stabilize = 0
-        num_points = np.int(round( (stop-start)/step+1 ))  # use round to catch the occasional rounding error
+        num_points = int(round( (stop-start)/step+1 ))  # use round to catch the occasional rounding error
         if num_points <= 0:
             self.logger.error("Start, stop and step result in 0 or fewer points to sweep")
             return
 
-        self.voltages_to_scan = np.linspace(start, stop, num_points)
+        if scan_properties.get('adaptive', False):
+            return self._do_adaptive_scan(start, stop, step, ch_ao, ch_ai, stabilize, num_points)
 
-        self.scan_voltages = []
-        self.measured_voltages = []
+        # Optionally repeat the scan and keep running statistics per point (the memory use doesn't grow with repeats)
+        repeats = int(scan_properties.get('repeats', 1))
+        if repeats > 1:
+            self.scan_statistics = RunningStatistics(num_points, scan_properties.get('reservoir_size', 0))
+        else:
+            self.scan_statistics = None
+
+        self.voltages_to_scan = np.linspace(start, stop, num_points)
 
         self._busy = True  # indicate that operator is busy
 
-        for i, voltage in enumerate(self.voltages_to_scan):
+        for self.scan_run in range(repeats):
+            self.scan_voltages = []
+            self.measured_voltages = []
+            for i, voltage in enumerate(self.voltages_to_scan):
+                self.logger.debug('applying {} to ch {}'.format(voltage, ch_ao))
+                self.analog_out(ch_ao, voltage)
+                self.clock.sleep(stabilize)
+                measured = self.analog_in()[ch_ai - 1]
+                self.measured_voltages.append(measured)
+                self.scan_voltages.append(voltage)
+                if self.scan_statistics is not None:
+                    self.scan_statistics.add(i, measured)
+
+                # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
+                self._new_scan_data = True
+                # before the end of the loop: halt if pause is True
+                while self._pause:
+                    sleep(0.05)
+                    if self._stop: break
+                # if (soft) stop was requested, break out of loop
+                if self._stop:
+                    break
+            if self._stop:
+                break
+            if self.scan_statistics is not None:
+                self.scan_statistics.end_run()
+
+        if self.scan_statistics is not None:
+            # return the mean of all points that were measured
+            measured = self.scan_statistics.count > 0
+            self.scan_voltages = list(self.voltages_to_scan[measured])
+            self.measured_voltages = list(self.scan_statistics.mean[measured])
+
+        self._stop = False  # reset stop flag to false
+        self._busy = False  # indicate operator is not busy anymore
+        self._pause = False  # is this necessary?
+
+        return self.scan_voltages, self.measured_voltages
+
+    def _do_adaptive_scan(self, start, stop, step, ch_ao, ch_ai, stabilize, num_points):
+        """
+        Adaptive version of the scan, called by do_scan() if 'adaptive' is True in the scan parameters.
+        It starts with a coarse scan and then refines where the measured voltage changes or curves most (see
+        labphew.core.tools.adaptive), until it's resolved within 'tolerance' (relative to the range of the measured
+        voltage, default 0.02). The finest steps are between step/2 and step. The scan also ends when 'max_points' (default: the
+        number of points of the uniform scan) or 'max_time' (s, default: None) is reached.
+        The scan voltages are kept sorted (and self.scan_order holds the order of measurement).
+
+        :return: the AO voltage, and the measured AI voltages
+        :rtype: list, list
+        """
+        scan_properties = self.properties['scan']
+        if scan_properties.get('repeats', 1) > 1:
+            self.logger.warning('repeats is ignored for an adaptive scan')
+        max_points = int(scan_properties.get('max_points', num_points))
+        max_time = scan_properties.get('max_time', None)
+        start = self.analog_out(ch_ao, start, verify_only=True)  # clip to the limits of the channel
+        stop = self.analog_out(ch_ao, stop, verify_only=True)
+        sampler = AdaptiveSampler(start, stop, tolerance=scan_properties.get('tolerance', 0.02),
+                                  initial_points=min(11, num_points), min_step=step / 2)  # so the finest steps are <= step
+        self.scan_statistics = None
+        self.scan_voltages = sampler.x  # these lists are kept sorted by the sampler
+        self.measured_voltages = sampler.y
+        self.scan_order = sampler.order
+
+        self._busy = True  # indicate that operator is busy
+        start_time = self.clock.time()
+        voltage = sampler.ask()
+        while voltage is not None and len(sampler.x) < max_points:
             self.logger.debug('applying {} to ch {}'.format(voltage, ch_ao))
             self.analog_out(ch_ao, voltage)
-            sleep(stabilize)
-            measured = self.analog_in()[ch_ai - 1]
-            self.measured_voltages.append(measured)
-            self.scan_voltages.append(voltage)
+            self.clock.sleep(stabilize)
+            sampler.tell(voltage, self.analog_in()[ch_ai - 1])
 
             # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
             self._new_scan_data = True
@@ -296,6 +568,10 @@ class Operator(OperatorBase):
             # if (soft) stop was requested, break out of loop
             if self._stop:
                 break
+            if max_time is not None and self.clock.time() - start_time > max_time:
+                self.logger.info('time budget of adaptive scan is used up')
+                break
+            voltage = sampler.ask()
 
         self._stop = False  # reset stop flag to false
         self._busy = False  # indicate operator is not busy anymore
@@ -303,7 +579,7 @@ class Operator(OperatorBase):
 
         return self.scan_voltages, self.measured_voltages
 
-    def save_scan(self, filename, metadata=None, store_conf=False):
+    def save_scan(self, filename, metadata=None, store_conf=False, append=False):
         """
         Store data in xarray Dataset and save to netCDF4 file.
         Optional metadata can be passed as a dict. Note that the keys should be strings and the values should be numbers or strings.
@@ -319,12 +595,14 @@ class Operator(OperatorBase):
         :type metadata: dict
         :param store_conf: store Operator properties in yaml file (default: False)
         :type store_conf: bool
+        :param append: append the scan as new run to a container file (see labphew.data.container) (default: False)
+        :type append: bool
         """
         # First test if the required data arrays have been generated (i.e. if the scan has run)
         if not all(hasattr(self, var) for var in ['scan_voltages', 'measured_voltages']):
             self.logger.warning('no data to save yet')
             return
-        if os.path.exists(filename):
+        if os.path.exists(filename) and not append:
             self.logger.warning('overwriting existing file: {}'.format(filename))
         self.logger.debug('Saving data')
         data = xr.Dataset(
@@ -338,18 +616,30 @@ class Operator(OperatorBase):
                 "time": datetime.now().strftime('%d-%m-%YT%H:%M:%S'),
             }
         )
+        if self.properties['scan'].get('adaptive', False) and len(self.scan_order) == len(self.scan_voltages):
+            data['scan_order'] = (["scan_voltage"], self.scan_order)  # order of measurement of the irregular coordinate
+        if self.scan_statistics is not None:
+            # store the statistics of a repeated scan (measured_voltage is the mean)
+            stats = self.scan_statistics
+            measured = stats.count > 0
+            data['measured_voltage_std'] = (["scan_voltage"], stats.std[measured], {"units": 'V'})
+            data['measured_voltage_min'] = (["scan_voltage"], stats.min[measured], {"units": 'V'})
+            data['measured_voltage_max'] = (["scan_voltage"], stats.max[measured], {"units": 'V'})
+            data['count'] = (["scan_voltage"], stats.count[measured])
+            if stats.reservoir_size:
+                data['reservoir'] = (["run", "scan_voltage"], stats.reservoir_runs[:, measured], {"units": 'V'})
+            data.attrs['runs'] = stats.runs
         for key in ['user', 'config_file']:
             if key in self.properties:
                 data.attrs[key] = self.properties[key]
         # Add all numeric and string keys
         for key, value in self.properties['scan'].items():
             if isinstance(value, (int, float, bool, str)):
-                data.attrs[key] = value
+                data.attrs[key] = int(value) if isinstance(value, bool) else value  # netCDF can't store booleans
         if type(metadata) is dict:
             data.attrs.update(metadata)  # add the optional metadata to the Dataset attributes
         self.data = data
-        data.to_netcdf(filename)
-        self.logger.info('Data saved in {}'.format(filename))
+        self.write_dataset(filename, data, append)
 
         if store_conf:
             try:
@@ -365,9 +655,14 @@ class Operator(OperatorBase):
         Close connection to all instruments/devices used by this operator.
         (Note that this method will get called when exiting a python with block)
         """
-        # This method is included because it is recommended (this method gets called when closing the gui), but the
-        # WaveForms controller does not have a disconnect, hence this method does nothing.
+        # This method is included because it is recommended (this method gets called when closing the gui). The
+        # WaveForms controller does not have a disconnect, but a shared device (see open_device()) is released (and
+        # closed when no other operator uses it). The spill files of the history are closed as well.
+        if self.monitor_history is not None:
+            self.monitor_history.close()
         self.logger.info('Disconnecting from device(s)')
+        if isinstance(self.instrument, DeviceHandle):
+            self.instrument.release()
 
     def load_config(self, filename=None):
         """
@@ -391,15 +686,14 @@ if __name__ == "__main__":
     import labphew   # import this to use labphew style logging (by importing it before matplotlib it also prevents matplotlib from printing many debugs)
     import matplotlib.pyplot as plt
 
-    # from labphew.controller.digilent.waveforms import DfwController
-
-    # To import the actual device:
-    # from labphew.controller.digilent.waveforms import DfwController
+    from labphew.controller.digilent.waveforms import open_device
 
-    # To import a simulated device:
-    from labphew.controller.digilent.waveforms import SimulatedDfwController as DfwController
+    # open_device() returns a handle to a device that is shared with other operators/windows (in this process)
+    # To use the actual device:
+    # instrument = open_device()
 
-    instrument = DfwController()
+    # To use a simulated device:
+    instrument = open_device(simulated=True)
 
     opr = Operator(instrument)
     opr.load_config()
@@ -12,11 +12,12 @@ Example usage can be found at the bottom of the file under if __name__=='__main_
 """
 import os.path
 import yaml
-from time import time, sleep, localtime, strftime
+from time import sleep, localtime, strftime
 import datetime
 import logging
 import xarray as xr
 from labphew.core.base.operator_base import OperatorBase
+from labphew.core.tools.clock import wall_clock
 import labphew
 
 
@@ -24,7 +25,7 @@ class BlinkOperator(OperatorBase):
     """
     Example Operator class (to work with fake device)
     """
-    def __init__(self, instrument, properties={}):
+    def __init__(self, instrument, properties={}, clock=None):
         """
         Create the Operator object
         The BlinkController object needs to be created before and passed as an argument.
@@ -33,10 +34,13 @@ class BlinkOperator(OperatorBase):
         :type instrument: BlinkController object
         :param properties: optional properties dictionary, note that this can be loaded from file with load_config()
         :type properties: dict
+        :param clock: clock for timing loops (default: None, meaning the clock of the instrument or the wall clock)
+        :type clock: WallClock or None
         """
         self.logger = logging.getLogger(__name__)
         self.properties = properties
         self.instrument = instrument
+        self.clock = clock or getattr(instrument, 'clock', None) or wall_clock
 
         # Flags controlled by operator:
         self._busy = False  # indicates the operator is busy (e.g. with scan or monitor)
@@ -60,10 +64,10 @@ class BlinkOperator(OperatorBase):
             self.logger.warning('Monitor should only be run from GUI and not while Operator is busy')
             return
         self._busy = True  # set flag to indicate operator is busy
-        self._monitor_start_time = time()
+        self._monitor_start_time = self.clock.time()
         next_time = 0
         while not self._stop:
-            timestamp = time() - self._monitor_start_time
+            timestamp = self.clock.time() - self._monitor_start_time
             time_str = str(datetime.timedelta(seconds=timestamp))[:-3] + ' blink!'   # (strip the last 3 digits)
             status = self.instrument.get_status()
             self._monitor_data = (time_str, status)
@@ -72,8 +76,8 @@ class BlinkOperator(OperatorBase):
             # Instead of sleep(), calculate when the next datapoint should be acquired and wait until that time arrives
             # this allows to keep the timing correct in case of slow data acquisition
             next_time += self.properties['monitor']['time_step']
-            while time()-self._monitor_start_time < next_time:
-                if self._stop: break  # check for stop flag while waiting to move to next point
+            # check for stop flag while waiting to move to next point
+            self.clock.wait_until(self._monitor_start_time + next_time, interrupt=lambda: self._stop)
         # Mandatory code at the end of _monitor_loop():
         self._stop = False  # reset stop flag to false
         self._busy = False  # indicate the operator is not busy anymore
@@ -146,7 +150,7 @@ class BlinkOperator(OperatorBase):
             self.point_number.append(i)
             state = int(self.instrument.get_status())  # get the state and convert True/False to 1/0
             self.measured_state.append(state)
-            sleep(time_between_points)
+            self.clock.sleep(time_between_points)
 
             # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
             self._new_scan_data = True
@@ -164,7 +168,7 @@ class BlinkOperator(OperatorBase):
 
         return self.point_number, self.measured_state
 
-    def save_scan(self, filename, metadata=None, store_conf=False):
+    def save_scan(self, filename, metadata=None, store_conf=False, append=False):
         """
         Store data in xarray Dataset and save to netCDF4 file.
         Optional metadata can be passed as a dict. Note that the keys should be strings and the values should be numbers or strings.
@@ -180,12 +184,14 @@ class BlinkOperator(OperatorBase):
         :type metadata: dict
         :param store_conf: store Operator properties in yaml file (default: False)
         :type store_conf: bool
+        :param append: append the scan as new run to a container file (see labphew.data.container) (default: False)
+        :type append: bool
         """
         # First test if the required data arrays have been generated (i.e. if the scan has run)
         if not hasattr(self, "point_number") or not hasattr(self, "measured_state"):
             self.logger.warning('no data to save yet')
             return
-        if os.path.exists(filename):
+        if os.path.exists(filename) and not append:
             self.logger.warning('overwriting existing file: {}'.format(filename))
         self.logger.debug('Saving data')
         data = xr.Dataset(
@@ -205,12 +211,11 @@ class BlinkOperator(OperatorBase):
         # Add all numeric and string keys in scan
         for key, value in self.properties['scan'].items():
             if isinstance(value, (int, float, bool, str)):
-                data.attrs[key] = value
+                data.attrs[key] = int(value) if isinstance(value, bool) else value  # netCDF can't store booleans
         if type(metadata) is dict:
             data.attrs.update(metadata)  # add the optional metadata to the Dataset attributes
         self.data = data
-        data.to_netcdf(filename)
-        self.logger.info('Data saved in {}'.format(filename))
+        self.write_dataset(filename, data, append)
 
         if store_conf:
             try:
@@ -0,0 +1,458 @@
+# coding=utf-8
+"""
+Lock-in
+=======
+
+This module contains an Operator that uses a Digilent Analog Discovery 2 as a (software) lock-in amplifier.
+
+One analog out channel drives the device under test with a sine. Both analog in channels are acquired in blocks and
+demodulated at the frequency of the sine (see labphew.core.tools.signal_processing.LockInDemodulator), giving the
+in-phase (X) and quadrature (Y) component, amplitude (R) and phase (theta) of the signal at a configurable output rate.
+
+The AD2 acquires blocks with gaps in between, so the phase of the internal reference drifts with respect to the analog
+out from block to block. Therefore the second analog in channel (reference_channel) should measure the analog out:
+the phase of the signal is then taken relative to that channel, which is independent of the gaps. The reference
+channel also gives the gain of the device (R of the signal / R of the reference).
+
+This Operator contains:
+- methods to start and stop the reference sine and to measure X, Y, R and theta for some time
+- a monitor, to provide continuous X, Y, R, theta time series for a gui
+- a frequency sweep (Bode plot) that could be run from command line or from a Scan gui
+- verify_simulated(), which compares a frequency sweep with the device under test of a simulated device
+
+Example usage can be found at the bottom of the file under if __name__=='__main___'
+"""
+import os.path
+import numpy as np
+import yaml
+from time import sleep
+import logging
+import xarray as xr
+from datetime import datetime
+from labphew.core.base.operator_base import OperatorBase
+from labphew.core.tools.clock import wall_clock
+from labphew.core.tools.signal_processing import LockInDemodulator
+from labphew.core.tools.device_registry import DeviceHandle
+import labphew
+
+
+class LockInOperator(OperatorBase):
+    """
+    Lock-in amplifier Operator for Digilent Analog Discovery 2.
+    """
+    def __init__(self, instrument, properties={}, clock=None):
+        """
+        Create the lock-in Operator object for the Digilent Analog Discovery 2.
+        The DigilentWaveForms controller object for the instrument needs to be created before and passed as an argument.
+
+        :param instrument: The instrument used by this Operator
+        :type instrument: DigilentWaveForms controller object
+        :param properties: optional properties dictionary, note that this can be loaded from file with load_config()
+        :type properties: dict
+        :param clock: clock for timing loops (default: None, meaning the clock of the instrument or the wall clock)
+        :type clock: WallClock or None
+        """
+        self.logger = logging.getLogger(__name__)
+        self.properties = properties
+        self.instrument = instrument
+        self.clock = clock or getattr(instrument, 'clock', None) or wall_clock
+
+        # Flags controlled by operator:
+        self._busy = False  # indicates the operator is busy (e.g. with scan or monitor)
+        self._new_scan_data = False  # signal there's new data that could be displayed
+        self._new_monitor_data = False  # used to flag gui that new data is available
+
+        # Flags controlled by external gui to control flow of loops (e.g. scan or monitor)
+        self._stop = False  # signal a loop to stop (whenever operator is not busy it should be False)
+        self._pause = False  # signal a loop to pause (whenever operator is not busy it should be False)
+        self._allow_monitor = False  # monitor should not be run from command line, a gui can set this to True
+
+        self.demodulator = None  # LockInDemodulator, created by start_reference()
+        self.reference_amplitude = np.nan  # last R of the reference channel (V rms)
+        self._previous_profile = None
+
+    def _channels(self):
+        """
+        Checks the channels in the properties and returns the analog out channel and the analog in channels
+        (signal, reference) as indices (0 or 1). The reference is None if the internal reference is used.
+        Note that None is returned if an error is found.
+
+        :return: analog out channel, analog in channels
+        :rtype: (int, list)
+        """
+        if 'lock_in' not in self.properties:
+            self.logger.error("'lock_in' not found in properties")
+            return
+        lock_in = self.properties['lock_in']
+        ao, signal, reference = lock_in.get('ao_channel'), lock_in.get('signal_channel'), lock_in.get('reference_channel')
+        if ao not in [1, 2] or signal not in [1, 2] or reference not in [1, 2, None] or signal == reference:
+            self.logger.error("'ao_channel' and 'signal_channel' should be 1 or 2, 'reference_channel' should be the "
+                              "other analog in channel or None")
+            return
+        return ao - 1, [signal - 1] if reference is None else [signal - 1, reference - 1]
+
+    def start_reference(self, frequency=None, amplitude=None):
+        """
+        Start (or change) the reference sine on the analog out channel and prepare the demodulator.
+        Only the analog out settings that changed are sent to the device. The analog in is switched to the 'lock_in'
+        profile (the previous profile is restored by stop_reference()).
+
+        :param frequency: reference frequency (Hz) (default: the value in properties)
+        :type frequency: float or None
+        :param amplitude: amplitude of the sine (V) (default: the value in properties)
+        :type amplitude: float or None
+        :return: True if successful
+        :rtype: bool
+        """
+        channels = self._channels()
+        if channels is None:
+            return
+        ao_channel, ai_channels = channels
+        lock_in = self.properties['lock_in']
+        if frequency is not None:
+            lock_in['frequency'] = frequency
+        if amplitude is not None:
+            lock_in['amplitude'] = amplitude
+        try:
+            sample_rate = lock_in['sample_rate']
+            if lock_in['frequency'] >= sample_rate / 2:
+                self.logger.error('the reference frequency should be below half the sample rate')
+                return
+            self.instrument.register_profile('lock_in', n=lock_in['block_size'], freq=sample_rate,
+                                             range=lock_in.get('range', 50.0))
+            self.demodulator = LockInDemodulator(sample_rate, lock_in['frequency'], lock_in['time_constant'],
+                                                 order=lock_in.get('filter_order', 4),
+                                                 output_rate=lock_in.get('output_rate', None),
+                                                 channels=len(ai_channels), reference_phase=-90)  # relative to sine
+        except:
+            self.logger.error("Error occurred while reading lock_in config values")
+            return
+        if self.instrument.active_profile != 'lock_in':
+            self._previous_profile = self.instrument.active_profile
+            self.instrument.apply_profile('lock_in')
+        self.instrument.update_analog_out({ao_channel: {'function': self.instrument.ao.FUNC.SINE, 'offset': 0.0,
+                                                        'amplitude': lock_in['amplitude'],
+                                                        'frequency': lock_in['frequency'], 'phase': 0.0}})
+        return True
+
+    def stop_reference(self):
+        """
+        Stop the reference sine (the analog out channel is set to 0V DC) and restore the previous acquisition profile.
+        """
+        channels = self._channels()
+        if channels is None:
+            return
+        self.instrument.update_analog_out({channels[0]: {'function': self.instrument.ao.FUNC.DC, 'offset': 0.0}})
+        if self._previous_profile is not None:
+            self.instrument.apply_profile(self._previous_profile)
+            self._previous_profile = None
+
+    def _demodulate(self):
+        """
+        Acquire and demodulate one block.
+        The phase of the output is relative to the reference channel (if used) and the amplitude of the reference
+        channel is stored in self.reference_amplitude.
+
+        :return: times (s) and X + iY of the signal (V rms) (or None's in case of read timeout)
+        :rtype: numpy.ndarray, numpy.ndarray
+        """
+        block = self.instrument.read_analog_block()
+        if block is None:
+            return None, None
+        ai_channels = self._channels()[1]
+        t, z = self.demodulator.demodulate(block[ai_channels])
+        if len(ai_channels) == 1:
+            return t, z[0]
+        reference = np.abs(z[1])
+        if len(reference):
+            self.reference_amplitude = reference[-1]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return t, z[0] * np.conj(z[1]) / reference
+
+    def measure(self, duration, settle=True):
+        """
+        Measure the output of the lock-in for some time. The reference should be started with start_reference().
+
+        :param duration: measurement time (s)
+        :type duration: float
+        :param settle: first wait for the filter to settle, 'settle' time constants from properties (default: True)
+        :type settle: bool
+        :return: times (s), X, Y, R (V rms), theta (degrees), and the R of the reference channel (V rms) (None if no
+                 block could be read)
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        if self.demodulator is None:
+            self.logger.error('start the reference first (start_reference())')
+            return
+        lock_in = self.properties['lock_in']
+        start = self.demodulator.sample_index / self.demodulator.sample_rate
+        if settle:
+            start += lock_in.get('settle', 10) * lock_in['time_constant']
+        times, outputs, reference = [], [], []
+        while self.demodulator.sample_index / self.demodulator.sample_rate < start + duration:
+            t, z = self._demodulate()
+            if t is None:
+                break
+            keep = t >= start
+            times.append(t[keep])
+            outputs.append(z[keep])
+            reference.append(np.full(keep.sum(), self.reference_amplitude))
+        if not times:
+            self.logger.error('measurement failed: no data was read')
+            return
+        t, z, reference = np.concatenate(times), np.concatenate(outputs), np.concatenate(reference)
+        return t, z.real, z.imag, np.abs(z), np.degrees(np.angle(z)), reference
+
+    def _monitor_loop(self):
+        """
+        Called by GUI Monitor to start the monitor loop.
+        Not intended to be called from Operator. (Which should be blocked)
+        It starts the reference and keeps the last 'monitor_points' output samples in self.lock_in_time, self.lock_in_x,
+        self.lock_in_y, self.lock_in_r and self.lock_in_theta.
+        """
+        # First check if monitor is allowed to start
+        if self._busy or not self._allow_monitor:
+            self.logger.warning('Monitor should only be run from GUI and not while Operator is busy')
+            return
+        if not self.start_reference():
+            return
+        points = self.properties['lock_in'].get('monitor_points', 1000)
+        self.lock_in_time = np.full(points, np.nan)
+        self.lock_in_x, self.lock_in_y = np.full(points, np.nan), np.full(points, np.nan)
+        self.lock_in_r, self.lock_in_theta = np.full(points, np.nan), np.full(points, np.nan)
+        self._busy = True  # set flag to indicate operator is busy
+        try:
+            while not self._stop:
+                t, z = self._demodulate()
+                if t is None or not len(t):
+                    continue
+                t, z = t[-points:], z[-points:]
+                m = len(t)
+                for buffer, new in ((self.lock_in_time, t), (self.lock_in_x, z.real), (self.lock_in_y, z.imag),
+                                    (self.lock_in_r, np.abs(z)), (self.lock_in_theta, np.degrees(np.angle(z)))):
+                    # shift the buffers in place and add the new samples at the end
+                    buffer[:-m] = buffer[m:]
+                    buffer[-m:] = new
+                self._new_monitor_data = True
+        finally:  # also if an exception occurred, stop the reference and release the operator
+            self.stop_reference()
+            self._stop = False  # reset stop flag to false
+            self._busy = False  # indicate the operator is not busy anymore
+
+    def do_scan(self, param=None):
+        """
+        Measure the frequency response (Bode plot) of the device: the reference frequency is swept logarithmically from
+        'start' to 'stop' (Hz) in 'points' steps. At each frequency the output is averaged for 'integration_time' (after
+        settling of the filter).
+        The gain is the R of the signal divided by the R of the reference channel (or by the rms value of the analog out
+        if no reference channel is used, in which case the phase is arbitrary).
+        This method can be run from a GUI, from command line or other script.
+
+        :param param: optional dictionary of parameters that will used to update the scan parameters
+        :type param: dict
+        :return: the frequencies (Hz), gains and phases (degrees)
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        if self._busy:
+            self.logger.error('Scan should not be started while Operator is busy.')
+            return
+        if 'scan' not in self.properties:
+            self.logger.error("The config file or properties dict should contain 'scan' section.")
+            return
+        if type(param) is dict:
+            self.logger.info('Updating scan properties with supplied parameters dictionary.')
+            self.properties['scan'].update(param)
+        scan_properties = self.properties['scan']
+        try:
+            frequencies = np.geomspace(scan_properties['start'], scan_properties['stop'], int(scan_properties['points']))
+            integration_time = scan_properties.get('integration_time', 0.1)
+        except:
+            self.logger.error("Error occurred while reading scan config values")
+            return
+        self.scan_frequencies = []
+        self.scan_x, self.scan_y = [], []
+        self.scan_gain, self.scan_phase = [], []
+
+        self._busy = True  # indicate that operator is busy
+        try:
+            for frequency in frequencies:
+                if not self.start_reference(frequency):
+                    break
+                result = self.measure(integration_time)
+                if result is None:
+                    break
+                t, x, y, r, theta, reference = result
+                # average X and Y (rather than R and theta, which are biased by noise)
+                z = np.nanmean(x + 1j * y)
+                if len(self._channels()[1]) == 1:
+                    reference = self.properties['lock_in']['amplitude'] / np.sqrt(2)
+                self.scan_frequencies.append(frequency)
+                self.scan_x.append(z.real)
+                self.scan_y.append(z.imag)
+                self.scan_gain.append(np.abs(z) / np.nanmean(reference))
+                self.scan_phase.append(np.degrees(np.angle(z)))
+
+                # The remainder of the loop adds functionality to plot data and pause and stop the scan when it's run from a gui:
+                self._new_scan_data = True
+                # before the end of the loop: halt if pause is True
+                while self._pause:
+                    sleep(0.05)
+                    if self._stop: break
+                # if (soft) stop was requested, break out of loop
+                if self._stop:
+                    break
+        finally:  # also if an exception occurred, stop the reference and release the operator
+            self.stop_reference()
+            self._stop = False  # reset stop flag to false
+            self._busy = False  # indicate operator is not busy anymore
+            self._pause = False
+
+        return np.array(self.scan_frequencies), np.array(self.scan_gain), np.array(self.scan_phase)
+
+    def verify_simulated(self, param=None):
+        """
+        Verify the gain and phase accuracy with a simulated device (SimulatedDfwController): do a frequency sweep and
+        compare it with the gain and phase of the simulated device under test (DeviceUnderTest.gain_and_phase()).
+
+        :param param: optional dictionary of parameters that will used to update the scan parameters
+        :type param: dict
+        :return: the frequencies (Hz), relative gain errors and phase errors (degrees) (None if not simulated)
+        :rtype: numpy.ndarray, numpy.ndarray, numpy.ndarray
+        """
+        simulator = getattr(self.instrument, 'simulator', None)
+        if simulator is None:
+            self.logger.error('verify_simulated() requires a simulated device')
+            return
+        result = self.do_scan(param)
+        if result is None:
+            return
+        frequencies, gain, phase = result
+        ao_channel, ai_channels = self._channels()
+        sample_rate = self.properties['lock_in']['sample_rate']
+        expected = [[simulator.dut.gain_and_phase(ch, ao_channel, f, sample_rate) for f in frequencies]
+                    for ch in ai_channels]
+        expected_gain, expected_phase = np.transpose(expected[0])
+        if len(ai_channels) == 2:
+            expected_gain = expected_gain / np.transpose(expected[1])[0]
+            expected_phase = expected_phase - np.transpose(expected[1])[1]
+        gain_error = gain / expected_gain - 1
+        phase_error = (phase - expected_phase + 180) % 360 - 180
+        self.logger.info(f'largest gain error: {np.abs(gain_error).max():.2%}')
+        if len(ai_channels) == 1:
+            self.logger.warning('without reference channel the phase is arbitrary, only the gain is verified')
+            phase_error[:] = np.nan
+        else:
+            self.logger.info(f'largest phase error: {np.abs(phase_error).max():.2f} degrees')
+        return frequencies, gain_error, phase_error
+
+    def save_scan(self, filename, metadata=None, store_conf=False, append=False):
+        """
+        Store the frequency response in xarray Dataset and save to netCDF4 file.
+        Optional metadata can be passed as a dict. Note that the keys should be strings and the values should be numbers or strings.
+        Optionally stores the entire Operator properties dictionary to a yaml file of the same name.
+
+        :param filename: full path and filename
+        :type filename: str
+        :param metadata: optional additional data to store (default: None)
+        :type metadata: dict
+        :param store_conf: store Operator properties in yaml file (default: False)
+        :type store_conf: bool
+        :param append: append the scan as new run to a container file (see labphew.data.container) (default: False)
+        :type append: bool
+        """
+        if not hasattr(self, 'scan_frequencies'):
+            self.logger.warning('no data to save yet')
+            return
+        if os.path.exists(filename) and not append:
+            self.logger.warning('overwriting existing file: {}'.format(filename))
+        self.logger.debug('Saving data')
+        data = xr.Dataset(
+            coords={
+                "frequency": (["frequency"], self.scan_frequencies, {"units": 'Hz'})
+            },
+            data_vars={
+                "x": (["frequency"], self.scan_x, {"units": 'V'}),
+                "y": (["frequency"], self.scan_y, {"units": 'V'}),
+                "gain": (["frequency"], self.scan_gain),
+                "phase": (["frequency"], self.scan_phase, {"units": 'degrees'}),
+            },
+            attrs={
+                "time": datetime.now().strftime('%d-%m-%YT%H:%M:%S'),
+            }
+        )
+        for key in ['user', 'config_file']:
+            if key in self.properties:
+                data.attrs[key] = self.properties[key]
+        # Add all numeric and string keys of the lock-in and scan settings
+        for section in ['lock_in', 'scan']:
+            for key, value in self.properties.get(section, {}).items():
+                if isinstance(value, (int, float, bool, str)):
+                    data.attrs[key] = int(value) if isinstance(value, bool) else value  # netCDF can't store booleans
+        if type(metadata) is dict:
+            data.attrs.update(metadata)  # add the optional metadata to the Dataset attributes
+        self.data = data
+        self.write_dataset(filename, data, append)
+
+        if store_conf:
+            try:
+                self.logger.info('Storing Operator properties in yaml file')
+                yml_fname = os.path.splitext(filename)[0] + '.yml'
+                with open(yml_fname, 'w') as f:
+                    yaml.safe_dump(self.properties, f)
+            except:
+                self.logger.warning('An error occurred while trying to save Operator properties to yaml file')
+
+    def disconnect_devices(self):
+        """
+        Close connection to all instruments/devices used by this operator.
+        (Note that this method will get called when exiting a python with block)
+        """
+        # The WaveForms controller does not have a disconnect, but a shared device (see open_device()) is released.
+        self.logger.info('Disconnecting from device(s)')
+        if isinstance(self.instrument, DeviceHandle):
+            self.instrument.release()
+
+    def load_config(self, filename=None):
+        """
+        If specified, this function loads the configuration file to generate the properties of the lock-in.
+
+        :param filename: Path to the filename. Defaults to lock_in_config.yml in labphew.core.defaults
+        :type filename: str
+        """
+        if filename and not os.path.isfile(filename):
+            self.logger.error('Config file not found: {}, falling back to default'.format(filename))
+            filename = None
+
+        if filename is None:
+            filename = os.path.join(labphew.package_path, 'core', 'defaults', 'lock_in_config.yml')
+        with open(filename, 'r') as f:
+            self.properties.update(yaml.safe_load(f))
+        self.properties['config_file'] = filename
+
+
+if __name__ == "__main__":
+    import labphew   # import this to use labphew style logging (by importing it before matplotlib it also prevents matplotlib from printing many debugs)
+    import matplotlib.pyplot as plt
+
+    # To import the actual device (connect W1 to 1+ as reference, and the output of your device to 2+):
+    # from labphew.controller.digilent.waveforms import DfwController
+
+    # To import a simulated device:
+    from labphew.controller.digilent.waveforms import SimulatedDfwController as DfwController
+    from labphew.controller.digilent.simulation import DeviceUnderTest
+
+    # W1 is connected to 1+ (the reference) and to a low-pass filter (and attenuator) whose output is connected to 2+
+    dut = DeviceUnderTest(coupling=[[1, 0], [0.5, 0]], bandwidth=[None, 1000], noise_density=[1e-5, 2e-5])
+    instrument = DfwController(dut=dut)
+
+    opr = LockInOperator(instrument)
+    opr.load_config()
+
+    frequencies, gain_error, phase_error = opr.verify_simulated()
+    print(f'gain error < {np.abs(gain_error).max():.2%}, phase error < {np.abs(phase_error).max():.2f} degrees')
+
+    fig, (ax1, ax2) = plt.subplots(2, sharex=True)
+    ax1.loglog(opr.scan_frequencies, opr.scan_gain)
+    ax2.semilogx(opr.scan_frequencies, opr.scan_phase)
+    ax2.set_xlabel('frequency (Hz)')
+    plt.show()
@@ -6,11 +6,15 @@ This module contains 2 classes which are intended to work with a specific Operat
 labphew.model.analog_discovery_2_model.Operator )
 
 MonitorWindow class is used to display continuous stream of live data from the Digilent Analog Discovery 2.
+Panning or zooming the plots shows the (multi-resolution) history of the monitor.
 All the processes that are not relating to user interaction are handled by the Operator class in the model folder.
 
 ScanWindow class is used to control and visualize a specific scan defined in the Operator. Note that scan itself is
 performed in the Operator and the ScanWindow is only used to modify parameters, start/stop and visualize data.
 
+SpectrumMonitorWindow is a variant of the MonitorWindow that displays continuously updated noise spectra.
+ScopeWindow is a variant of the MonitorWindow that displays triggered frames on top of a persistence display.
+
 These Windows may be run separately, but it's also possible to add the ScanWindow (or multiple ScanWindows) to the
 MonitorWindow.
 
@@ -25,8 +29,10 @@ from PyQt5.QtGui import QIcon
 import labphew
 import logging
 import os
-from time import time
-from labphew.core.tools.gui_tools import set_spinbox_stepsize, ValueLabelItem, SaverWidget, ModifyConfig, fit_on_screen
+from time import time, process_time
+import numpy as np
+from labphew.core.tools.gui_tools import set_spinbox_stepsize, ValueLabelItem, SaverWidget, ModifyConfig, fit_on_screen, \
+    DecimatedCurve
 from labphew.core.base.general_worker import WorkThread
 from labphew.core.base.view_base import MonitorWindowBase, ScanWindowBase
 
@@ -142,7 +148,7 @@ class MonitorWindow(MonitorWindowBase):
         self.plot1 = self.graph_win.addPlot()
         self.plot1.setLabel('bottom', 'time', units='s')
         self.plot1.setLabel('left', 'voltage', units='V')
-        self.curve1 = self.plot1.plot(pen='y')
+        self.curve1 = DecimatedCurve(self.plot1, pen='y')
         text_update_time = self.operator.properties['monitor']['text_update_time']
         self.label_1 = ValueLabelItem('--', color='y', siPrefix=True, suffix='V', siPrecision=4,
                                       averageTime=text_update_time, textUpdateTime=text_update_time)
@@ -152,7 +158,7 @@ class MonitorWindow(MonitorWindowBase):
         self.plot2 = self.graph_win.addPlot()
         self.plot2.setLabel('bottom', 'time', units='s')
         self.plot2.setLabel('left', 'voltage', units='V')
-        self.curve2 = self.plot2.plot(pen='c')
+        self.curve2 = DecimatedCurve(self.plot2, pen='c')
         self.label_2 = ValueLabelItem('--', color='c', siPrefix=True, suffix='V', siPrecision=4,
                                       averageTime=text_update_time, textUpdateTime=text_update_time)
         self.graph_win.addItem(self.label_2)
@@ -175,6 +181,10 @@ class MonitorWindow(MonitorWindowBase):
         self.plot2.setXRange(left, 0)
         self.plot1.enableAutoRange()
         self.plot2.enableAutoRange()
+        # Panning or zooming (which switches off auto range) shows the history of the monitor, see plot_history()
+        self.plot2.setXLink(self.plot1)
+        self.plot1.sigXRangeChanged.connect(self.plot_history)
+        self._plotting_history = False
 
 
     def apply_properties(self):
@@ -298,8 +308,12 @@ class MonitorWindow(MonitorWindowBase):
         """
         if self.operator._new_monitor_data:
             self.operator._new_monitor_data = False
-            self.curve1.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_1)
-            self.curve2.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_2)
+            if self.plot1.getViewBox().autoRangeEnabled()[0]:
+                # following the live data
+                self.curve1.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_1)
+                self.curve2.setData(self.operator.analog_monitor_time, self.operator.analog_monitor_2)
+            elif self.plot1.getViewBox().viewRange()[0][1] >= self.operator.analog_monitor_time[0]:
+                self.plot_history()  # the visible part of the history includes recent data
             self.label_1.setValue(self.operator.analog_monitor_1[-1])
             self.label_2.setValue(self.operator.analog_monitor_2[-1])
 
@@ -309,6 +323,36 @@ class MonitorWindow(MonitorWindowBase):
             self.plot_points_spinbox.setEnabled(True)
             self.start_button.setEnabled(True)
 
+    def plot_history(self):
+        """
+        Called when the visible time range changes (by panning or zooming, which switches off auto range).
+        Plots the visible range of the history of the monitor (see Operator.monitor_history), at the resolution that fits
+        the width of the plot. At the aggregated levels every block of samples is drawn as a vertical line from its
+        minimum to its maximum, so peaks remain visible. Press the auto range button ('A') to follow the live data again.
+        """
+        history = getattr(self.operator, 'monitor_history', None)
+        view_box = self.plot1.getViewBox()
+        if history is None or self._plotting_history or view_box.autoRangeEnabled()[0]:
+            return
+        self._plotting_history = True
+        start, stop = view_box.viewRange()[0]
+        margin = 0.1 * (stop - start)  # a bit more than the visible range, so small pans don't show gaps
+        pixels = max(int(view_box.width()), 100)
+        data = history.query(start - margin, stop + margin, max_points=int(1.2 * pixels))
+        if data['level'] == 0:
+            t, values = data['time'], data['mean']
+        else:
+            t = np.repeat(data['time'], 2)
+            values = np.empty((len(t), history.channels))
+            values[0::2], values[1::2] = data['min'], data['max']
+        self.curve1.setData(t, values[:, 0])
+        self.curve2.setData(t, values[:, 1])
+        if data['level'] == 0:
+            self.statusBar().showMessage(f"history: {len(data['time'])} samples")
+        else:
+            self.statusBar().showMessage(f"history: {len(data['time'])} blocks of {data['factor']} samples")
+        self._plotting_history = False
+
     def closeEvent(self, event):
         """ Gets called when the window is closed. Could be used to do some cleanup before closing. """
 
@@ -327,6 +371,209 @@ class MonitorWindow(MonitorWindowBase):
         event.accept()
 
 
+class SpectrumMonitorWindow(MonitorWindow):
+    """
+    Variant of the MonitorWindow that displays the noise spectra (amplitude spectral density) of both analog in
+    channels, continuously updated by Operator._spectrum_loop(). The status bar reports the update rate and the CPU
+    usage of the process.
+    """
+    def __init__(self, operator, parent=None):
+        """
+        Creates the spectrum monitor window.
+
+        :param operator: The operator
+        :type operator: labphew operator instance
+        :param parent: Optional parent GUI
+        :type parent: QWidget
+        """
+        super().__init__(operator, parent)
+        self.setWindowTitle('Analog Discovery 2 Spectrum')
+        self.monitor_thread = WorkThread(self.operator._spectrum_loop)
+        self._rate_time = time()
+        self._rate_cpu_time = process_time()
+        self._rate_updates = 0
+
+    def set_UI(self):
+        """ Uses the user-interface of the MonitorWindow, with logarithmic spectrum plots """
+        super().set_UI()
+        self.setWindowTitle('Digilent AD2 Spectrum')
+        # time step, plot points and the monitor history don't apply to the spectrum monitor
+        self.time_step_spinbox.setEnabled(False)
+        self.plot_points_spinbox.setEnabled(False)
+        self.plot1.sigXRangeChanged.disconnect(self.plot_history)
+        for plot, label in [(self.plot1, self.label_1), (self.plot2, self.label_2)]:
+            plot.setLabel('bottom', 'frequency', units='Hz')
+            plot.setLabel('left', 'amplitude spectral density (V/\u221aHz)')
+            plot.setLogMode(x=True, y=True)
+            plot.enableAutoRange()
+            label._ValueLabel.suffix = 'V rms'  # the labels show the rms value of the spectrum
+
+    def start_monitor(self):
+        """
+        Called when start button is pressed.
+        Starts the spectrum monitor (thread and timer) and disables some gui elements
+        """
+        if self.operator._busy:
+            self.logger.debug("Operator is busy")
+            return
+        self.logger.debug('Starting spectrum monitor')
+        self.operator._allow_monitor = True  # enable operator monitor loop to run
+        self.monitor_thread.start()  # start the operator spectrum monitor
+        self.monitor_timer.start(int(self.operator.properties['spectrum']['gui_refresh_time'] * 1000))
+        self.start_button.setEnabled(False)
+        self._rate_time = time()
+        self._rate_cpu_time = process_time()
+        self._rate_updates = self.operator.spectrum_updates
+
+    def stop_monitor(self):
+        """
+        Called when stop button is pressed. Stops the spectrum monitor (see MonitorWindow.stop_monitor()).
+        """
+        if not self.monitor_thread.isRunning():
+            self.logger.debug('Monitor is not running')
+            return
+        self.logger.debug('Stopping spectrum monitor')
+        self.operator._stop = True
+        self.monitor_thread.stop(self.operator.properties['spectrum']['stop_timeout'])
+        self.operator._allow_monitor = False  # disable monitor again
+        self.operator._busy = False  # Reset in case the monitor was not stopped gracefully, but forcefully stopped
+
+    def update_monitor(self):
+        """
+        Checks if a new spectrum is available and updates the graphs and the status bar.
+        Checks if thread is still running and if not: stops timer and reset gui elements
+        (called by timer)
+        """
+        if self.operator._new_spectrum_data:
+            self.operator._new_spectrum_data = False
+            spectrum = self.operator.spectrum
+            asd = np.sqrt(spectrum.psd[:, 1:])  # skip 0 Hz, which can't be displayed on a log scale
+            self.curve1.setData(spectrum.frequencies[1:], asd[0])
+            self.curve2.setData(spectrum.frequencies[1:], asd[1])
+            rms = spectrum.rms(spectrum.frequencies[1])
+            self.label_1.setValue(rms[0])
+            self.label_2.setValue(rms[1])
+
+        now = time()
+        if now - self._rate_time >= 1:
+            cpu_time = process_time()
+            rate = (self.operator.spectrum_updates - self._rate_updates) / (now - self._rate_time)
+            cpu = 100 * (cpu_time - self._rate_cpu_time) / (now - self._rate_time)
+            self.statusBar().showMessage(f'{rate:.1f} updates/s, CPU {cpu:.0f}%')
+            self._rate_time, self._rate_cpu_time = now, cpu_time
+            self._rate_updates = self.operator.spectrum_updates
+
+        if self.monitor_thread.isFinished():
+            self.logger.debug('Spectrum monitor thread is finished')
+            self.monitor_timer.stop()
+            self.start_button.setEnabled(True)
+
+
+class ScopeWindow(MonitorWindow):
+    """
+    Variant of the MonitorWindow that works like an oscilloscope: it displays the last triggered frame of both analog in
+    channels, captured by Operator._scope_loop(), on top of a persistence display (a histogram of all frames). The
+    status bar reports the number of captures per second.
+    """
+    def __init__(self, operator, parent=None):
+        """
+        Creates the scope window.
+
+        :param operator: The operator
+        :type operator: labphew operator instance
+        :param parent: Optional parent GUI
+        :type parent: QWidget
+        """
+        super().__init__(operator, parent)
+        self.setWindowTitle('Analog Discovery 2 Scope')
+        self.monitor_thread = WorkThread(self.operator._scope_loop)
+        self._rate_time = time()
+        self._rate_captures = 0
+
+    def set_UI(self):
+        """ Uses the user-interface of the MonitorWindow, with persistence images behind the curves """
+        super().set_UI()
+        self.setWindowTitle('Digilent AD2 Scope')
+        # time step, plot points and the monitor history don't apply to the scope
+        self.time_step_spinbox.setEnabled(False)
+        self.plot_points_spinbox.setEnabled(False)
+        self.plot1.sigXRangeChanged.disconnect(self.plot_history)
+        scope = self.operator.properties['scope']
+        duration = scope['frame_size'] / scope['frequency']
+        scope_range = scope.get('range', 50.0)  # same default as the model uses for the ADC range
+        lookup_table = pg.ColorMap([0, 0.5, 1], [(0, 0, 0), (0, 90, 200), (255, 255, 255)]).getLookupTable(0, 1, 256)
+        self.images = []
+        for plot, label in [(self.plot1, self.label_1), (self.plot2, self.label_2)]:
+            image = pg.ImageItem()
+            image.setLookupTable(lookup_table)
+            image.setZValue(-1)  # behind the curve of the last frame
+            image.setRect(pg.QtCore.QRectF(-scope.get('trigger_position', 0.5) * duration, -scope_range / 2,
+                                           duration, scope_range))
+            plot.addItem(image)
+            plot.setLabel('bottom', 'time after trigger', units='s')
+            plot.setXRange(-scope.get('trigger_position', 0.5) * duration,
+                           (1 - scope.get('trigger_position', 0.5)) * duration)
+            plot.setYRange(-scope_range / 2, scope_range / 2)
+            label._ValueLabel.suffix = 'Vpp'  # the labels show the peak to peak value of the last frame
+            self.images.append(image)
+
+    def start_monitor(self):
+        """
+        Called when start button is pressed.
+        Starts the scope (thread and timer) and disables some gui elements
+        """
+        if self.operator._busy:
+            self.logger.debug("Operator is busy")
+            return
+        self.logger.debug('Starting scope')
+        self.operator._allow_monitor = True  # enable operator monitor loop to run
+        self.monitor_thread.start()  # start the operator scope loop
+        self.monitor_timer.start(int(self.operator.properties['scope']['gui_refresh_time'] * 1000))
+        self.start_button.setEnabled(False)
+        self._rate_time = time()
+        self._rate_captures = 0
+
+    def stop_monitor(self):
+        """
+        Called when stop button is pressed. Stops the scope (see MonitorWindow.stop_monitor()).
+        """
+        if not self.monitor_thread.isRunning():
+            self.logger.debug('Monitor is not running')
+            return
+        self.logger.debug('Stopping scope')
+        self.operator._stop = True
+        self.monitor_thread.stop(self.operator.properties['scope']['stop_timeout'])
+        self.operator._allow_monitor = False  # disable monitor again
+        self.operator._busy = False  # Reset in case the monitor was not stopped gracefully, but forcefully stopped
+
+    def update_monitor(self):
+        """
+        Checks if a new frame is available and updates the graphs and the status bar.
+        Checks if thread is still running and if not: stops timer and reset gui elements
+        (called by timer)
+        """
+        if self.operator._new_scope_data:
+            self.operator._new_scope_data = False
+            frame = self.operator.scope_frame
+            for ch, (curve, label, image) in enumerate([(self.curve1, self.label_1, self.images[0]),
+                                                        (self.curve2, self.label_2, self.images[1])]):
+                image.setImage(self.operator.persistence[ch].image(), autoLevels=False, levels=(0, 1))
+                curve.setData(self.operator.scope_time, frame[ch])
+                label.setValue(np.ptp(frame[ch]))
+
+        now = time()
+        if now - self._rate_time >= 1:
+            rate = (self.operator.scope_captures - self._rate_captures) / (now - self._rate_time)
+            self.statusBar().showMessage(f'{rate:.0f} captures/s ({rate * 60:.0f} per minute)')
+            self._rate_time = now
+            self._rate_captures = self.operator.scope_captures
+
+        if self.monitor_thread.isFinished():
+            self.logger.debug('Scope thread is finished')
+            self.monitor_timer.stop()
+            self.start_button.setEnabled(True)
+
+
 class ScanWindow(ScanWindowBase):
     def __init__(self, operator, scan_name='scan', parent=None):
         self.logger = logging.getLogger(__name__)
@@ -413,7 +660,8 @@ class ScanWindow(ScanWindowBase):
         self.graph_win = pg.GraphicsWindow()
         self.graph_win.resize(1000, 600)
         self.plot1 = self.graph_win.addPlot()
-        self.curve1 = self.plot1.plot(pen='y')
+        self.curve_run = DecimatedCurve(self.plot1, pen=(255, 255, 0, 80))  # the current run of a repeated scan
+        self.curve1 = DecimatedCurve(self.plot1, pen='y')
 
         # Add an empty widget at the bottom of the control layout to make layout nicer
         dummy = QWidget()
@@ -571,7 +819,16 @@ class ScanWindow(ScanWindowBase):
         """
         if self.operator._new_scan_data:
             self.operator._new_scan_data = False
-            self.curve1.setData(self.operator.scan_voltages, self.operator.measured_voltages)
+            stats = self.operator.scan_statistics
+            if stats is None:
+                self.curve1.setData(self.operator.scan_voltages, self.operator.measured_voltages)
+                self.curve_run.setData([], [])  # remove the last run of a previous repeated scan
+            else:
+                # repeated scan: plot the converging mean and the current run
+                measured = stats.count > 0
+                self.curve1.setData(self.operator.voltages_to_scan[measured], stats.mean[measured])
+                self.curve_run.setData(self.operator.scan_voltages, self.operator.measured_voltages)
+                self.statusBar().showMessage(f'run {self.operator.scan_run + 1}')
         if self.scan_thread.isFinished():
             self.logger.debug('Scan thread is finished')
             self.scan_timer.stop()
@@ -598,13 +855,14 @@ if __name__ == "__main__":
     from PyQt5.QtWidgets import QApplication
     from labphew.model.analog_discovery_2_model import Operator
 
+    from labphew.controller.digilent.waveforms import open_device
+
+    # open_device() returns a handle to a device that is shared with other operators/windows (in this process)
     # To use with real device
-    # from labphew.controller.digilent.waveforms import DfwController
+    # instrument = open_device()
 
     # To test with simulated device
-    from labphew.controller.digilent.waveforms import SimulatedDfwController as DfwController
-
-    instrument = DfwController()
+    instrument = open_device(simulated=True)
     opr = Operator(instrument)
     opr.load_config()
 